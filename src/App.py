@@ -1,11 +1,16 @@
 # Built-in imports
+import multiprocessing
+import multiprocessing.connection
 import os
+import sys
 
 # Project imports
 from src.Bot import BotClient
 from src.commands import GuideCommands, UtilityCommands, TaterCommands
+from src.data import Config
 # from src.repeating_tasks import GenshinTasks
 # from src.utils.ChatHandler import ChatHandler
+from src.utils import Sharding
 
 # External imports
 import discord
@@ -13,23 +18,76 @@ import discord
 # Get Discord token from the environment
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
-# Create intent
-intent = discord.Intents.default()
-intent.members = True
+# Sharding: total number of shards (Discord's recommendation if unset),
+# and how many processes to split them across (each process runs a contiguous range of shards)
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None
+SHARD_PROCESSES = int(os.getenv("SHARD_PROCESSES", "1"))
 
-# Create and start the client
-bot = BotClient(intents=intent)
+# Bot processes are fresh interpreters, like the training process (TensorFlow isn't fork-safe)
+CONTEXT = multiprocessing.get_context("spawn")
 
-# Register commands
-# NlpCommands.register_all(bot)
-UtilityCommands.register_all(bot)
-GuideCommands.register_all(bot)
-TaterCommands.register_all(bot)
 
-# Register NLP chat handler
-# bot.register_chat_handler(ChatHandler(bot))
+def run_bot(shard_ids=None, shard_count=None, identify_coordinator=None):
+    """
+    Create, set up and run a bot, blocks until it closes
 
-# Register repeating tasks
-# GenshinTasks.register_all(bot)
+    Args:
+        shard_ids (List[int]): shards run by this process, None for all of them
+        shard_count (int): total number of shards, None for Discord's recommendation
+        identify_coordinator (Sharding.IdentifyCoordinator): paces identifies with the other bot processes
+    """
+    # Each process exports its own metrics
+    if shard_ids is not None and Config.METRICS_TEXTFILE:
+        root, extension = os.path.splitext(Config.METRICS_TEXTFILE)
+        Config.METRICS_TEXTFILE = f"{root}.shards-{shard_ids[0]}-{shard_ids[-1]}{extension}"
 
-bot.run(BOT_TOKEN)
+    # Create intent
+    intent = discord.Intents.default()
+    intent.members = True
+
+    # Create and start the client
+    bot = BotClient(intents=intent, shard_ids=shard_ids, shard_count=shard_count, identify_coordinator=identify_coordinator)
+
+    # Register commands
+    # NlpCommands.register_all(bot)
+    UtilityCommands.register_all(bot)
+    GuideCommands.register_all(bot)
+    TaterCommands.register_all(bot)
+
+    # Register NLP chat handler
+    # bot.register_chat_handler(ChatHandler(bot))
+
+    # Register repeating tasks
+    # GenshinTasks.register_all(bot)
+
+    bot.run(BOT_TOKEN)
+
+
+def main():
+    if SHARD_PROCESSES <= 1:
+        run_bot(shard_count=SHARD_COUNT)
+        return
+
+    # Split the shards across processes, all processes must agree on the total
+    shard_count = SHARD_COUNT or Sharding.fetch_recommended_shard_count(BOT_TOKEN)
+    coordinator = Sharding.IdentifyCoordinator(CONTEXT)
+    processes = [CONTEXT.Process(target=run_bot, args=(shard_ids, shard_count, coordinator), name=f"shards-{shard_ids[0]}-{shard_ids[-1]}")
+                 for shard_ids in Sharding.split_shards(shard_count, SHARD_PROCESSES)]
+    for process in processes:
+        process.start()
+    BotClient.log(1, "Started {} bot processes for {} shards", len(processes), shard_count)
+
+    # A dead process leaves its guilds offline, stop everything so the platform restarts the whole bot
+    multiprocessing.connection.wait([process.sentinel for process in processes])
+    exit_code = next(process.exitcode for process in processes if process.exitcode is not None)
+    BotClient.log(3, "A bot process exited with code {}, stopping the others", exit_code)
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+    sys.exit(exit_code or 1)
+
+
+# Guarded so worker processes (spawned, they re-import this module) don't start another bot
+if __name__ == "__main__":
+    main()
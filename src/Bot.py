@@ -4,39 +4,118 @@ import time
 
 # Project imports
 from src.data import Config, Emoji
-from src.utils import TimeUtil, MoveMessageUtil
+from src.utils import MoveMessageUtil
+from src.utils.AttachmentRelay import AttachmentRelay
+from src.utils.ChannelCache import ChannelCache
+from src.utils.ExpiryScheduler import ExpiryScheduler
+from src.utils.LogWriter import LogWriter
+from src.utils.Metrics import Metrics
+from src.utils.SendScheduler import SendScheduler, PRIORITY_REPLY, PRIORITY_REACTION
+from src.utils.TaskScheduler import TaskScheduler
 
 # External imports
 import discord
 
 
 # Base client class
-class BotClient(discord.Client):
-    """ Custom Discord client """
+class BotClient(discord.AutoShardedClient):
+    """
+    Custom Discord client, runs as many shards as Discord recommends (or shard_count), or only shard_ids of them when
+    the shards are split across processes (see App.py). Every piece of state tied to a guild or channel (reaction
+    handlers, send queues, channel and guild rate limits) lives in the process running that guild's shard
+    """
 
-    def __init__(self, **options):
-        self.log(0, "Initializing bot...", print_footer=False)
+    # Shared by every client in the process, log is a static method
+    log_writer = LogWriter()
+
+    def __init__(self, identify_coordinator=None, **options):
+        """
+        Initialize the bot
+
+        Args:
+            identify_coordinator (IdentifyCoordinator): paces identifies with the other bot processes, None if this is the only one
+            **options (Any): discord.AutoShardedClient options, e.g. intents, shard_ids and shard_count
+        """
+        self.log(0, "Initializing bot...")
         super().__init__(**options)
+        self.identify_coordinator = identify_coordinator
 
-        # Command handlers
+        # Command handlers, in registration order
         self.command_handlers = []
+        # Dispatch index of {command or alias => command handler}
+        self.command_index = {}
 
-        # Dynamically-registered reaction handlers
-        self.reaction_handlers = []
+        # Dynamically-registered reaction handlers, {message id => {emoji => reaction handler}}
+        self.reaction_handlers = {}
+        # Fires on_timeout of reaction handlers when they expire
+        self.expiry_scheduler = ExpiryScheduler(self)
 
         # Chat handler
         self.chat_handler = None
         self.chat_enabled = False
-
-        self.log(0, " OK", print_header=False)
+        # NLP readiness, any of {"cold", "warming", "ready", "failed"}, the model loads in the background
+        self.nlp_state = "cold"
+        # Why warming up failed, shown to owners
+        self.nlp_error = None
+
+        # Channels resolved by id, without a REST call each time
+        self.channel_cache = ChannelCache(self)
+        # Copies attachments of relayed messages
+        self.attachment_relay = AttachmentRelay(self)
+        # Queues, prioritizes and paces outbound requests
+        self.send_scheduler = SendScheduler(self, concurrency=Config.SEND_CONCURRENCY)
+        # Runs repeating tasks on the bot's loop
+        self.task_scheduler = TaskScheduler(self)
+
+        # Latency histograms, counters and gauges
+        self.metrics = Metrics(self)
+
+        self.log(0, "Bot initialized!")
+
+    @property
+    def nlp_ready(self):
+        """ Whether the NLP model is loaded and chat messages can be answered """
+        return self.nlp_state == "ready"
+
+    async def start(self, *args, **kwargs):
+        """ Starts warming up NLP, metrics and repeating tasks in the background, then connects to Discord right away """
+        self.metrics.start()
+        self.task_scheduler.start()
+        if self.chat_handler is not None and self.nlp_state == "cold":
+            self.loop.create_task(self.chat_handler.warm_up())
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        """ Stops repeating tasks and NLP, and closes our own HTTP session along with the Discord connection """
+        self.task_scheduler.stop()
+        if self.chat_handler is not None:
+            await self.chat_handler.close()
+        await self.attachment_relay.close()
+        await super().close()
 
     #########################
     # DISCORD EVENT METHODS #
     #########################
 
+    async def before_identify_hook(self, shard_id, *, initial=False):
+        """ Called before each shard identifies, waits for our turn when other processes run the other shards """
+        if self.identify_coordinator is None:
+            await super().before_identify_hook(shard_id, initial=initial)
+            return
+        await self.identify_coordinator.wait()
+
+    async def on_shard_ready(self, shard_id):
+        self.log(1, "Shard {} is ready!", shard_id, shard=shard_id)
+
     async def on_ready(self):
-        """ Called when the Discord bot is online, sets bot status """
-        self.log(1, f"Bot is online! Hello (happy) world from {self.user}!")
+        """ Called when all shards of this process are online, sets bot status """
+        self.log(1, "Bot is online! Hello (happy) world from {} with shards {}!", self.user, sorted(self.shards), shard_count=self.shard_count)
+        # Without configured owners, owner-only commands belong to whoever owns the bot application
+        if not Config.OWNER_IDS:
+            application = await self.application_info()
+            members = application.team.members if application.team is not None else [application.owner]
+            Config.OWNER_IDS.update(member.id for member in members)
+            self.log(1, "No OWNER_IDS configured, owner-only commands are open to the application owner(s) {}", sorted(Config.OWNER_IDS))
         await self.change_presence(activity=discord.Activity(name="with your gold", type=1))
 
     async def on_message(self, message):
@@ -55,7 +134,8 @@ class BotClient(discord.Client):
         # Check if channel is in MOVE_FROM list
         if channel.id in Config.MOVE_FROM_CHANNELS:
             # Move message to target channel
-            await MoveMessageUtil.move_message(self, message)
+            with self.metrics.timer("stage_duration_seconds", stage="move_message"):
+                await MoveMessageUtil.move_message(self, message)
             return
         # Check if channel is whitelisted or DMs
         elif channel.id not in Config.ENABLED_CHANNELS and not isinstance(channel, discord.DMChannel):
@@ -63,11 +143,12 @@ class BotClient(discord.Client):
 
         # Prefix test
         if len(message.content) <= len(Config.BOT_PREFIX) or not message.content.startswith(Config.BOT_PREFIX):
-            # Test if chat is enabled and if message is in NLP-enabled channel
-            if self.chat_enabled and channel.id in Config.NLP_CHANNELS:
+            # Test if chat is enabled and if message is in NLP-enabled channel, stay silent while the model is warming up
+            if self.chat_enabled and self.nlp_ready and channel.id in Config.NLP_CHANNELS:
                 # Handle NLP
-                await self.chat_handler.on_message(author, message, channel, message.guild)
-                self.log(1, f"Chat message \"{message.content}\" received from {author.display_name}#{author.discriminator}!")
+                with self.metrics.timer("stage_duration_seconds", stage="chat"):
+                    await self.chat_handler.on_message(author, message, channel, message.guild)
+                self.log(1, "Chat message \"{}\" received from {}#{}!", message.content, author.display_name, author.discriminator, user=author.id, channel=channel.id)
 
             return
 
@@ -77,22 +158,36 @@ class BotClient(discord.Client):
         args = info[1:]
 
         # Log
-        self.log(1, f"Command \"{message.content}\" received from {author.display_name}#{author.discriminator}!")
+        self.log(1, "Command \"{}\" received from {}#{}!", message.content, author.display_name, author.discriminator, user=author.id, channel=channel.id)
 
-        # Find command handler in registered handlers
-        handler = None
-        for loop in self.command_handlers:
-            if command == loop.command or command in loop.aliases:
-                handler = loop
-                break
+        # Find command handler in the dispatch index
+        handler = self.get_command_handler(command)
 
         # Not found -- unknown command
         if handler is None:
+            self.metrics.increment("unknown_commands_total")
             await self.react_unknown(message)
             return
 
-        # Found -- fire handler
-        await handler.on_command(message.author, command, args, message, channel, message.guild)
+        # Found -- check flood protection before doing any work
+        if handler.rate_limiter is not None:
+            retry_after = handler.rate_limiter.check(author, channel, message.guild)
+            if retry_after:
+                self.metrics.increment("rate_limited_total", handler=handler.command)
+                await handler.on_rate_limited(author, retry_after, message, channel, message.guild)
+                return
+
+        # Fire handler
+        with self.metrics.timer("command_duration_seconds", command=handler.command):
+            await handler.on_command(message.author, command, args, message, channel, message.guild)
+
+    async def on_guild_channel_update(self, before, after):
+        """ Drop the cached copy of an updated channel, the next lookup gets the fresh one """
+        self.channel_cache.invalidate(after.id)
+
+    async def on_guild_channel_delete(self, channel):
+        """ Drop the cached copy of a deleted channel """
+        self.channel_cache.invalidate(channel.id)
 
     async def on_reaction_add(self, reaction, user):
         """
@@ -115,29 +210,23 @@ class BotClient(discord.Client):
         emoji = reaction.emoji  # any of {Emoji, str}
 
         # Find reaction handler in registered handlers
-        for a in range(len(self.reaction_handlers) - 1, 0 - 1, -1):
-            handler = self.reaction_handlers[a]
-
-            # Check if the reaction has expired
-            if time.time() > handler.expire_time:
-                # Fire on_timeout
-                await handler.on_timeout()
-                del self.reaction_handlers[a]
-                continue
+        handler = self.reaction_handlers.get(message.id, {}).get(emoji)
+        if handler is None:
+            return
+        self.unregister_reaction_handler(handler)
 
-            # Match message and reaction(s)
-            if message != handler.message or emoji not in handler.emojis:
-                continue
+        # Check if the reaction has expired but the expiry timer hasn't caught up yet
+        if time.time() > handler.expire_time:
+            # Fire on_timeout
+            await handler.on_timeout()
+            return
 
-            # Correct handler, fire on_react
+        # Correct handler, fire on_react
+        with self.metrics.timer("stage_duration_seconds", stage="reaction"):
             await handler.on_react(user, emoji)
-            del self.reaction_handlers[a]
-
-            # Log
-            self.log(1, f"Reaction \"{emoji}\" added by {user.display_name}#{user.discriminator} on \"{message.content}\"!")
 
-            # We're done here, return out of this method
-            return
+        # Log
+        self.log(1, "Reaction \"{}\" added by {}#{} on \"{}\"!", emoji, user.display_name, user.discriminator, message.content, user=user.id, message_id=message.id)
 
     ####################
     # LOGISTIC METHODS #
@@ -150,7 +239,27 @@ class BotClient(discord.Client):
         Args:
             handler (CommandHandler): command handler
         """
+        # Check every name first so a collision doesn't leave a half-registered handler behind
+        names = [handler.command] + list(handler.aliases)
+        for name in names:
+            assert name not in self.command_index, f"Command or alias \"{name}\" of {handler} is already taken by {self.command_index[name]}"
+        assert len(set(names)) == len(names), f"Duplicate command or alias in {handler}"
+
         self.command_handlers.append(handler)
+        for name in names:
+            self.command_index[name] = handler
+
+    def get_command_handler(self, command):
+        """
+        Find the command handler registered under a command name or alias
+
+        Args:
+            command (str): command name or alias
+
+        Returns:
+            Optional[CommandHandler]: command handler, None if the command is unknown
+        """
+        return self.command_index.get(command)
 
     def register_reaction_handler(self, handler):
         """
@@ -159,7 +268,27 @@ class BotClient(discord.Client):
         Args:
             handler (ReactionHandler): reaction handler
         """
-        self.reaction_handlers.append(handler)
+        emoji_handlers = self.reaction_handlers.setdefault(handler.message.id, {})
+        for emoji in handler.emojis:
+            emoji_handlers[emoji] = handler
+        self.expiry_scheduler.schedule(handler)
+
+    def unregister_reaction_handler(self, handler):
+        """
+        Remove a dynamic reaction handler from the bot, does nothing if it is no longer registered
+
+        Args:
+            handler (ReactionHandler): reaction handler
+        """
+        self.expiry_scheduler.discard(handler)
+        emoji_handlers = self.reaction_handlers.get(handler.message.id)
+        if emoji_handlers is None:
+            return
+        for emoji in handler.emojis:
+            if emoji_handlers.get(emoji) is handler:
+                del emoji_handlers[emoji]
+        if not emoji_handlers:
+            del self.reaction_handlers[handler.message.id]
 
     def register_chat_handler(self, handler):
         """
@@ -174,42 +303,49 @@ class BotClient(discord.Client):
     # EXPRESS ACTION METHODS #
     ##########################
 
-    @staticmethod
-    async def reply(reference, content=None, embedded=None, channel=None):
+    # Outbound requests go through the send scheduler, below PRIORITY_REPLY they are dropped (and return None) when too late
+
+    async def reply(self, reference, content=None, embedded=None, channel=None, priority=PRIORITY_REPLY, created_at=None):
         assert any([content, embedded]), "Must reply with one or more of {content (string), embedded (embedded message)}!"
         if channel is None:
             channel = reference.channel
-        return await channel.send(content=content, embed=embedded, reference=reference, mention_author=False)
+        return await self.send_scheduler.submit(channel, lambda: channel.send(content=content, embed=embedded, reference=reference, mention_author=False),
+                                                priority, "send", created_at)
 
-    @staticmethod
-    async def react_unknown(message):
-        await message.add_reaction(Emoji.QUESTION)
+    async def edit(self, message, priority=PRIORITY_REPLY, **fields):
+        # Only the latest state of a message matters, a queued edit is replaced by newer ones
+        return await self.send_scheduler.submit(message.channel, lambda: message.edit(**fields), priority, "edit", coalesce_key=("edit", message.id))
 
-    @staticmethod
-    async def react_check(message):
-        await message.add_reaction(Emoji.CHECK)
+    async def react(self, message, emoji, priority=PRIORITY_REACTION):
+        await self.send_scheduler.submit(message.channel, lambda: message.add_reaction(emoji), priority, "reaction", coalesce_key=("react", message.id, emoji))
 
-    @staticmethod
-    async def react_cross(message):
-        await message.add_reaction(Emoji.CROSS)
+    async def react_unknown(self, message):
+        await self.react(message, Emoji.QUESTION)
+
+    async def react_check(self, message):
+        await self.react(message, Emoji.CHECK)
+
+    async def react_cross(self, message):
+        await self.react(message, Emoji.CROSS)
 
     ###################
     # UTILITY METHODS #
     ###################
 
     @staticmethod
-    def log(level, message, print_header=True, print_footer=True):
+    def log(level, message, /, *args, **fields):
         """
-        Log `message` at level `level`, only logs messages more severe then LOG_THRESHOLD
+        Log `message` at level `level`, only logs messages more severe then LOG_THRESHOLD.
+        Never blocks: the record is queued and formatted and written by the log writer thread, so pass
+        values as args instead of building an f-string, e.g. log(1, "Command \"{}\" received", content)
 
         Args:
             level (int): log severity (see LOG_LEVEL in Config.py)
-            message (str): message to log
-            print_header (bool): set to True when continuously logging (such as progress)
-            print_footer (bool): set to True to not print new line at the end
+            message (str): message to log, str.format template when args are given
+            *args (Any): template arguments, only formatted if the record passes the threshold
+            **fields (Any): extra structured fields of the record, e.g. user=author.id, level and message are positional-only
+                            so fields can use those names too
         """
         if level < Config.LOG_THRESHOLD:
             return
-        header = f"[{Config.LOG_LEVELS[level]}] {TimeUtil.formatted_now()} >> " if print_header else ""
-        footer = "\n" if print_footer else ""
-        print(f"{header}{message}", end=footer)
+        BotClient.log_writer.submit(level, message, args, fields)
@@ -0,0 +1,389 @@
+# Built-in imports
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+
+# Project imports
+from src.Bot import BotClient
+from src.benchmarks import NlpBenchmark
+from src.commands import GuideCommands, NlpCommands, TaterCommands, UtilityCommands
+from src.data import Config
+from src.nlp import PrimitiveModel
+from src.utils.AttachmentRelay import AttachmentRelay
+from src.utils.ChatHandler import ChatHandler
+
+# External imports
+import discord
+import numpy as np
+
+# Fake Discord ids, far away from real snowflakes
+IDS = itertools.count(10 ** 6)
+
+# Guild channels the workload is sent to
+COMMAND_CHANNEL = next(iter(Config.ENABLED_CHANNELS - Config.NLP_CHANNELS), next(iter(Config.ENABLED_CHANNELS)))
+NLP_CHANNEL = next(iter(Config.NLP_CHANNELS))
+MOVE_FROM_CHANNEL = next(iter(Config.MOVE_FROM_CHANNELS))
+
+# Default workload, {scenario => (weight, channel kind, message content)}
+WORKLOAD = {
+    "help": (10, "command", f"{Config.BOT_PREFIX}help"),
+    "help ping": (5, "command", f"{Config.BOT_PREFIX}help ping"),
+    "ping": (10, "command", f"{Config.BOT_PREFIX}ping"),
+    "test": (5, "command", f"{Config.BOT_PREFIX}test"),
+    "guide": (10, "command", f"{Config.BOT_PREFIX}guide"),
+    "unknown": (5, "command", f"{Config.BOT_PREFIX}definitely-not-a-command"),
+    "intent list": (5, "command", f"{Config.BOT_PREFIX}intent list"),
+    "report": (5, "dm", f"{Config.BOT_PREFIX}report I ate too many strawberries!"),
+    "move": (5, "move", "please move this message"),
+    "chat": (40, "nlp", "how do i get more gold?"),
+}
+
+
+class FakeUser:
+    """ Stand-in for discord.Member / discord.User """
+
+    def __init__(self, bot=False):
+        self.id = next(IDS)
+        self.bot = bot
+        self.display_name = f"user{self.id}"
+        self.discriminator = "0000"
+        self.mention = f"<@{self.id}>"
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeAttachment:
+    """ Stand-in for discord.Attachment """
+
+    def __init__(self, filename, size):
+        self.filename = filename
+        self.size = size
+        self.url = f"https://cdn.invalid/{filename}"
+
+
+class FakeAttachmentRelay(AttachmentRelay):
+    """ Attachment relay whose downloads take a simulated latency instead of hitting the CDN """
+
+    def __init__(self, bot, harness):
+        super().__init__(bot)
+        self.harness = harness
+
+    async def download(self, attachment, fp):
+        await self.harness.simulate("download")
+        fp.write(bytes(attachment.size))
+
+
+class FakeMessage:
+    """ Stand-in for discord.Message, outbound calls sleep for a simulated latency """
+
+    def __init__(self, harness, channel, author, content="", attachments=()):
+        self.harness = harness
+        self.id = next(IDS)
+        self.channel = channel
+        self.guild = getattr(channel, "guild", None)
+        self.author = author
+        self.content = content
+        self.attachments = list(attachments)
+        self.reactions = []
+        self.created_at = datetime.datetime.utcnow()
+
+    async def add_reaction(self, emoji):
+        await self.harness.simulate("add_reaction")
+        self.reactions.append(emoji)
+
+    async def edit(self, **kwargs):
+        await self.harness.simulate("edit")
+
+    async def delete(self):
+        await self.harness.simulate("delete")
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content=content, reference=self, **kwargs)
+
+
+class FakeTextChannel:
+    """ Stand-in for discord.TextChannel """
+
+    def __init__(self, harness, channel_id):
+        self.harness = harness
+        self.id = channel_id
+        self.guild = None
+
+    async def send(self, content=None, **kwargs):
+        await self.harness.simulate("send")
+        return FakeMessage(self.harness, self, self.harness.bot_user, content or "")
+
+    async def trigger_typing(self):
+        await self.harness.simulate("trigger_typing")
+
+
+class FakeDMChannel(discord.DMChannel):
+    """ Stand-in for discord.DMChannel, subclassed so isinstance checks in the handlers still pass """
+
+    def __init__(self, harness):
+        self.harness = harness
+        self.id = next(IDS)
+        self.guild = None
+
+    send = FakeTextChannel.send
+    trigger_typing = FakeTextChannel.trigger_typing
+
+
+class FakeReaction:
+    """ Stand-in for discord.Reaction added on one of the bot's messages """
+
+    def __init__(self, message, emoji):
+        self.message = message
+        self.emoji = emoji
+        self.me = True
+
+
+class LoadTestBot(BotClient):
+    """ Bot client that never connects, channel fetches are served by the harness """
+
+    def __init__(self, harness, **options):
+        super().__init__(**options)
+        self.harness = harness
+        self.attachment_relay = FakeAttachmentRelay(self, harness)
+
+    @property
+    def latency(self):
+        return self.harness.latency
+
+    @property
+    def latencies(self):
+        return [(0, self.harness.latency)]
+
+    async def fetch_channel(self, channel_id):
+        await self.harness.simulate("fetch_channel")
+        return self.harness.get_channel(channel_id)
+
+
+class LoadHarness:
+    """ Drives BotClient event handlers with fake Discord objects and records throughput and latencies """
+
+    def __init__(self, latency=0.05, users=1000, attachments=0):
+        """
+        Initialize a harness, call setup inside the event loop before running
+
+        Args:
+            latency (float): mean simulated latency (seconds) of every outbound Discord call
+            users (int): number of distinct fake users sending messages
+            attachments (int): number of attachments on report and moved messages
+        """
+        self.latency = latency
+        self.users = [FakeUser() for _ in range(users)]
+        self.attachments = attachments
+        self.bot_user = FakeUser(bot=True)
+        self.bot = None
+        self.channels = {}
+
+        # Measurements, {scenario => [latencies (seconds)...]} and {outbound call => count}
+        self.latencies = {}
+        self.outbound = {}
+        self.loop_lags = []
+        self.errors = {}
+
+    async def simulate(self, call):
+        """ Pretend to make an outbound Discord call """
+        self.outbound[call] = self.outbound.get(call, 0) + 1
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    def get_channel(self, channel_id):
+        if channel_id not in self.channels:
+            self.channels[channel_id] = FakeTextChannel(self, channel_id)
+        return self.channels[channel_id]
+
+    def setup(self, nlp=False, scratch_directory=None):
+        """
+        Create the bot and register the real command modules, must be called inside the running event loop
+
+        Args:
+            nlp (bool): register the chat handler and serve the cached NLP model, or an untrained one if there is none
+            scratch_directory (str): directory for the utterance journal and dataset, so the load test never touches the real ones
+        """
+        self.bot = LoadTestBot(self)
+        self.bot._connection.user = self.bot_user
+        NlpCommands.register_all(self.bot)
+        UtilityCommands.register_all(self.bot)
+        GuideCommands.register_all(self.bot)
+        TaterCommands.register_all(self.bot)
+
+        if nlp:
+            if scratch_directory is not None:
+                PrimitiveModel.PATH_JOURNAL = os.path.join(scratch_directory, "intents.journal.jsonl")
+                PrimitiveModel.PATH_DATASET = os.path.join(scratch_directory, "dataset")
+
+            if not PrimitiveModel.load_cached():
+                # No trained model, serve random weights and answer every message so the chat path still sees load
+                PrimitiveModel.load_or_generate_data(force_generate=True, save_data=False)
+                NlpBenchmark.publish_untrained_model()
+                Config.NLP_CONFIDENCE_THRESHOLD = 0
+                print("No cached NLP model found, serving an untrained model that answers every chat message")
+            self.bot.register_chat_handler(ChatHandler(self.bot))
+            self.bot.chat_enabled = True
+            self.bot.nlp_state = "ready"
+
+    def create_message(self, kind, content):
+        author = random.choice(self.users)
+        if kind == "dm":
+            channel = FakeDMChannel(self)
+        else:
+            channel = self.get_channel({"command": COMMAND_CHANNEL, "nlp": NLP_CHANNEL, "move": MOVE_FROM_CHANNEL}[kind])
+        attachments = [FakeAttachment(f"file{i}.png", 1024) for i in range(self.attachments)] if kind in ("dm", "move") else []
+        return FakeMessage(self, channel, author, content, attachments)
+
+    async def timed(self, scenario, coroutine):
+        """ Await an event handler and record how long it took """
+        start = time.perf_counter()
+        try:
+            await coroutine
+        except Exception as e:
+            self.errors[f"{scenario}: {e!r}"] = self.errors.get(f"{scenario}: {e!r}", 0) + 1
+            return
+        self.latencies.setdefault(scenario, []).append(time.perf_counter() - start)
+
+    async def send_message(self, scenario, kind, content):
+        await self.timed(scenario, self.bot.on_message(self.create_message(kind, content)))
+
+    async def add_reaction(self):
+        """ React to a random message that has a registered reaction handler, like its author would """
+        if not self.bot.reaction_handlers:
+            return
+        emoji_handlers = random.choice(list(self.bot.reaction_handlers.values()))
+        emoji, handler = random.choice(list(emoji_handlers.items()))
+        await self.timed("reaction", self.bot.on_reaction_add(FakeReaction(handler.message, emoji), handler.author))
+
+    async def probe_loop_lag(self, interval=0.01):
+        """ Measure how late the event loop wakes up a sleeping task """
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lags.append(time.perf_counter() - start - interval)
+
+    async def run(self, workload, rate, reaction_rate, duration):
+        """
+        Fire events at Poisson arrival times, each event runs in its own task like discord.py dispatches them
+
+        Args:
+            workload (Dict[str, Tuple(int, str, str)]): {scenario => (weight, channel kind, message content)}
+            rate (float): messages per second
+            reaction_rate (float): reactions per second
+            duration (float): how long (seconds) to keep sending events
+
+        Returns:
+            Dict[str, Any]: report
+        """
+        loop = asyncio.get_event_loop()
+        scenarios = list(workload)
+        weights = [workload[scenario][0] for scenario in scenarios]
+        total_rate = rate + reaction_rate
+
+        probe = loop.create_task(self.probe_loop_lag())
+        tasks = []
+        sent = 0
+        start = time.perf_counter()
+        next_event = start
+        while next_event - start < duration:
+            next_event += random.expovariate(total_rate)
+            await asyncio.sleep(max(0.0, next_event - time.perf_counter()))
+            if random.random() < rate / total_rate:
+                scenario = random.choices(scenarios, weights)[0]
+                tasks.append(loop.create_task(self.send_message(scenario, *workload[scenario][1:])))
+                sent += 1
+            else:
+                tasks.append(loop.create_task(self.add_reaction()))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        probe.cancel()
+
+        completed = sum(len(samples) for scenario, samples in self.latencies.items() if scenario != "reaction")
+        return {
+            "offered_rate": rate,
+            "messages_sent": sent,
+            "messages_completed": completed,
+            "messages_per_second": completed / elapsed,
+            "reactions_completed": len(self.latencies.get("reaction", [])),
+            "elapsed_s": elapsed,
+            "loop_lag_ms": summarize(self.loop_lags),
+            "handlers_ms": {scenario: summarize(samples) for scenario, samples in sorted(self.latencies.items())},
+            "outbound_calls": self.outbound,
+            "reaction_handlers_left": len(self.bot.reaction_handlers),
+            "sends_dropped": sum(self.bot.metrics.counters.get("sends_dropped_total", {}).values()),
+            "errors": self.errors,
+        }
+
+
+def summarize(samples):
+    """ Latency summary in milliseconds """
+    if not samples:
+        return None
+    samples = np.array(samples) * 1000
+    return {"count": len(samples), "mean": float(samples.mean()), "p50": float(np.percentile(samples, 50)),
+            "p99": float(np.percentile(samples, 99)), "max": float(samples.max())}
+
+
+async def run_harness(args):
+    harness = LoadHarness(args.latency, args.users, args.attachments)
+    with tempfile.TemporaryDirectory() as directory:
+        harness.setup(nlp=args.nlp, scratch_directory=directory)
+        workload = {scenario: entry for scenario, entry in WORKLOAD.items() if not args.only or scenario in args.only}
+        try:
+            return await harness.run(workload, args.rate, args.reaction_rate, args.duration)
+        finally:
+            # The bot never connects so it's never closed, stop the inference worker ourselves
+            if harness.bot.chat_handler is not None:
+                await harness.bot.chat_handler.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the bot's event handlers offline with simulated Discord latency")
+    parser.add_argument("--rate", type=float, default=200, help="messages per second")
+    parser.add_argument("--reaction-rate", type=float, default=20, help="reactions per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to keep sending events")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean latency (seconds) of simulated Discord calls")
+    parser.add_argument("--users", type=int, default=1000, help="number of distinct fake users")
+    parser.add_argument("--attachments", type=int, default=0, help="attachments on reported and moved messages")
+    parser.add_argument("--only", nargs="*", help=f"only run these scenarios, any of {list(WORKLOAD)}")
+    parser.add_argument("--no-rate-limits", action="store_true", help="disable command and chat flood protection")
+    parser.add_argument("--discord-limits", action="store_true", help="pace outbound requests to Discord's buckets, the fakes don't enforce them otherwise")
+    parser.add_argument("--nlp", action="store_true", help="serve chat messages with the NLP model")
+    parser.add_argument("--log-threshold", type=int, default=len(Config.LOG_LEVELS) - 1, help="bot log threshold, logs are quiet by default")
+    parser.add_argument("--output", help="JSON report file")
+    args = parser.parse_args()
+
+    Config.LOG_THRESHOLD = args.log_threshold
+    if args.no_rate_limits:
+        Config.COMMAND_RATE_LIMIT = Config.NLP_USER_RATE_LIMIT = Config.NLP_CHANNEL_RATE_LIMIT = None
+    if not args.discord_limits:
+        # Every request may be in flight at once, messages to a channel included, so only the bot's own overhead shows
+        Config.SEND_ROUTE_LIMITS, Config.SEND_GLOBAL_LIMIT, Config.SEND_CONCURRENCY, Config.SEND_ORDERED_ROUTES = {}, None, 10 ** 6, set()
+    report = asyncio.get_event_loop().run_until_complete(run_harness(args))
+
+    print(f"{report['messages_completed']}/{report['messages_sent']} messages in {report['elapsed_s']:.1f}s "
+          f"({report['messages_per_second']:.1f} msgs/s), {report['reactions_completed']} reactions")
+    lag = report["loop_lag_ms"]
+    print(f"Event loop lag: p50 {lag['p50']:.2f}ms, p99 {lag['p99']:.2f}ms, max {lag['max']:.2f}ms")
+    for scenario, summary in report["handlers_ms"].items():
+        print(f"  {scenario:15s} n={summary['count']:6d}  p50 {summary['p50']:8.2f}ms  p99 {summary['p99']:8.2f}ms")
+    for error, count in report["errors"].items():
+        print(f"  ERROR x{count}: {error}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+# Built-in imports
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# Project imports
+from src.nlp import PrimitiveModel
+from src.nlp.NumpyEngine import NumpyEngine
+
+# External imports
+import numpy as np
+
+# Default corpus scales, (intents, utterances), larger ones (e.g. 1000x100000) are opt-in through --scales
+DEFAULT_SCALES = [(10, 100), (100, 1000), (100, 10000)]
+# Training densifies the whole dataset for tflearn, scales whose dense matrix would be larger than this aren't trained
+MAX_TRAIN_DENSE_BYTES = 1024 ** 3
+
+# Syllables used to make up words, so stemming and tokenizing see realistic-looking input
+SYLLABLES = ["ba", "ko", "ri", "tes", "mon", "ga", "lu", "pre", "sti", "ge", "sea", "son", "ing", "ed", "er", "ly", "qu", "ar"]
+FILLER_WORDS = ["how", "do", "i", "what", "are", "the", "is", "can", "you", "where", "why", "get", "my", "a", "to"]
+
+
+def generate_corpus(intent_count, utterance_count, seed=0):
+    """
+    Generate a synthetic intents corpus: every intent has its own topic words mixed with common filler words
+
+    Args:
+        intent_count (int): number of intents
+        utterance_count (int): total number of utterances, spread evenly over the intents
+        seed (int): random seed
+
+    Returns:
+        Dict[str, Dict[str, List[str]]]: corpus in the intents.json layout
+    """
+    rng = random.Random(seed)
+
+    def make_word():
+        return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3)))
+
+    corpus = {}
+    for i in range(intent_count):
+        topic = [make_word() for _ in range(8)]
+        patterns = []
+        for _ in range(max(1, utterance_count // intent_count)):
+            words = rng.sample(FILLER_WORDS, 3) + rng.sample(topic, 2) + [make_word()]
+            rng.shuffle(words)
+            patterns.append(" ".join(words) + rng.choice(["?", "!", "", " ._."]))
+        corpus[f"intent_{i}"] = {"patterns": patterns, "responses": [f"response {i}.{a}" for a in range(3)]}
+    return corpus
+
+
+def publish_untrained_model():
+    """ Serve random weights of the right shape for the pending data, inference cost doesn't depend on the values """
+    data = PrimitiveModel.pending
+    shapes = [data.input_width] + PrimitiveModel.HIDDEN_LAYERS + [len(data.intents)]
+    weights = [np.random.rand(a, b).astype(np.float32) for a, b in zip(shapes, shapes[1:])]
+    biases = [np.zeros(b, dtype=np.float32) for b in shapes[1:]]
+    PrimitiveModel.publish(data._replace(engine=NumpyEngine(weights, biases, ["linear"] * len(PrimitiveModel.HIDDEN_LAYERS) + ["softmax"])))
+
+
+def time_training(epochs):
+    """
+    Train on the pending data, timing epochs apart from the fixed costs around them
+
+    Args:
+        epochs (int): epochs to train for, at least 2 so an epoch can be timed from one epoch end to the next
+
+    Returns:
+        Dict[str, float]: train_epoch_s (median epoch), train_setup_s (graph build, densify and the first epoch's
+                          warm-up, up to the first epoch end minus one epoch), train_export_s (checkpoint save,
+                          weights export and publishing, after the last epoch) and train_total_s
+    """
+    epoch_ends = []
+    start = time.perf_counter()
+    PrimitiveModel.create_and_train_model(epochs=epochs, progress_callback=lambda epoch, total, loss: epoch_ends.append(time.perf_counter()))
+    end = time.perf_counter()
+
+    epoch_s = float(np.median(np.diff(epoch_ends)))
+    return {
+        "train_epoch_s": epoch_s,
+        "train_setup_s": epoch_ends[0] - start - epoch_s,
+        "train_export_s": end - epoch_ends[-1],
+        "train_total_s": end - start
+    }
+
+
+def percentile(samples, q):
+    return float(np.percentile(np.array(samples), q))
+
+
+def time_calls(function, arguments):
+    """
+    Time one call of function per argument
+
+    Args:
+        function (function): function to time
+        arguments (List[Any]): argument of each call
+
+    Returns:
+        Dict[str, float]: mean, p50 and p99 latency in microseconds
+    """
+    samples = []
+    for argument in arguments:
+        start = time.perf_counter()
+        function(argument)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return {"mean_us": float(np.mean(samples)), "p50_us": percentile(samples, 50), "p99_us": percentile(samples, 99)}
+
+
+def run_scale(intent_count, utterance_count, epochs, queries, results, max_train_bytes=MAX_TRAIN_DENSE_BYTES):
+    """
+    Benchmark the whole pipeline at one corpus scale, runs in its own process so peak RSS is per scale
+
+    Args:
+        intent_count (int): number of intents
+        utterance_count (int): number of utterances
+        epochs (int): epochs to train for when timing training
+        queries (int): number of messages to time preprocess, bag_of_words and predict with
+        results (multiprocessing.Queue): receives the result dict, with an "error" entry if the benchmark failed
+    """
+    result = {"intents": intent_count, "utterances": utterance_count}
+    try:
+        measure_scale(result, intent_count, utterance_count, epochs, queries, max_train_bytes)
+    except Exception as e:
+        result["error"] = repr(e)
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_mb"] = peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    results.put(result)
+
+
+def measure_scale(result, intent_count, utterance_count, epochs, queries, max_train_bytes):
+    """ Fill in the measurements of run_scale, see run_scale """
+    with tempfile.TemporaryDirectory() as directory:
+        # Point every artifact at the scratch directory
+        PrimitiveModel.PATH_INTENT = os.path.join(directory, "intents.json")
+        PrimitiveModel.PATH_JOURNAL = os.path.join(directory, "intents.journal.jsonl")
+        PrimitiveModel.PATH_DATASET = os.path.join(directory, "dataset")
+        PrimitiveModel.PATH_MODEL = os.path.join(directory, "primitive.tflearn")
+        PrimitiveModel.PATH_WEIGHTS = os.path.join(directory, "primitive.npz")
+        PrimitiveModel.PATH_MANIFEST = os.path.join(directory, "manifest.json")
+
+        corpus = generate_corpus(intent_count, utterance_count)
+        with open(PrimitiveModel.PATH_INTENT, "w") as f:
+            json.dump(corpus, f)
+        rng = random.Random(1)
+        messages = [rng.choice(corpus[rng.choice(list(corpus))]["patterns"]) for _ in range(queries)]
+
+        # Data generation and loading
+        start = time.perf_counter()
+        PrimitiveModel.generate_data()
+        result["generate_data_s"] = time.perf_counter() - start
+        result["dictionary_size"] = len(PrimitiveModel.pending.dictionary)
+        result["input_width"] = PrimitiveModel.pending.input_width
+        result["dataset_bytes"] = sum(os.path.getsize(os.path.join(PrimitiveModel.PATH_DATASET, name)) for name in os.listdir(PrimitiveModel.PATH_DATASET))
+
+        start = time.perf_counter()
+        PrimitiveModel.load_data()
+        result["load_data_s"] = time.perf_counter() - start
+
+        # Preprocessing, cold (empty stem cache) then warm
+        PrimitiveModel.stem.cache_clear()
+        result["preprocess_cold"] = time_calls(PrimitiveModel.preprocess, messages)
+        result["preprocess_warm"] = time_calls(PrimitiveModel.preprocess, messages)
+
+        # Training, needs TensorFlow
+        # float32 features, plus the one-hot labels
+        dense_bytes = (len(PrimitiveModel.train_y) * (PrimitiveModel.pending.input_width + len(PrimitiveModel.pending.intents))) * 4
+        try:
+            if dense_bytes > max_train_bytes:
+                raise MemoryError(f"dense training data would take {dense_bytes / 1024 ** 2:.1f}MB, over the {max_train_bytes / 1024 ** 2:.1f}MB limit")
+            result.update(time_training(epochs))
+            result["engine"] = "numpy (trained)"
+        except (ImportError, MemoryError) as e:
+            result["train_epoch_s"] = None
+            result["train_skipped"] = f"{e!r}"
+            publish_untrained_model()
+            result["engine"] = "numpy (random weights)"
+
+        # Vectorizing and prediction, predict_cold bypasses the prediction cache
+        token_lists = [PrimitiveModel.preprocess(message) for message in messages]
+        result["bag_of_words"] = time_calls(PrimitiveModel.bag_of_words, token_lists)
+
+        def predict_cold(message):
+            PrimitiveModel.prediction_cache.clear()
+            PrimitiveModel.predict(message)
+
+        result["predict_cold"] = time_calls(predict_cold, messages)
+        result["predict_cached"] = time_calls(PrimitiveModel.predict, messages)
+        for batch_size in (1, 16):
+            batches = [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
+
+            def predict_batch(batch):
+                PrimitiveModel.prediction_cache.clear()
+                PrimitiveModel.predict_batch(batch)
+
+            result[f"predict_batch_{batch_size}"] = time_calls(predict_batch, batches)
+
+
+def wait_for_result(process, results, poll_interval=1.0):
+    """
+    Wait for the result of a run_scale process, without hanging if it dies before reporting (crash, OOM kill)
+
+    Args:
+        process (multiprocessing.Process): process running run_scale
+        results (multiprocessing.Queue): queue it reports to
+        poll_interval (float): how often (seconds) to check whether the process is still alive
+
+    Returns:
+        Optional[Dict[str, Any]]: result dict, None if the process died without one
+    """
+    while True:
+        try:
+            return results.get(timeout=poll_interval)
+        except queue.Empty:
+            if not process.is_alive():
+                break
+    # The result may have been put right before the process exited
+    try:
+        return results.get(timeout=poll_interval)
+    except queue.Empty:
+        return None
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_scales(text):
+    return [tuple(int(a) for a in scale.split("x")) for scale in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PrimitiveModel NLP pipeline on synthetic corpora")
+    parser.add_argument("--scales", type=parse_scales, default=DEFAULT_SCALES, help="comma-separated INTENTSxUTTERANCES, e.g. 10x100,1000x100000 (the default stops at 100x10000)")
+    parser.add_argument("--epochs", type=int, default=3, help="epochs to train for when timing training, at least 2")
+    parser.add_argument("--max-train-mb", type=float, default=MAX_TRAIN_DENSE_BYTES / 1024 ** 2,
+                        help="skip training scales whose dense training data would be larger than this (MB), recorded in the results")
+    parser.add_argument("--queries", type=int, default=1000, help="messages to time per measurement")
+    parser.add_argument("--output", default="nlp_benchmark.json", help="JSON results file")
+    args = parser.parse_args()
+    if args.epochs < 2:
+        parser.error("--epochs must be at least 2, epochs are timed from one epoch end to the next")
+
+    report = {
+        "commit": get_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scales": []
+    }
+
+    context = multiprocessing.get_context("spawn")
+    for intent_count, utterance_count in args.scales:
+        print(f"Benchmarking {intent_count} intents x {utterance_count} utterances... ", end="", flush=True)
+        results = context.Queue()
+        process = context.Process(target=run_scale, args=(intent_count, utterance_count, args.epochs, args.queries, results, args.max_train_mb * 1024 ** 2))
+        process.start()
+        result = wait_for_result(process, results)
+        process.join()
+        if result is None:
+            result = {"intents": intent_count, "utterances": utterance_count, "error": f"benchmark process exited with code {process.exitcode}"}
+        report["scales"].append(result)
+        if "error" in result:
+            print(f"FAILED! ({result['error']})")
+        else:
+            print(f"OK! (generate {result['generate_data_s']:.2f}s, predict p99 {result['predict_cold']['p99_us']:.0f}us, peak RSS {result['peak_rss_mb']:.0f}MB)")
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
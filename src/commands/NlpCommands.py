@@ -1,9 +1,14 @@
+# Built-in imports
+import asyncio
+import time
+
 # Project imports
 from src.utils import StringUtil
 from src.utils.CommandHandler import CommandHandler
 from src.utils.ReactionHandler import ReactionHandler
 from src.data import Config, Emoji, Color
 from src.nlp import PrimitiveModel
+from src.nlp.TrainingWorker import TrainingWorker
 
 # External imports
 import discord
@@ -16,9 +21,9 @@ class ToggleCommandHandler(CommandHandler):
     async def on_command(self, author, command, args, message, channel, guild):
         self.bot.chat_enabled = not self.bot.chat_enabled
         emote = Emoji.UNMUTE if self.bot.chat_enabled else Emoji.MUTE
-        await message.add_reaction(emote)
+        await self.bot.react(message, emote)
         status = "enabled" if self.bot.chat_enabled else "disabled"
-        self.bot.log(1, f"NLP chat interface is now {status}")
+        self.bot.log(1, "NLP chat interface is now {}", status)
 
 
 class IntentCommandHandler(CommandHandler):
@@ -28,7 +33,8 @@ class IntentCommandHandler(CommandHandler):
                          f"> {Config.BOT_PREFIX}intent info greetings\n"
                          f"> {Config.BOT_PREFIX}intent list\n"
                          f"> {Config.BOT_PREFIX}intent reload")
-        self.is_reloading = False
+        # Only one training run at a time
+        self.reload_lock = asyncio.Lock()
 
     async def on_command(self, author, command, args, message, channel, guild):
         # Assert there is at least 1 arguments
@@ -36,12 +42,23 @@ class IntentCommandHandler(CommandHandler):
             await self.bot.reply(message, content=f"Invalid arguments! Check out `{Config.BOT_PREFIX}help intent`")
             return
 
+        # Intents aren't available until the model has warmed up, which won't happen after a failed warm-up
+        if self.bot.nlp_state == "failed":
+            content = f"{Emoji.CROSS} My NLP module failed to start and is unavailable until I restart!"
+            if author.id in Config.OWNER_IDS:
+                content += f"\nReason: `{self.bot.nlp_error}`"
+            await self.bot.reply(message, content=content)
+            return
+        if not self.bot.nlp_ready:
+            await self.bot.reply(message, content=f"{Emoji.HOUR_GLASS} My NLP module is still warming up, try again in a bit!")
+            return
+
         operation = args[0]
         if operation == "add" or operation == "a":
             if len(args) < 3:
                 await self.bot.reply(message, content=f"Invalid arguments! Usage: `{Config.BOT_PREFIX}intent add <intent_name> <utterance...>`")
                 return
-            elif args[1] not in PrimitiveModel.intents:
+            elif args[1] not in PrimitiveModel.snapshot.intents:
                 await self.bot.reply(message, embedded=self.get_intent_not_found_embedded(args[1]))
                 return
             await self.add_utterance(args[1], " ".join(args[2:]), author, message)
@@ -50,7 +67,7 @@ class IntentCommandHandler(CommandHandler):
                 await self.bot.reply(message, content=f"Invalid arguments! Usage: `{Config.BOT_PREFIX}intent info <intent_name>`")
                 return
             # Show intent information
-            if args[1] not in PrimitiveModel.intents:
+            if args[1] not in PrimitiveModel.snapshot.intents:
                 response = self.get_intent_not_found_embedded(args[1])
             else:
                 response = self.get_intent_info_embedded(args[1])
@@ -60,12 +77,12 @@ class IntentCommandHandler(CommandHandler):
             await self.bot.reply(message, embedded=self.get_intent_list_embedded())
         elif operation == "reload" or operation == "r":
             # Reload data and retrain model
-            if self.is_reloading:
-                await message.add_reaction(Emoji.HOUR_GLASS)
+            if self.reload_lock.locked():
+                await self.bot.react(message, Emoji.HOUR_GLASS)
                 return
             await self.reload_intents(message)
         else:
-            await message.add_reaction(Emoji.QUESTION)
+            await self.bot.react_unknown(message)
             return
 
     async def add_utterance(self, intent, utterance, author, reply_message):
@@ -76,36 +93,62 @@ class IntentCommandHandler(CommandHandler):
         async def confirm_add(target_user, user, emote, message, channel, guild):
             # Confirm check emote
             if emote != Emoji.CHECK:
-                await confirmation_message.edit(embed=self.get_add_utterance_cancelled_embedded(intent, utterance), mention_author=False)
+                await self.bot.edit(confirmation_message, embed=self.get_add_utterance_cancelled_embedded(intent, utterance), mention_author=False)
                 return
-            # Add utterance to intent json file
-            PrimitiveModel.add_utterance(intent, utterance)
+            # Add utterance to the intents journal, off the event loop since it may fsync
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, PrimitiveModel.add_utterance, intent, utterance)
+            # Fold the journal into the intents file in the background once it gets long
+            if PrimitiveModel.should_compact_journal():
+                self.bot.loop.create_task(self.compact_journal())
             # Edit message
             # TODO: solve the edit-message-mention problem
-            await confirmation_message.edit(embed=self.get_add_utterance_successful_embedded(intent, utterance), mention_author=False)
+            await self.bot.edit(confirmation_message, embed=self.get_add_utterance_successful_embedded(intent, utterance), mention_author=False)
 
         reaction_handler = ReactionHandler(author, confirmation_message, [Emoji.CHECK, Emoji.CROSS], confirm_add, user_lock=True)
         self.bot.register_reaction_handler(reaction_handler)
 
+    async def compact_journal(self):
+        """ Fold the utterance journal into the intents file off the event loop, errors are logged """
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, PrimitiveModel.compact_journal)
+        except Exception as e:
+            self.bot.log(3, "Utterance journal compaction failed: {!r}", e)
+
     async def reload_intents(self, reply_message):
-        self.is_reloading = True
+        async with self.reload_lock:
+            # Send status: stage 0 -- data reload
+            message = await self.bot.reply(reply_message, embedded=self.get_reload_embedded(0))
+
+            # Reload data and retrain the model in a separate process, the current model keeps serving meanwhile
+            worker = TrainingWorker(incremental=True)
+            worker.start()
 
-        # Send status: stage 0 -- data reload
-        message = await self.bot.reply(reply_message, embedded=self.get_reload_embedded(0))
-        # Reload data
-        PrimitiveModel.load_or_generate_data(force_generate=True)
+            last_edit = [0.0]
 
-        # Send status: stage 1 -- model reload
-        await message.edit(embed=self.get_reload_embedded(1))
-        # Retrain model
-        PrimitiveModel.create_and_train_model()
+            async def on_progress(worker):
+                # Stage changes are always shown, epoch progress at most every few seconds (message edits are rate-limited)
+                if worker.stage == 1 and worker.epoch and time.time() - last_edit[0] < 3:
+                    return
+                last_edit[0] = time.time()
+                await self.bot.edit(message, embed=self.get_reload_embedded(worker.stage, worker))
 
-        # Send status: stage 2 -- done!
-        await message.edit(embed=self.get_reload_embedded(2))
-        # Set "pending changes" tag to false
-        PrimitiveModel.model_changed = False
+            if not await worker.wait(on_progress):
+                await self.bot.edit(message, embed=self.get_reload_failed_embedded(worker.error))
+                self.bot.log(3, "Intent reload failed: {}", worker.error)
+                return
 
-        self.is_reloading = False
+            # Load the new data and model on the default executor, not the inference thread: predictions running
+            # meanwhile keep using the old snapshot, publishing the new one is a single atomic swap
+            loaded = await asyncio.get_event_loop().run_in_executor(None, PrimitiveModel.load_artifacts)
+            if not loaded:
+                await self.bot.edit(message, embed=self.get_reload_failed_embedded("trained artifacts could not be loaded"))
+                return
+
+            # Send status: stage 2 -- done!
+            await self.bot.edit(message, embed=self.get_reload_embedded(2, worker))
+            # Set "pending changes" tag to false
+            PrimitiveModel.model_changed = False
 
     ###############################
     # EMBEDDED MESSAGE GENERATORS #
@@ -148,12 +191,12 @@ class IntentCommandHandler(CommandHandler):
     def get_intent_info_embedded(intent):
         embedded = discord.Embed(
             title=f"Information about intent \"{intent}\"",
-            description=f"There is currently a total of **{len(PrimitiveModel.utterances[intent])}** utterances "
-                        f"and **{len(PrimitiveModel.responses[intent])}** responses for \"{intent}\"",
+            description=f"There is currently a total of **{len(PrimitiveModel.snapshot.utterances[intent])}** utterances "
+                        f"and **{len(PrimitiveModel.snapshot.responses[intent])}** responses for \"{intent}\"",
             color=Color.COLOR_NLP
         )
-        embedded.add_field(name="**Utterances:**", value=f"> {StringUtil.quote_join(PrimitiveModel.utterances[intent])}", inline=False)
-        embedded.add_field(name="**Responses:**", value=f"> {StringUtil.quote_join(PrimitiveModel.responses[intent])}", inline=False)
+        embedded.add_field(name="**Utterances:**", value=f"> {StringUtil.quote_join(PrimitiveModel.snapshot.utterances[intent])}", inline=False)
+        embedded.add_field(name="**Responses:**", value=f"> {StringUtil.quote_join(PrimitiveModel.snapshot.responses[intent])}", inline=False)
         if PrimitiveModel.model_changed:
             embedded.set_footer(text="* there are some pending changes to the model, reload to see them in action")
         return embedded
@@ -173,16 +216,16 @@ class IntentCommandHandler(CommandHandler):
     def get_intent_list_embedded():
         embedded = discord.Embed(
             title=f"List of intents in my NLP module",
-            description=f"There is currently a total of **{len(PrimitiveModel.intents)}** intents",
+            description=f"There is currently a total of **{len(PrimitiveModel.snapshot.intents)}** intents",
             color=Color.COLOR_NLP
         )
-        embedded.add_field(name="**Intents:**", value=f"> {Config.SEP.join(PrimitiveModel.intents)}", inline=False)
+        embedded.add_field(name="**Intents:**", value=f"> {Config.SEP.join(PrimitiveModel.snapshot.intents)}", inline=False)
         if PrimitiveModel.model_changed:
             embedded.set_footer(text="* there are some pending changes to the model, reload to see them in action")
         return embedded
 
     @staticmethod
-    def get_reload_embedded(stage):
+    def get_reload_embedded(stage, worker=None):
         descriptions = ["Reloading Data", "Retraining Model", "Complete"]
         descriptions[stage] = f"**{descriptions[stage]}**"
         embedded = discord.Embed(
@@ -190,6 +233,19 @@ class IntentCommandHandler(CommandHandler):
             description=" >> ".join(descriptions),
             color=Color.COLOR_NLP
         )
+        if worker is not None and worker.epochs:
+            loss = f", loss {worker.loss:.4f}" if worker.loss is not None else ""
+            warm_started = " (fine-tuned from the previous model)" if stage == 2 and worker.warm_started else ""
+            embedded.set_footer(text=f"Epoch {worker.epoch}/{worker.epochs}{loss}{warm_started}")
+        return embedded
+
+    @staticmethod
+    def get_reload_failed_embedded(error):
+        embedded = discord.Embed(
+            title=f"Reloading intent data failed",
+            description=f"The current model is still being used. Error: `{error}`",
+            color=Color.COLOR_NLP
+        )
         return embedded
 
 
@@ -4,6 +4,7 @@ import time
 # Project imports
 from src.utils import TimeUtil, MoveMessageUtil
 from src.utils.CommandHandler import CommandHandler
+from src.utils.RateLimiter import RateLimiter
 from src.data import Color, Config, Emoji
 
 # External imports
@@ -13,7 +14,8 @@ import discord
 class DmReportCommandHandler(CommandHandler):
     def __init__(self, bot):
         super().__init__(bot, "report", ["vent"], "[DM Only] Report something to the moderators in AaH Discord", f"{Config.BOT_PREFIX}report [message...]", f"{Config.BOT_PREFIX}report I ate too many strawberries!")
-        self.cooldowns = {}
+        # One report per user per hour, only counted once the report is valid
+        self.report_limiter = RateLimiter(1, 60 * 60)
 
     async def on_command(self, author, command, args, message, channel, guild):
         # DM-only command
@@ -27,12 +29,11 @@ class DmReportCommandHandler(CommandHandler):
             return
 
         # Check cooldowns
-        if self.cooldowns.get(author.id, -1) > time.time():
+        retry_after = self.report_limiter.hit(author.id)
+        if retry_after:
             # In cooldown, send "wait" message
-            await self.bot.reply(message, content=f"This command should not be spammed. You need to wait {TimeUtil.format_time(self.cooldowns[author.id] - time.time(), english=True)} before reporting again!")
+            await self.bot.reply(message, content=f"This command should not be spammed. You need to wait {TimeUtil.format_time(retry_after, english=True)} before reporting again!")
             return
-        # Not in cooldown, reset cooldown
-        self.cooldowns[author.id] = time.time() + 60 * 60
 
         # Trigger typing
         await channel.trigger_typing()
@@ -40,18 +41,15 @@ class DmReportCommandHandler(CommandHandler):
         # Generate message embedded
         embedded = MoveMessageUtil.generate_embedded(message.author, message.content, message.attachments, is_dm=True)
 
-        # Fetch MOVE_TO channel and send message
-        channel = await self.bot.fetch_channel(Config.MOVE_TO_CHANNEL)
-        sent_message = await channel.send(embed=embedded)
+        # Resolve MOVE_TO channel and send message
+        channel = await self.bot.channel_cache.get(Config.MOVE_TO_CHANNEL)
+        sent_message = await self.bot.send_scheduler.submit(channel, lambda: channel.send(embed=embedded))
 
         # Send confirm message
         await self.bot.reply(message, content=f"`{TimeUtil.formatted_now(include_date=True)}` >> Your report has been registered {Emoji.CHECK}")
 
         # Send attachments if there are attachments
-        if message.attachments:
-            for attachment in message.attachments:
-                file = await attachment.to_file()
-                await sent_message.reply(content=f"Attached file `{attachment.filename}`:", file=file)
+        await self.bot.attachment_relay.relay(sent_message, message.attachments)
 
 
 ###############################################################
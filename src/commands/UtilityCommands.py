@@ -1,4 +1,8 @@
+# Built-in imports
+import math
+
 # Project imports
+from src.utils import TimeUtil
 from src.utils.CommandHandler import CommandHandler
 from src.data import Color, Config, Emoji
 
@@ -17,11 +21,7 @@ class HelpCommandHandler(CommandHandler):
         # Help for specific command
         elif len(args) == 1:
             # Find target command
-            handler = None
-            for loop in self.bot.command_handlers:
-                if args[0] == loop.command or args[0] in loop.aliases:
-                    handler = loop
-                    break
+            handler = self.bot.get_command_handler(args[0])
 
             # Not found -- unknown command
             if handler is None:
@@ -63,8 +63,78 @@ class PingCommandHandler(CommandHandler):
     def __init__(self, bot):
         super().__init__(bot, "ping", [], "Check my connection speed to the Discord server", "", "")
 
+    # Most shards listed, the rest are summarized in one line
+    MAX_LISTED_SHARDS = 25
+
+    async def on_command(self, author, command, args, message, channel, guild):
+        # DMs are always received by shard 0
+        shard_id = guild.shard_id if guild is not None else 0
+        latencies = dict(self.bot.latencies)
+        content = f"{Emoji.PING_PONG} Pong! {self.format_latency(latencies.get(shard_id, self.bot.latency))}"
+        if self.bot.shard_count is not None and self.bot.shard_count > 1:
+            content += f" (shard {shard_id} of {self.bot.shard_count})"
+        # List every shard of this process, shards run by other processes answer in their own guilds
+        if len(latencies) > 1:
+            lines = [f"Shard {i:>4} {self.format_latency(latency):>8}" + (" <" if i == shard_id else "")
+                     for i, latency in sorted(latencies.items())[:self.MAX_LISTED_SHARDS]]
+            if len(latencies) > self.MAX_LISTED_SHARDS:
+                lines.append(f"... and {len(latencies) - self.MAX_LISTED_SHARDS} more, averaging {self.format_latency(self.bot.latency)}")
+            content += "\n```\n" + "\n".join(lines) + "\n```"
+        await self.bot.reply(message, content=content)
+
+    @staticmethod
+    def format_latency(latency):
+        # Shards that haven't heartbeated yet have an infinite latency
+        return f"{int(latency * 1000)}ms" if math.isfinite(latency) else "n/a"
+
+
+class StatsCommandHandler(CommandHandler):
+    def __init__(self, bot):
+        super().__init__(bot, "stats", ["metrics"], "[Owner Only] Show my latency and load statistics", "", "")
+
     async def on_command(self, author, command, args, message, channel, guild):
-        await self.bot.reply(message, content=f"{Emoji.PING_PONG} Pong! {int(self.bot.latency * 1000)}ms")
+        # Owner-only command
+        if author.id not in Config.OWNER_IDS:
+            await self.bot.react_cross(message)
+            return
+
+        await self.bot.reply(message, embedded=self.get_stats_embedded())
+
+    def get_stats_embedded(self):
+        metrics = self.bot.metrics
+        loop_lag = metrics.histograms.get("event_loop_lag_seconds", {}).get(())
+        embedded = discord.Embed(
+            title=f"Bot statistics",
+            description=f"Up for {TimeUtil.format_time(metrics.get_gauge('uptime_seconds'), english=True) or 'a moment'}",
+            color=Color.COLOR_HELP
+        )
+        overview = [
+            f"Event loop lag: p50 {loop_lag.quantile(0.5) * 1000:.1f}ms, p99 {loop_lag.quantile(0.99) * 1000:.1f}ms" if loop_lag else "Event loop lag: not measured yet",
+            f"Reaction handlers: {metrics.get_gauge('reaction_handlers')} message(s), {metrics.get_gauge('reaction_expiry_pending')} pending expiry",
+            f"Unknown commands: {metrics.get_counter('unknown_commands_total')}",
+            f"NLP: {self.bot.nlp_state}, {metrics.get_gauge('nlp_queue_depth')} queued, {metrics.get_counter('nlp_low_confidence_total')} low-confidence skip(s)",
+            f"Logs: {metrics.get_gauge('log_queue_depth')} queued, {metrics.get_gauge('log_records_dropped')} dropped",
+            f"Outbound: {metrics.get_gauge('send_queue_depth')} queued, {sum(metrics.counters.get('sends_dropped_total', {}).values())} dropped as stale",
+        ]
+        embedded.add_field(name="**Overview:**", value="> " + "\n> ".join(overview), inline=False)
+        embedded.add_field(name="**Commands:**", value=self.get_latency_table(metrics.histograms.get("command_duration_seconds", {})), inline=False)
+        embedded.add_field(name="**Stages:**", value=self.get_latency_table(metrics.histograms.get("stage_duration_seconds", {})), inline=False)
+        depths = sorted(self.bot.send_scheduler.get_depths().items(), key=lambda a: a[1], reverse=True)[:5]
+        if depths:
+            embedded.add_field(name="**Busiest outbound queues:**", value="> " + "\n> ".join(f"<#{channel_id}>: {depth}" for channel_id, depth in depths), inline=False)
+        return embedded
+
+    @staticmethod
+    def get_latency_table(family):
+        if not family:
+            return "> *nothing recorded yet*"
+        table = "```\n"
+        table += f"{'':15s} {'count':>7s} {'p50':>9s} {'p99':>9s}\n"
+        for key, histogram in sorted(family.items(), key=lambda a: a[1].count, reverse=True):
+            name = key[0][1] if key else ""
+            table += f"{name:15s} {histogram.count:7d} {histogram.quantile(0.5) * 1000:7.1f}ms {histogram.quantile(0.99) * 1000:7.1f}ms\n"
+        table += "```"
+        return table
 
 
 class TestCommandHandler(CommandHandler):
@@ -81,4 +151,5 @@ def register_all(bot):
     """ Register all commands in this module """
     bot.register_command_handler(HelpCommandHandler(bot))
     bot.register_command_handler(PingCommandHandler(bot))
+    bot.register_command_handler(StatsCommandHandler(bot))
     bot.register_command_handler(TestCommandHandler(bot))
@@ -1,3 +1,6 @@
+# Built-in imports
+import os
+
 #######################
 # CORE CONFIGURATIONS #
 #######################
@@ -6,6 +9,53 @@ SEP = ", "
 
 LOG_THRESHOLD = 0
 LOG_LEVELS = ["D", "I", "W", "E"]
+# Log output, any of {"json", "text"}, and how many records may wait for the writer thread before new ones are dropped
+LOG_FORMAT = "json"
+LOG_QUEUE_SIZE = 10000
+
+# Users allowed to use owner-only commands (e.g. stats), {user id...}, from the comma-separated OWNER_IDS environment
+# variable, the bot application's owner (or team) is used when it's empty
+OWNER_IDS = {int(user_id) for user_id in os.getenv("OWNER_IDS", "").split(",") if user_id.strip()}
+
+# Flood protection, (events, per seconds) or None to disable: commands per user (each command separately),
+# and NLP chat messages per user and per channel, checked before any inference
+COMMAND_RATE_LIMIT = (5, 10)
+NLP_USER_RATE_LIMIT = (3, 15)
+NLP_CHANNEL_RATE_LIMIT = (60, 60)
+# Keys (users, channels...) tracked per rate limiter at most
+RATE_LIMITER_MAX_KEYS = 10000
+
+# Outbound requests are paced to Discord's buckets, {route => (requests, per seconds)} per channel, plus a bot-wide limit
+SEND_ROUTE_LIMITS = {
+    "send": (5, 5),
+    "edit": (5, 5),
+    "delete": (5, 1),
+    "reaction": (1, 0.25),
+    "channel_edit": (2, 600)
+}
+SEND_GLOBAL_LIMIT = (50, 1)
+# Requests in flight per channel and route at most, routes keeping their order (messages) send one at a time
+SEND_CONCURRENCY = 5
+SEND_ORDERED_ROUTES = {"send"}
+# Chat responses and reactions this many seconds late are dropped instead of sent
+SEND_STALE_AFTER = 30
+
+#######################
+# TASK CONFIGURATIONS #
+#######################
+# Time zone of cron-style repeating tasks, IANA name (e.g. "America/New_York"), "UTC", or None for the host's local time
+TASK_TIMEZONE = None
+# Repeating task runs starting more than this many seconds late are skipped
+TASK_MISFIRE_GRACE = 60
+
+##########################
+# METRICS CONFIGURATIONS #
+##########################
+# Prometheus textfile for node_exporter's textfile collector, None to disable the export
+METRICS_TEXTFILE = None
+METRICS_EXPORT_INTERVAL = 15
+# How often (seconds) to probe the event loop lag
+METRICS_LOOP_LAG_INTERVAL = 0.5
 
 ##########################
 # CHANNEL CONFIGURATIONS #
@@ -38,9 +88,22 @@ MOVE_FROM_CHANNELS = {
 # Move messages to this one channel:
 MOVE_TO_CHANNEL = 831381240958550046  # Almost a hero >> vent and report bot
 
+# Attachment relay: bytes of attachments held in memory at once (all relays together), attachments larger than
+# RELAY_SPOOL_THRESHOLD bytes are spooled to temp files instead, at most RELAY_FILES_PER_MESSAGE files per upload,
+# and the upload limit used outside of guilds
+RELAY_MEMORY_BUDGET = 32 * 1024 * 1024
+RELAY_SPOOL_THRESHOLD = 4 * 1024 * 1024
+RELAY_FILES_PER_MESSAGE = 10
+RELAY_DEFAULT_UPLOAD_LIMIT = 8 * 1024 * 1024
+
 # vent and report = 827241144488427560
 # vent and report bot = 831381240958550046
 ######################
 # NLP CONFIGURATIONS #
 ######################
 NLP_CONFIDENCE_THRESHOLD = 0.7
+# Micro-batching of chat inference: largest batch per forward pass, and how long (seconds) to wait for a batch to fill up
+NLP_BATCH_MAX_SIZE = 16
+NLP_BATCH_MAX_WAIT = 0.02
+# How often (seconds) to check for a model saved by another bot process (see SHARD_PROCESSES in App.py), None to never
+NLP_MODEL_WATCH_INTERVAL = 10
@@ -0,0 +1,137 @@
+# Built-in imports
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# Project imports
+from src.data import Config
+from src.nlp import PrimitiveModel
+
+
+class InferenceBatcher:
+    """ Collects chat messages into micro-batches and runs each batch through the model on a worker thread """
+
+    def __init__(self, bot, max_batch_size=Config.NLP_BATCH_MAX_SIZE, max_wait=Config.NLP_BATCH_MAX_WAIT):
+        """
+        Initialize an inference batcher
+
+        Args:
+            bot (BotClient): bot instance
+            max_batch_size (int): maximum number of messages per model forward pass
+            max_wait (float): how long (seconds) the first message of a batch waits for more messages to arrive
+        """
+        self.bot = bot
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        # A single worker thread, the model is not safe to run concurrently
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nlp-inference")
+        # Queue of (message, future), created on the bot's loop when the first message comes in
+        self.queue = None
+        self.worker = None
+        # Batch on the worker thread right now, [(message, future)...]
+        self.batch = []
+        self.closed = False
+
+        # Statistics for tuning
+        self.last_batch_size = 0
+        self.max_seen_batch_size = 0
+        self.total_batches = 0
+        self.total_messages = 0
+
+    @property
+    def queue_depth(self):
+        """ Number of messages waiting for a batch """
+        return self.queue.qsize() if self.queue is not None else 0
+
+    async def predict(self, message):
+        """
+        Queue a message for prediction and wait for its batch to finish
+
+        Args:
+            message (str): input message
+
+        Returns:
+            Tuple(str, float, Dict[str, float]): (predicted response, confidence, entire result as a dict)
+        """
+        if self.closed:
+            raise RuntimeError("Inference batcher is closed")
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self.run())
+
+        future = asyncio.get_event_loop().create_future()
+        self.queue.put_nowait((message, future))
+        return await future
+
+    async def run(self):
+        """ Worker coroutine, forms batches and hands them to the executor """
+        loop = asyncio.get_event_loop()
+        while True:
+            # Wait for the first message of the next batch, then give others a short window to join
+            batch = self.batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            messages = [message for message, _ in batch]
+            start = loop.time()
+            try:
+                results = await loop.run_in_executor(self.executor, PrimitiveModel.predict_batch, messages)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+
+            self.batch = []
+            self.record_batch(len(batch), loop.time() - start)
+
+    async def close(self):
+        """ Stop the worker, messages still queued or in the running batch fail with RuntimeError """
+        self.closed = True
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+        self.worker = None
+
+        outstanding = list(self.batch)
+        while self.queue is not None and not self.queue.empty():
+            outstanding.append(self.queue.get_nowait())
+        self.batch = []
+        for _, future in outstanding:
+            if not future.done():
+                future.set_exception(RuntimeError("Inference batcher is closed"))
+        # The batch running on the worker thread, if any, finishes in the background
+        self.executor.shutdown(wait=False)
+
+    def record_batch(self, size, duration):
+        """
+        Update batch statistics and log them
+
+        Args:
+            size (int): size of the batch that just finished
+            duration (float): how long (seconds) the batch took on the worker thread
+        """
+        self.last_batch_size = size
+        self.max_seen_batch_size = max(self.max_seen_batch_size, size)
+        self.total_batches += 1
+        self.total_messages += size
+        self.bot.metrics.observe("stage_duration_seconds", duration, stage="nlp_batch")
+        self.bot.log(0, "NLP batch of {} message(s) done, {} message(s) queued", size, self.queue_depth)
+
+    def __str__(self):
+        return f"Inference batcher ({self.queue_depth} queued, last batch {self.last_batch_size}, " \
+               f"average batch {self.total_messages / max(self.total_batches, 1):.2f})"
@@ -0,0 +1,110 @@
+# Built-in imports
+from types import MappingProxyType
+from typing import *
+
+# External imports
+import numpy as np
+
+
+class StringGroups(Mapping):
+    """
+    Read-only {key => (strings...)} over a table of UTF-8 strings, e.g. the utterances of a saved dataset.
+    The table can be memory-mapped, a key's strings are only decoded the first time it's looked up
+    """
+
+    def __init__(self, keys, data, offsets, groups):
+        """
+        Initialize a view over a string table
+
+        Args:
+            keys (Sequence[str]): group keys, position = group index
+            data (np.ndarray): uint8 UTF-8 bytes of all strings, back to back
+            offsets (np.ndarray): int64 start of each string in data, plus the end of the last one
+            groups (np.ndarray): int32 group index of each string
+        """
+        self.keys_index = {key: i for i, key in enumerate(keys)}
+        self.data = data
+        self.offsets = offsets
+        self.groups = groups
+        # Decoded groups, {key => (strings...)}
+        self.decoded = {}
+
+    def __getitem__(self, key):
+        strings = self.decoded.get(key)
+        if strings is None:
+            rows = np.flatnonzero(self.groups == self.keys_index[key])
+            strings = self.decoded[key] = tuple(bytes(self.data[self.offsets[row]:self.offsets[row + 1]]).decode() for row in rows)
+        return strings
+
+    def __iter__(self):
+        return iter(self.keys_index)
+
+    def __len__(self):
+        return len(self.keys_index)
+
+
+class ModelSnapshot(NamedTuple):
+    """
+    Immutable, versioned view of everything a prediction needs: vocabulary, intents, responses and engine.
+    A reload builds a whole new snapshot and swaps it in with a single assignment, so a prediction that
+    grabbed the old snapshot keeps a consistent view until it's done
+    """
+
+    version: int  # increases every time a snapshot is published, 0 = never published
+    dictionary: Tuple[str, ...]  # words we've seen, position = input index
+    dictionary_index: Mapping[str, int]  # read-only {token => index in dictionary}
+    input_width: int  # width of the model's input layer, >= len(dictionary)
+    intents: Tuple[str, ...]  # intents, position = output index
+    utterances: Mapping[str, Tuple[str, ...]]  # read-only {intent => (utterances...)}
+    responses: Mapping[str, Tuple[str, ...]]  # read-only {intent => (responses...)}
+    corpus_hash: str  # sha256 of the intents file the data was generated from
+    engine: Any  # inference engine (NumpyEngine or tflearn.DNN), None until a model is trained or loaded
+
+    @staticmethod
+    def create(dictionary=(), input_width=0, intents=(), utterances=None, responses=None, corpus_hash="", engine=None, version=0):
+        """
+        Build a snapshot, freezing the given containers
+
+        Args:
+            dictionary (Iterable[str]): words in input order
+            input_width (int): width of the model's input layer
+            intents (Iterable[str]): intents in output order
+            utterances (Dict[str, List[str]] or StringGroups): {intent => [utterances...]}, StringGroups are kept as is
+            responses (Dict[str, List[str]] or StringGroups): {intent => [responses...]}, StringGroups are kept as is
+            corpus_hash (str): sha256 of the intents file
+            engine (Any): inference engine
+            version (int): snapshot version
+
+        Returns:
+            ModelSnapshot: frozen snapshot
+        """
+        dictionary = tuple(dictionary)
+        return ModelSnapshot(
+            version=version,
+            dictionary=dictionary,
+            dictionary_index=MappingProxyType({word: i for i, word in enumerate(dictionary)}),
+            input_width=input_width,
+            intents=tuple(intents),
+            utterances=freeze_groups(utterances),
+            responses=freeze_groups(responses),
+            corpus_hash=corpus_hash,
+            engine=engine
+        )
+
+    def __str__(self):
+        return f"Model snapshot v{self.version} ({len(self.intents)} intents, {len(self.dictionary)}/{self.input_width} words)"
+
+
+def freeze_groups(groups):
+    """
+    Read-only copy of {key => [strings...]}
+
+    Args:
+        groups (Dict[str, List[str]] or StringGroups): strings by key, None for none
+
+    Returns:
+        Mapping[str, Tuple[str, ...]]: read-only mapping, StringGroups (already read-only) are returned as is
+    """
+    if isinstance(groups, StringGroups):
+        return groups
+    return MappingProxyType({key: tuple(items) for key, items in (groups or {}).items()})
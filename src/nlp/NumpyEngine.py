@@ -0,0 +1,120 @@
+# Built-in imports
+
+# Project imports
+
+# External imports
+import numpy as np
+
+
+class NumpyEngine:
+    """ TensorFlow-free forward pass of the trained intent network, exposes the same predict API as tflearn.DNN """
+
+    def __init__(self, weights, biases, activations):
+        """
+        Initialize an engine from the weights of a trained fully-connected network
+
+        Args:
+            weights (List[np.array]): weight matrix of each layer, shape (inputs, outputs)
+            biases (List[np.array]): bias vector of each layer
+            activations (List[str]): activation of each layer, any of {"linear", "relu", "softmax"}
+        """
+        assert len(weights) == len(biases) == len(activations), "Every layer needs a weight, a bias and an activation!"
+        self.weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        self.biases = [np.asarray(b, dtype=np.float32) for b in biases]
+        self.activations = list(activations)
+
+    @property
+    def input_width(self):
+        return self.weights[0].shape[0]
+
+    def predict(self, x):
+        """
+        Run the forward pass on a dense input matrix
+
+        Args:
+            x (np.array): dense bag-of-words matrix, shape (rows, input width)
+
+        Returns:
+            np.array: softmax confidences, shape (rows, intents)
+        """
+        x = np.asarray(x, dtype=np.float32)
+        return self.forward(x @ self.weights[0] + self.biases[0])
+
+    def predict_sparse(self, indptr, indices):
+        """
+        Run the forward pass on a CSR bag-of-words matrix without densifying it,
+        the first layer is just the sum of the weight rows of the present tokens
+
+        Args:
+            indptr (np.array): CSR row pointers
+            indices (np.array): CSR column indices
+
+        Returns:
+            np.array: softmax confidences, shape (rows, intents)
+        """
+        rows = len(indptr) - 1
+        hidden = np.zeros((rows, self.weights[0].shape[1]), dtype=np.float32)
+        np.add.at(hidden, np.repeat(np.arange(rows), np.diff(indptr)), self.weights[0][indices])
+        return self.forward(hidden + self.biases[0])
+
+    def forward(self, x):
+        """
+        Finish the forward pass from the pre-activation output of the first layer
+
+        Args:
+            x (np.array): pre-activation output of the first layer
+
+        Returns:
+            np.array: output of the last layer
+        """
+        x = self.activate(x, self.activations[0])
+        for w, b, activation in zip(self.weights[1:], self.biases[1:], self.activations[1:]):
+            x = self.activate(x @ w + b, activation)
+        return x
+
+    @staticmethod
+    def activate(x, activation):
+        if activation == "linear":
+            return x
+        if activation == "relu":
+            return np.maximum(x, 0)
+        if activation == "softmax":
+            # Shift by the row maximum for numerical stability
+            e = np.exp(x - x.max(axis=1, keepdims=True))
+            return e / e.sum(axis=1, keepdims=True)
+        raise ValueError(f"Unsupported activation \"{activation}\"")
+
+    def save(self, path):
+        """
+        Save the weights to a compact .npz artifact
+
+        Args:
+            path (str): file path
+        """
+        arrays = {}
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            arrays[f"W{i}"] = w
+            arrays[f"b{i}"] = b
+        # np.savez appends ".npz" to paths without it, write through a file object to keep the path as-is
+        with open(path, "wb") as f:
+            np.savez_compressed(f, activations=np.array(self.activations), **arrays)
+
+    @staticmethod
+    def load(path):
+        """
+        Load an engine from a .npz artifact written by save
+
+        Args:
+            path (str): file path
+
+        Returns:
+            NumpyEngine: loaded engine
+        """
+        with np.load(path) as data:
+            activations = [str(a) for a in data["activations"]]
+            weights = [data[f"W{i}"] for i in range(len(activations))]
+            biases = [data[f"b{i}"] for i in range(len(activations))]
+        return NumpyEngine(weights, biases, activations)
+
+    def __str__(self):
+        return f"NumPy engine ({' -> '.join(str(w.shape[0]) for w in self.weights)} -> {self.weights[-1].shape[1]})"
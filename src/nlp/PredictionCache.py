@@ -0,0 +1,86 @@
+# Built-in imports
+from collections import OrderedDict
+import threading
+
+
+class PredictionCache:
+    """ Bounded LRU cache of model outputs, keyed by (snapshot version, sorted stemmed tokens) """
+
+    def __init__(self, max_size):
+        """
+        Initialize an empty cache
+
+        Args:
+            max_size (int): maximum number of cached predictions, least recently used ones are evicted first
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        # Filled on the inference thread, cleared by whoever publishes a new snapshot
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(version, tokens):
+        """
+        Cache key of a preprocessed message, word order and repeats don't matter to a bag-of-words model
+
+        Args:
+            version (int): snapshot version
+            tokens (List[str]): preprocessed tokens
+
+        Returns:
+            Tuple(int, Tuple[str, ...]): cache key
+        """
+        return version, tuple(sorted(set(tokens)))
+
+    def get(self, key):
+        """
+        Look up a prediction and mark it as recently used
+
+        Args:
+            key (Tuple): cache key
+
+        Returns:
+            Optional[np.array]: cached model output, None on a miss
+        """
+        with self.lock:
+            results = self.entries.get(key)
+            if results is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return results
+
+    def put(self, key, results):
+        """
+        Store a prediction, evicting the least recently used one when full
+
+        Args:
+            key (Tuple): cache key
+            results (np.array): model output, made read-only since it's shared between hits
+        """
+        results.setflags(write=False)
+        with self.lock:
+            self.entries[key] = results
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """ Drop every entry, counters are kept """
+        with self.lock:
+            self.entries.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return f"Prediction cache ({len(self)}/{self.max_size} entries, {self.hits} hits, {self.misses} misses, {self.hit_rate * 100:.1f}% hit rate)"
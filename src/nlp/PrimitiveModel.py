@@ -1,78 +1,171 @@
 # Built-in imports
+import argparse
+import atexit
+import contextlib
+import functools
+import hashlib
+import itertools
 import json
 import os
-import pickle
 import random
+import re
+import threading
+import time
+import uuid
 from typing import *
 
 # Project imports
-
+from src.nlp.ModelSnapshot import ModelSnapshot, StringGroups
+from src.nlp.NumpyEngine import NumpyEngine
+from src.nlp.PredictionCache import PredictionCache
 
 # External imports
 import numpy as np
-import tflearn
-import tensorflow as tf
-import nltk
-from nltk.stem.lancaster import LancasterStemmer
-
-# Path configurations
-PATH_INTENT = "nlp/intents.json"
-PATH_WORDS_DATA = "nlp/data/bag_of_words.pickle"
-PATH_MODEL = "nlp/models/primitive.tflearn"
+try:
+    import fcntl
+except ImportError:
+    # Windows, the saved artifacts are then only guarded within a process
+    fcntl = None
+# tensorflow, tflearn and nltk are imported lazily so importing this module stays cheap,
+# only training (and the "tflearn" engine) needs TensorFlow, nltk is loaded on the first stem
+
+# Path configurations, relative to this package so they don't depend on the working directory
+PATH_NLP = os.path.dirname(os.path.abspath(__file__))
+PATH_INTENT = os.path.join(PATH_NLP, "intents.json")
+PATH_JOURNAL = os.path.join(PATH_NLP, "intents.journal.jsonl")
+PATH_DATASET = os.path.join(PATH_NLP, "data", "dataset")
+PATH_MODEL = os.path.join(PATH_NLP, "models", "primitive.tflearn")
+PATH_WEIGHTS = os.path.join(PATH_NLP, "models", "primitive.npz")
+PATH_MANIFEST = os.path.join(PATH_NLP, "models", "manifest.json")
 
 # Global configurations
-
-# Stemmer
-stemmer = LancasterStemmer()
-
-# Global data variables
-dictionary = []  # dictionary of words we've seen (unique)
-intents = []  # list of intents
-utterances = {}  # dict of {intent => [utterances...]}
-responses = {}  # dict of {intent => [responses...]}
-train_x, train_y = [], []  # training data lists
-
-# Global model variables
-model = None
+DATA_FORMAT_VERSION = 5  # bump whenever the layout of the saved training data changes
+ENGINE = "numpy"  # inference engine, any of {"numpy", "tflearn"}, "numpy" serves without TensorFlow installed
+
+# Utterance journal: fsync after this many appends or seconds (whichever comes first),
+# and fold the journal into the intents file once it holds this many entries
+JOURNAL_FSYNC_BATCH = 32
+JOURNAL_FSYNC_INTERVAL = 5
+JOURNAL_COMPACT_THRESHOLD = 256
+# Key of the intents file recording the last journal entry folded into it, so a replay after an interrupted compaction
+# skips exactly the compacted entries (utterances added twice on purpose stay twice)
+JOURNAL_APPLIED_KEY = "__journal_applied__"
+
+# Hyperparameters, part of the artifact cache key together with the intents file
+EPOCHS = 1000
+HIDDEN_LAYERS = [8, 8]
+BATCH_SIZE = 8
+
+# Incremental training: epochs used to fine-tune existing weights, and the spare input slots (fraction of the
+# dictionary size, rounded up to INPUT_WIDTH_STEP) reserved so new words don't force a rebuild of the input layer
+FINE_TUNE_EPOCHS = 100
+VOCABULARY_HEADROOM = 0.5
+INPUT_WIDTH_STEP = 64
+
+# Preprocessing: tokenizer, any of {"regex", "nltk"}, "regex" doesn't need the nltk Punkt data download,
+# and how many distinct stemmed words to remember (chat vocabulary is Zipfian, a small cache hits most words)
+TOKENIZER = "regex"
+STEM_CACHE_SIZE = 65536
+# How many distinct questions to remember the model output for, per served snapshot
+PREDICTION_CACHE_SIZE = 4096
+
+# Fast tokenizer, splits like nltk's word_tokenize (Treebank rules) on chat input, checked by tests/test_tokenizer_parity.py
+TOKEN_PATTERN = re.compile(r"""
+    \w+(?=n't\b)                                     # "can't" => "ca", "n't"
+    | n't\b
+    | \b(?:can(?=not\b)|gim(?=me\b)|gon(?=na\b)|got(?=ta\b)|lem(?=me\b)|wan(?=na\b(?!-))|d(?='ye\b)|more(?='n\b))
+                                                     # "gonna" => "gon", "na", "cannot" => "can", "not"
+    | (?<=\bd)'ye\b | (?<=\bmore)'n\b
+    | '(?:s|re|ve|ll|m|d)(?=[^\w'-]|$)               # "where's" => "where", "'s", but "i'd've" => "i'd", "'ve"
+    | ''                                             # double quote typed as two single ones
+    | --
+    | \.{2,}                                         # "..."
+    | (?:(?<!\w)'(?=(?:re|ve|ll|m|t|s|d|n)\b))?     # words: anything up to a space or a symbol Treebank splits off
+      (?:(?!n't\b)(?:
+          [^\s;@#$%&?!*()\[\]{}<>"'`,:.\-«“‘„»”’\u2012-\u2015]
+        | [,:](?=\d)                                 # "1,000", "10:30"
+        | \.(?=[^\s.])                               # "v1.2.3", "a.com", sentence-ending periods are split off
+        | -(?!-)                                     # "x-ray", but "x--y" => "x", "--", "y"
+        | (?<=\w)'(?!(?:s|re|ve|ll|m|d)(?:[^\w'-]|$))(?=\w)  # "o'clock", "rock'n'roll"
+      ))+
+    | \S                                             # any other single symbol
+""", re.VERBOSE | re.IGNORECASE)
+# Sentence boundaries, stand-in for Punkt when its data isn't installed (see nltk_tokenize)
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+# Chat input checked by check_tokenizer_parity and tests/test_tokenizer_parity.py on top of the corpus, cases the two tokenizers are easy to split on
+PARITY_MESSAGES = [
+    "where's the pizza? i can't find it, won't you help",
+    "gonna grab pizza, gimme a sec", "lemme see, i wanna go", "i cannot", "gotta go", "d'ye know more'n me",
+    "x--y", "rock 'n' roll", "mail me at a@b.com", "v1.2.3 is out", "pizza w/ cheese", "and/or",
+    "it's 10:30, that's 1,000.50 $ or 50% off", "hello... anyone?!", "\"quoted\" (and bracketed) [stuff]",
+    "'tis the dogs' o'clock", "don’t “curly” quotes", "x-ray #tag *wink* ;)", "Hi there. How are you?"
+]
+
+# Stemmer, created on first use
+stemmer = None
+
+# Served model: everything predict needs, replaced as a whole (see ModelSnapshot)
+snapshot = ModelSnapshot.create()
+snapshot_versions = itertools.count(1)
+# Model outputs of recently seen token sets, keyed by snapshot version
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE)
+
+# Training data: generated or loaded data waiting to be trained on (or matched with a saved model), not served yet
+pending = None  # ModelSnapshot without engine
+train_x = (np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32))  # sparse training features, CSR (indptr, indices)
+train_y = np.zeros(0, dtype=np.int32)  # training labels, intent index of each row
+
+# Whether intents were modified since the served model was built
 model_changed = False
+# Manifest key of the saved artifacts being served, another process (see SHARD_PROCESSES) may save newer ones
+served_manifest_key = None
+
+# Utterance journal state, appends and compaction are serialized by the lock
+journal_lock = threading.Lock()
+journal_file = None  # append handle, opened on the first add
+journal_entries = None  # number of entries in the journal, counted on first use
+journal_unsynced = 0  # appends since the last fsync
+journal_synced_at = 0.0  # time of the last fsync
+journal_timer = None  # fsyncs appends left unsynced by a batch that didn't fill up
 
 
 #######################
 # DATA / FILE METHODS #
 #######################
 
-def load_or_generate_data(force_generate=False, save_data=True):
+def load_or_generate_data(force_generate=False, save_data=True, incremental=False):
     """
     Load data if exists or generate data from intents
 
     Args:
         save_data (bool): whether to save the data to file
         force_generate (bool): set to True to force the re-generation of data
+        incremental (bool): keep the current dictionary layout when re-generating, see generate_data
     """
     if not force_generate and load_data():
         return
-    generate_data(save_data)
+    generate_data(save_data, incremental)
 
 
-def generate_data(save_data=True):
+def generate_data(save_data=True, incremental=False):
     """
-    Generate data from intents and load into global variables
+    Generate data from intents as the pending training data
 
     Args:
         save_data (bool): whether to save the data to file
+        incremental (bool): keep the served dictionary order and input width if the new words fit in the spare input slots
     """
-    global dictionary, intents, utterances, responses, train_x, train_y
+    global pending, train_x, train_y
 
-    # Step 1: load data from intents file
-    with open(PATH_INTENT) as f:
-        data = json.load(f)
+    # Step 1: load data from intents file and journal
+    data, corpus_hash = read_corpus()
 
-    # Reset global variables (in case of re-train)
+    # Start from scratch (in case of re-train)
+    previous_dictionary = snapshot.dictionary if incremental else ()
     dictionary = set()
     intents = []
     utterances = {}
     responses = {}
-    train_x, train_y = [], []
 
     # Step 2: convert intent sentences into token lists
     temp_x, temp_y = [], []
@@ -103,59 +196,423 @@ def generate_data(save_data=True):
     # - dictionary contains all tokens in all sentences
     # - responses contains intent => [responses...]
 
-    # Convert dictionary to sorted list to keep ordering
-    # TODO: in the future, if this project gets bigger, this will need optimization
-    #       the bag-of-words array is really sparse, consists of mostly 0's and only few 1's
-    #       compress by only remembering the location of 1's?
-    dictionary = sorted(dictionary)
-
-    # Step 3: create training data by converting strings into bag of words
-    for i, tokens in enumerate(temp_x):
-        # TODO: optimize by converting dictionary to dict with {token => index}? O(1) lookup cost
-        #       convert back to list afterwards? not sure, just an idea
-        #       cause right now the complexity is O(len(tokens) * len(dictionary)) => O(n^2)
-
-        # See bag_of_words method for more details here
-        x = [1 if word in tokens else 0 for word in dictionary]
-
-        # Y is basically an all-zero array but the target intent's index is 1
-        # There should be only one 1 here
-        # Example: target intent is "identity"
-        # - Intents: ["greeting", "farewell", "identity", "age", ...]
-        # - Y array: [         0,          0,          1,     0, ...]
-        y = [0] * len(data)  # len(data) = how many classes (intents) there are
-        y[intents.index(temp_y[i])] = 1
-        train_x.append(x)
-        train_y.append(y)
+    # Convert dictionary to a list to keep ordering, and index it for O(1) token lookup
+    # Incremental: known words keep their index (and trained input weights), new words take spare input slots
+    new_words = sorted(dictionary.difference(previous_dictionary))
+    if previous_dictionary and len(previous_dictionary) + len(new_words) <= snapshot.input_width:
+        dictionary = list(previous_dictionary) + new_words
+        input_width = snapshot.input_width
+    else:
+        dictionary = sorted(dictionary)
+        input_width = get_input_width(len(dictionary))
+    pending = ModelSnapshot.create(dictionary, input_width, intents, utterances, responses, corpus_hash)
+
+    # Step 3: create sparse training features, O(total tokens) instead of O(tokens * dictionary)
+    train_x = vectorize_batch(temp_x, pending.dictionary_index)
+    # Y is the index of the target intent, expanded to one-hot only at the model boundary (see one_hot)
+    # Example: target intent is "identity"
+    # - Intents: ["greeting", "farewell", "identity", "age", ...]
+    # - Y:       2
+    intent_index = {intent: i for i, intent in enumerate(intents)}
+    train_y = np.array([intent_index[intent] for intent in temp_y], dtype=np.int32)
 
     # Training data is now in train_x and train_y
 
     # Save this bag-of-words training data for faster access in the future
     if save_data:
-        with open(PATH_WORDS_DATA, "wb") as f:
-            pickle.dump((dictionary, intents, utterances, responses, train_x, train_y), f)
+        # The cached model no longer matches the saved data
+        invalidate_manifest()
+        save_dataset()
 
     # We are done here
 
 
+def save_dataset():
+    """
+    Save the pending training data as a dataset directory:
+    - indptr.npy, indices.npy: CSR bag-of-words features (int64 row pointers, int32 dictionary indices)
+    - labels.npy: int32 intent index of each row
+    - dictionary, intents, utterances (one per row) and responses: string tables, see save_strings
+    - response_labels.npy: int32 intent index of each response
+    - meta.json: format version, array sizes and corpus hash, written last
+    Every file is replaced atomically, the arrays are plain .npy so they can be memory-mapped
+    """
+    os.makedirs(PATH_DATASET, exist_ok=True)
+    indptr, indices = train_x
+    save_array("indptr", indptr.astype(np.int64))
+    save_array("indices", indices.astype(np.int32))
+    save_array("labels", train_y.astype(np.int32))
+
+    intent_index = {intent: i for i, intent in enumerate(pending.intents)}
+    responses = [(intent_index[intent], response) for intent, items in pending.responses.items() for response in items]
+    save_strings("dictionary", pending.dictionary)
+    save_strings("intents", pending.intents)
+    # Rows are generated intent by intent, in utterance order
+    save_strings("utterances", [utterance for intent in pending.intents for utterance in pending.utterances.get(intent, ())])
+    save_strings("responses", [response for _, response in responses])
+    save_array("response_labels", np.array([label for label, _ in responses], dtype=np.int32))
+
+    meta = {
+        "format": DATA_FORMAT_VERSION,
+        "rows": len(indptr) - 1,
+        "nnz": len(indices),
+        "input_width": pending.input_width,
+        "dictionary_size": len(pending.dictionary),
+        "intent_count": len(pending.intents),
+        "response_count": len(responses),
+        "corpus_hash": pending.corpus_hash
+    }
+    path = os.path.join(PATH_DATASET, "meta.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(path + ".tmp", path)
+
+
+def save_array(name, array):
+    """
+    Atomically save an array of the dataset as name.npy
+
+    Args:
+        name (str): array name
+        array (np.ndarray): array to save
+    """
+    path = os.path.join(PATH_DATASET, f"{name}.npy")
+    # np.save appends ".npy" to paths without it, write through a file object to keep the temporary name
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def save_strings(name, strings):
+    """
+    Save strings of the dataset as a string table: name.npy holds their UTF-8 bytes back to back (uint8),
+    name_offsets.npy where each one starts plus the end of the last one (int64)
+
+    Args:
+        name (str): table name
+        strings (Sequence[str]): strings to save
+    """
+    encoded = [string.encode() for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in encoded], out=offsets[1:])
+    save_array(name, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    save_array(f"{name}_offsets", offsets)
+
+
+def load_array(name):
+    """ Memory-map an array of the dataset, see save_array """
+    return np.load(os.path.join(PATH_DATASET, f"{name}.npy"), mmap_mode="r")
+
+
+def load_strings(name):
+    """
+    Memory-map a string table of the dataset, see save_strings
+
+    Returns:
+        Tuple(np.ndarray, np.ndarray): (UTF-8 bytes, offsets)
+    """
+    return load_array(name), load_array(f"{name}_offsets")
+
+
+def decode_strings(data, offsets):
+    """ Decode every string of a string table """
+    return [bytes(data[start:end]).decode() for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
 def load_data():
     """
-    Load previously saved data into global variables
+    Load previously saved data as the pending training data. The arrays are memory-mapped rather than read,
+    utterances and responses are only decoded once an intent's are looked up
 
     Returns:
         bool: whether the load is successful
     """
-    global dictionary, intents, utterances, responses, train_x, train_y
+    global pending, train_x, train_y
 
     # Check file existence and permissions
-    if not os.path.isfile(PATH_WORDS_DATA) or not os.access(PATH_WORDS_DATA, os.R_OK):
+    path = os.path.join(PATH_DATASET, "meta.json")
+    if not os.path.isfile(path) or not os.access(path, os.R_OK):
+        return False
+    with open(path) as f:
+        meta = json.load(f)
+    # Data saved in an older layout has to be regenerated
+    if meta.get("format") != DATA_FORMAT_VERSION:
+        return False
+
+    try:
+        indptr, indices, labels, response_labels = [load_array(name) for name in ("indptr", "indices", "labels", "response_labels")]
+        tables = {name: load_strings(name) for name in ("dictionary", "intents", "utterances", "responses")}
+    except (OSError, ValueError):
         return False
-    # Open file and load data
-    with open(PATH_WORDS_DATA, "rb") as f:
-        dictionary, intents, utterances, responses, train_x, train_y = pickle.load(f)
+    # Arrays from a different save than the header (interrupted save) can't be used
+    sizes = {"dictionary": meta["dictionary_size"], "intents": meta["intent_count"], "utterances": meta["rows"], "responses": meta["response_count"]}
+    if len(indptr) != meta["rows"] + 1 or len(indices) != meta["nnz"] or len(labels) != meta["rows"] or len(response_labels) != meta["response_count"]:
+        return False
+    if any(len(tables[name][1]) != size + 1 or len(tables[name][0]) != tables[name][1][-1] for name, size in sizes.items()):
+        return False
+
+    intents = decode_strings(*tables["intents"])
+    train_x, train_y = (indptr, indices), labels
+    pending = ModelSnapshot.create(decode_strings(*tables["dictionary"]), meta["input_width"], intents,
+                                   StringGroups(intents, *tables["utterances"], labels), StringGroups(intents, *tables["responses"], response_labels),
+                                   meta["corpus_hash"])
     return True
 
 
+def get_input_width(dictionary_size):
+    """
+    Input layer width for a dictionary, leaves VOCABULARY_HEADROOM spare slots for words added later
+
+    Args:
+        dictionary_size (int): number of words in the dictionary
+
+    Returns:
+        int: input layer width
+    """
+    spare = int(dictionary_size * (1 + VOCABULARY_HEADROOM))
+    return max(INPUT_WIDTH_STEP, -(-spare // INPUT_WIDTH_STEP) * INPUT_WIDTH_STEP)
+
+
+def read_corpus():
+    """
+    Read the intents file with the utterance journal replayed on top of it
+
+    Returns:
+        Tuple(Dict[str, Dict[str, List[str]]], str): (merged intents data, sha256 of its canonical JSON)
+    """
+    data, _ = merge_journal()
+    # Hash the content rather than the files, so compacting the journal doesn't invalidate the model cache
+    return data, hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def merge_journal():
+    """
+    Replay the utterance journal on top of the intents file
+
+    Returns:
+        Tuple(Dict[str, Dict[str, List[str]]], str): (merged intents data, id of the last journal entry or None)
+    """
+    # Journal first: compaction replaces the intents file before truncating the journal,
+    # so in this order a concurrent compaction can't make us miss entries
+    entries = []
+    if os.path.isfile(PATH_JOURNAL):
+        with open(PATH_JOURNAL) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # Torn write from a crash, only the last line can be affected
+                    continue
+    with open(PATH_INTENT) as f:
+        data = json.load(f)
+
+    # Entries up to the last compacted one are already in the intents file (compaction was interrupted before
+    # truncating the journal), replaying them would add their utterances twice
+    applied = data.pop(JOURNAL_APPLIED_KEY, None)
+    ids = [entry.get("id") for entry in entries]
+    if applied is not None and applied in ids:
+        entries = entries[ids.index(applied) + 1:]
+
+    for entry in entries:
+        patterns = data.get(entry["intent"], {}).get("patterns")
+        if patterns is not None:
+            patterns.append(entry["utterance"])
+
+    return data, ids[-1] if ids else applied
+
+
+def get_corpus_hash():
+    """
+    Hash the intents as they are on disk right now (intents file plus journal)
+
+    Returns:
+        str: sha256 hex digest of the merged intents
+    """
+    return read_corpus()[1]
+
+
+def get_artifact_key(data_hash, epochs):
+    """
+    Cache key of the saved data and model: changes whenever the intents or any hyperparameter change
+
+    Args:
+        data_hash (str): sha256 of the intents file
+        epochs (int): number of training epochs
+
+    Returns:
+        str: sha256 hex digest
+    """
+    # Preprocessing settings too: a tokenizer or stemmer change gives different words than the saved dictionary
+    hyperparameters = {"format": DATA_FORMAT_VERSION, "epochs": epochs, "hidden": HIDDEN_LAYERS, "batch_size": BATCH_SIZE,
+                       "tokenizer": TOKENIZER, "token_pattern": TOKEN_PATTERN.pattern, "stemmer": "lancaster",
+                       "vocabulary_headroom": VOCABULARY_HEADROOM, "input_width_step": INPUT_WIDTH_STEP}
+    return hashlib.sha256((data_hash + json.dumps(hyperparameters, sort_keys=True)).encode()).hexdigest()
+
+
+@contextlib.contextmanager
+def file_lock(path, shared=False, blocking=True):
+    """
+    Advisory lock between processes (e.g. bot processes of a sharded bot) sharing saved files, a no-op without fcntl, e.g.
+        with file_lock(PATH_MANIFEST + ".lock") as locked:
+            ...
+
+    Args:
+        path (str): lock file path, created if missing
+        shared (bool): take a shared (read) lock instead of an exclusive one
+        blocking (bool): wait for the lock instead of giving up right away
+
+    Yields:
+        bool: whether the lock is held
+    """
+    if fcntl is None:
+        yield True
+        return
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f.fileno(), (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def artifacts_lock(shared=False, blocking=True):
+    """ Lock of the saved data and model, held exclusively while they are rewritten and shared while they are loaded """
+    return file_lock(PATH_MANIFEST + ".lock", shared, blocking)
+
+
+def write_manifest(key, dictionary):
+    """
+    Record the cache key of the artifacts that were just saved, written last so a crash never leaves a valid-looking key
+
+    Args:
+        key (str): artifact cache key
+        dictionary (Sequence[str]): dictionary the model was trained with, in input order
+    """
+    temp_path = PATH_MANIFEST + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"key": key, "dictionary_hash": get_dictionary_hash(dictionary)}, f)
+    os.replace(temp_path, PATH_MANIFEST)
+
+
+def get_manifest():
+    """
+    Manifest of the saved artifacts, see write_manifest
+
+    Returns:
+        Dict[str, str]: {"key": artifact cache key, "dictionary_hash": ...}, empty while there are no complete artifacts
+    """
+    try:
+        with open(PATH_MANIFEST) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_manifest_key():
+    """
+    Cache key of the saved artifacts
+
+    Returns:
+        Optional[str]: artifact cache key, None while there are no complete artifacts
+    """
+    return get_manifest().get("key")
+
+
+def get_dictionary_hash(dictionary):
+    """
+    Hash a dictionary, input order included
+
+    Args:
+        dictionary (Sequence[str]): words in input order
+
+    Returns:
+        str: sha256 hex digest
+    """
+    return hashlib.sha256(json.dumps(list(dictionary)).encode()).hexdigest()
+
+
+def invalidate_manifest():
+    """ Forget the cache key, the saved artifacts are about to be overwritten """
+    if os.path.isfile(PATH_MANIFEST):
+        os.remove(PATH_MANIFEST)
+
+
+def load_cached(epochs=EPOCHS):
+    """
+    Load the saved data and model if they were built from the current intents file and hyperparameters.
+    Only the model is expensive to rebuild, a missing dataset (e.g. a fresh checkout ships the weights without it)
+    is regenerated, call with artifacts_lock held
+
+    Args:
+        epochs (int): number of training epochs the model should have been trained for
+
+    Returns:
+        bool: whether the cache was hit and everything is loaded
+    """
+    global served_manifest_key
+    manifest = get_manifest()
+    saved_key = manifest.get("key")
+    if saved_key is None:
+        return False
+
+    data_hash = get_corpus_hash()
+    if saved_key != get_artifact_key(data_hash, epochs):
+        return False
+    model_path = PATH_WEIGHTS if ENGINE == "numpy" else PATH_MODEL + ".index"
+    if not os.path.isfile(model_path):
+        return False
+    if not load_data() or pending.corpus_hash != data_hash:
+        # The regenerated dictionary has to be the one the model was trained with,
+        # incremental training orders it differently than a fresh generation
+        generate_data(save_data=False)
+        if pending.corpus_hash != data_hash or get_dictionary_hash(pending.dictionary) != manifest.get("dictionary_hash"):
+            return False
+        save_dataset()
+    load_model()
+    served_manifest_key = saved_key
+    return True
+
+
+def load_artifacts(blocking=True):
+    """
+    Load the saved data and model regardless of the cache key, used after a training process has written them
+
+    Args:
+        blocking (bool): wait while another process rewrites them, instead of giving up
+
+    Returns:
+        bool: whether the load is successful
+    """
+    global served_manifest_key
+    with artifacts_lock(shared=True, blocking=blocking) as locked:
+        if not locked:
+            return False
+        key = get_manifest_key()
+        if not load_data():
+            return False
+        load_model()
+        served_manifest_key = key
+        return True
+
+
+def reload_if_changed():
+    """
+    Load the saved data and model if another process saved newer ones than the served model, e.g. after an intent
+    reload in another bot process. Gives up without waiting while they are being rewritten
+
+    Returns:
+        bool: whether a new model was loaded
+    """
+    key = get_manifest_key()
+    if key is None or key == served_manifest_key:
+        return False
+    return load_artifacts(blocking=False)
+
+
 def add_utterance(intent, utterance):
     """
     Add a new utterance to the target intent
@@ -164,58 +621,353 @@ def add_utterance(intent, utterance):
         intent (str): intent to be modified
         utterance (str): utterance to be added
     """
-    global model_changed
-    assert intent in intents, f"Invalid intent \"{intent}\""
-    with open(PATH_INTENT) as f:
-        data = json.load(f)
-    data[intent]["patterns"].append(utterance)
-    with open(PATH_INTENT, "w") as f:
-        json.dump(data, f, indent=4)
+    global model_changed, journal_file, journal_entries, journal_unsynced, journal_timer
+    assert intent in snapshot.intents, f"Invalid intent \"{intent}\""
+
+    # Append to the journal instead of rewriting the whole intents file, it is merged in by read_corpus.
+    # Other bot processes append to the same journal, the file lock keeps compaction from dropping their entries
+    with journal_lock, file_lock(PATH_JOURNAL + ".lock"):
+        if journal_file is None:
+            journal_entries = count_journal_entries()
+            journal_file = open(PATH_JOURNAL, "a")
+            # Terminate a line torn by a crash, so the next entry starts on its own line
+            if journal_file.tell() > 0:
+                with open(PATH_JOURNAL, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        journal_file.write("\n")
+            # Appends left unsynced when the process exits are synced on the way out
+            atexit.register(close_journal)
+        # Each entry gets an id so replays can tell the compacted ones apart, see merge_journal
+        journal_file.write(json.dumps({"id": uuid.uuid4().hex, "intent": intent, "utterance": utterance}) + "\n")
+        journal_file.flush()
+        journal_entries += 1
+        journal_unsynced += 1
+
+        # Batch fsyncs, a crash loses at most a batch of moderator additions
+        if journal_unsynced >= JOURNAL_FSYNC_BATCH or time.time() - journal_synced_at >= JOURNAL_FSYNC_INTERVAL:
+            sync_journal_locked()
+        # A batch that doesn't fill up is synced by a timer rather than waiting for the next append
+        elif journal_timer is None:
+            journal_timer = threading.Timer(JOURNAL_FSYNC_INTERVAL, sync_journal)
+            journal_timer.daemon = True
+            journal_timer.start()
 
     model_changed = True
 
 
+def sync_journal():
+    """ Fsync appends to the utterance journal that aren't durable yet """
+    with journal_lock:
+        sync_journal_locked()
+
+
+def sync_journal_locked():
+    """ sync_journal, with journal_lock already held """
+    global journal_unsynced, journal_synced_at, journal_timer
+    if journal_timer is not None:
+        journal_timer.cancel()
+        journal_timer = None
+    if journal_file is not None and journal_unsynced:
+        os.fsync(journal_file.fileno())
+    journal_unsynced = 0
+    journal_synced_at = time.time()
+
+
+def close_journal():
+    """ Sync and close the utterance journal, the next add reopens it """
+    global journal_file
+    with journal_lock:
+        sync_journal_locked()
+        if journal_file is not None:
+            journal_file.close()
+        journal_file = None
+
+
+def count_journal_entries():
+    """
+    Count the entries in the utterance journal
+
+    Returns:
+        int: number of journal lines
+    """
+    if not os.path.isfile(PATH_JOURNAL):
+        return 0
+    with open(PATH_JOURNAL) as f:
+        return sum(1 for _ in f)
+
+
+def should_compact_journal():
+    """
+    Whether the journal has grown enough to be folded into the intents file
+
+    Returns:
+        bool: whether compact_journal should run
+    """
+    return (journal_entries or 0) >= JOURNAL_COMPACT_THRESHOLD
+
+
+def compact_journal():
+    """ Fold the utterance journal into the intents file, the intents file is replaced atomically """
+    global journal_file, journal_entries
+    with journal_lock, file_lock(PATH_JOURNAL + ".lock"):
+        data, last_entry = merge_journal()
+        data[JOURNAL_APPLIED_KEY] = last_entry
+
+        # Write the merged intents next to the original, make it durable, then swap it in
+        temp_path = PATH_INTENT + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, PATH_INTENT)
+
+        # Start a fresh journal, after a crash here the replay skips the entries up to the recorded one.
+        # Pending appends are durable in the new intents file, this also resets the fsync batch
+        sync_journal_locked()
+        if journal_file is not None:
+            journal_file.close()
+        journal_file = open(PATH_JOURNAL, "w")
+        os.fsync(journal_file.fileno())
+        journal_entries = 0
+
+
 ##########################
 # NEURAL NETWORK METHODS #
 ##########################
 
-def create_and_train_model(epochs=1000, save_model=True):
+def create_and_train_model(epochs=EPOCHS, save_model=True, warm_start=False, progress_callback=None):
     """
-    Create and train the neural network
+    Create and train the neural network, then export its weights for the NumPy engine
 
     Args:
-        epochs (int): number of epochs to train for
+        epochs (int): number of epochs to train for, a warm start trains for FINE_TUNE_EPOCHS instead
         save_model (bool): whether to save the trained model to file
+        warm_start (bool): fine-tune the served weights instead of training from random init, when they are compatible
+        progress_callback (function): called as progress_callback(epoch, epochs, loss) after every epoch
+
+    Returns:
+        bool: whether the model was warm-started
     """
-    global model, train_x, train_y
-    model = None
+    global served_manifest_key
+    import tflearn
+    import tensorflow as tf
+
+    # The served model keeps serving until the new one is published
+    data = pending
+    initial_engine = get_warm_start_engine() if warm_start else None
+    key_epochs = epochs
+    if initial_engine is not None:
+        # A fine-tuned model stands in for a full run on the same data
+        epochs = FINE_TUNE_EPOCHS
 
     # Build model
     with tf.Graph().as_default():
-        # Input layer's shape is basically the number of unique words in the dictionary
-        net = tflearn.input_data(shape=[None, len(train_x[0])])
-        net = tflearn.fully_connected(net, 8)
-        net = tflearn.fully_connected(net, 8)
+        # Input layer's shape is the number of unique words in the dictionary plus spare slots for new words
+        net = tflearn.input_data(shape=[None, data.input_width])
+        layers = []
+        for width in HIDDEN_LAYERS:
+            layers.append(tflearn.fully_connected(layers[-1] if layers else net, width))
         # Output layer's shape is basically the number of intents
         # Softmax activation will output a "confidence" percentage, range=[0, 1]
-        net = tflearn.fully_connected(net, len(train_y[0]), activation="softmax")
-        net = tflearn.regression(net)
-        model = tflearn.DNN(net)
+        layers.append(tflearn.fully_connected(layers[-1], len(data.intents), activation="softmax"))
+        net = tflearn.regression(layers[-1])
+        dnn = tflearn.DNN(net)
+
+        # Start from the current weights
+        if initial_engine is not None:
+            for layer, w, b in zip(layers, initial_engine.weights, initial_engine.biases):
+                dnn.set_weights(layer.W, w)
+                dnn.set_weights(layer.b, b)
+
+        # Report progress through a tflearn callback
+        callbacks = []
+        if progress_callback is not None:
+            class ProgressCallback(tflearn.callbacks.Callback):
+                def on_epoch_end(self, training_state):
+                    progress_callback(training_state.epoch, epochs, training_state.global_loss)
+            callbacks.append(ProgressCallback())
 
         # Train model
-        model.fit(train_x, train_y, n_epoch=epochs, batch_size=8, show_metric=True)
+        dnn.fit(densify(*train_x, data.input_width), one_hot(train_y, len(data.intents)), n_epoch=epochs, batch_size=BATCH_SIZE, show_metric=True, callbacks=callbacks)
+
+        # Export weights (hidden layers use tflearn's default linear activation)
+        engine = NumpyEngine([dnn.get_weights(layer.W) for layer in layers], [dnn.get_weights(layer.b) for layer in layers],
+                             ["linear"] * len(HIDDEN_LAYERS) + ["softmax"])
 
-        # Save model
+        # Save model, then mark the artifacts as matching the data they were trained on
         if save_model:
-            model.save(PATH_MODEL)
+            dnn.save(PATH_MODEL)
+            engine.save(PATH_WEIGHTS)
+            served_manifest_key = get_artifact_key(data.corpus_hash, key_epochs)
+            write_manifest(served_manifest_key, data.dictionary)
+
+    publish(data._replace(engine=engine if ENGINE == "numpy" else dnn))
+    return initial_engine is not None
+
+
+def get_served_weights():
+    """
+    Weights of the served model as a NumPy engine, whatever engine is serving
+
+    Returns:
+        Optional[NumpyEngine]: served weights, None if there is no model
+    """
+    current = snapshot
+    if isinstance(current.engine, NumpyEngine):
+        return current.engine
+    if current.engine is not None and os.path.isfile(PATH_WEIGHTS):
+        return NumpyEngine.load(PATH_WEIGHTS)
+    return None
+
+
+def get_warm_start_engine():
+    """
+    Weights of the served model, if the pending data can be trained on top of them:
+    same intents, same input width, and the served dictionary is a prefix of the pending one
+
+    Returns:
+        Optional[NumpyEngine]: served weights, None if a warm start isn't possible
+    """
+    current, data = snapshot, pending
+    if not current.dictionary or current.intents != data.intents or data.dictionary[:len(current.dictionary)] != current.dictionary:
+        return None
+    engine = get_served_weights()
+    if engine is None:
+        return None
+    shapes = [w.shape[1] for w in engine.weights]
+    if engine.input_width != data.input_width or shapes != HIDDEN_LAYERS + [len(data.intents)]:
+        return None
+    return engine
 
 
 def load_model():
-    """ Load model from disk """
-    # TODO: check correctness of this cause tflearn is wonk
-    global model
-    model = tflearn.DNN(None)
-    model.load(PATH_MODEL)
+    """ Load model from disk and publish it with the pending data, it is assumed to be trained on that data """
+    if ENGINE == "numpy":
+        engine = NumpyEngine.load(PATH_WEIGHTS)
+    else:
+        # TODO: check correctness of this cause tflearn is wonk
+        import tflearn
+        engine = tflearn.DNN(None)
+        engine.load(PATH_MODEL)
+    publish(pending._replace(engine=engine))
+
+
+def publish(new_snapshot):
+    """
+    Start serving a snapshot, a single reference assignment so predictions never see a mix of two snapshots
+
+    Args:
+        new_snapshot (ModelSnapshot): snapshot with an engine
+    """
+    global snapshot
+    assert new_snapshot.engine is not None, "Only snapshots with a model can be served!"
+    snapshot = new_snapshot._replace(version=next(snapshot_versions))
+    # Entries of older versions can never hit again, free them right away
+    prediction_cache.clear()
+
+
+def read_checkpoint(path):
+    """
+    Read the weights of a saved tflearn model as a NumPy engine, needs TensorFlow but not tflearn
+
+    Args:
+        path (str): checkpoint path, as given to tflearn.DNN.save
+
+    Returns:
+        NumpyEngine: engine with the checkpoint's weights
+    """
+    import tensorflow as tf
+
+    reader = tf.train.load_checkpoint(path)
+    # tflearn names fully connected layers FullyConnected, FullyConnected_1, ... in creation order
+    scopes = ["FullyConnected"] + [f"FullyConnected_{i}" for i in range(1, len(HIDDEN_LAYERS) + 1)]
+    return NumpyEngine([reader.get_tensor(f"{scope}/W") for scope in scopes], [reader.get_tensor(f"{scope}/b") for scope in scopes],
+                       ["linear"] * len(HIDDEN_LAYERS) + ["softmax"])
+
+
+def export_checkpoint(epochs=EPOCHS):
+    """
+    Export the saved tflearn model for the NumPy engine without retraining: regenerates the data from the intents,
+    saves the weights and marks them as matching the data, so a bot without TensorFlow loads them from the cache
+
+    Args:
+        epochs (int): number of training epochs the checkpoint was trained for
+    """
+    global served_manifest_key
+    with artifacts_lock():
+        generate_data()
+        engine = read_checkpoint(PATH_MODEL)
+        width = engine.input_width
+        assert len(pending.dictionary) <= width <= pending.input_width and engine.weights[-1].shape[1] == len(pending.intents), \
+            f"{engine} wasn't trained on the current intents!"
+        # Models trained before the spare input slots are narrower, words added later start with zero weights anyway
+        engine.weights[0] = np.vstack([engine.weights[0], np.zeros((pending.input_width - width, engine.weights[0].shape[1]), dtype=np.float32)])
+
+        engine.save(PATH_WEIGHTS)
+        served_manifest_key = get_artifact_key(pending.corpus_hash, epochs)
+        write_manifest(served_manifest_key, pending.dictionary)
+    publish(pending._replace(engine=engine))
+
+
+def load_tflearn_model(path):
+    """
+    Rebuild the tflearn network of a saved model and restore its weights, needs tflearn.
+    Must be called (and predicted with) inside a fresh tf.Graph().as_default() block
+
+    Args:
+        path (str): checkpoint path, as given to tflearn.DNN.save
+
+    Returns:
+        Tuple(tflearn.DNN, int): (restored model, its input width), export_checkpoint may have widened the NumPy engine's
+    """
+    import tflearn
+
+    # Layer sizes come from the checkpoint, the graph itself is built the same way as in create_and_train_model
+    shapes = read_checkpoint(path)
+    net = tflearn.input_data(shape=[None, shapes.input_width])
+    for width in HIDDEN_LAYERS:
+        net = tflearn.fully_connected(net, width)
+    net = tflearn.fully_connected(net, shapes.weights[-1].shape[1], activation="softmax")
+    dnn = tflearn.DNN(tflearn.regression(net))
+    dnn.load(path)
+    return dnn, shapes.input_width
+
+
+def get_parity_messages():
+    """
+    Messages the parity checks run on: every utterance of the intents (journal included) plus PARITY_MESSAGES
+
+    Returns:
+        List[str]: messages
+    """
+    return [pattern for intent_data in read_corpus()[0].values() for pattern in intent_data["patterns"]] + PARITY_MESSAGES
+
+
+def check_engine_parity(messages=None, tolerance=1e-5):
+    """
+    Compare the saved NumPy engine against the saved tflearn model, needs tflearn and the pending data
+
+    Args:
+        messages (List[str]): messages to compare on, defaults to get_parity_messages
+        tolerance (float): maximum allowed absolute difference between the two engines' confidences
+
+    Returns:
+        float: maximum absolute difference found
+    """
+    import tensorflow as tf
+
+    indptr, indices = vectorize_batch([preprocess(message) for message in (messages or get_parity_messages())], pending.dictionary_index)
+    x = densify(indptr, indices, pending.input_width)
+    with tf.Graph().as_default():
+        dnn, width = load_tflearn_model(PATH_MODEL)
+        # Columns past the checkpoint's input width are spare slots exported with zero weights
+        expected = np.array(dnn.predict(x[:, :width]))
+
+    engine = NumpyEngine.load(PATH_WEIGHTS)
+    difference = max(float(np.abs(engine.predict(x) - expected).max()), float(np.abs(engine.predict_sparse(indptr, indices) - expected).max()))
+    assert difference <= tolerance, f"NumPy engine differs from tflearn by {difference}!"
+    return difference
 
 
 def predict(message):
@@ -228,27 +980,60 @@ def predict(message):
     Returns:
         Tuple(str, float, Dict[str, float]): (predicted response, confidence, entire result as a dict)
     """
-    assert model is not None, "Model must be initialized before predicting!"
+    return predict_batch([message])[0]
+
+
+def predict_batch(messages):
+    """
+    Generate responses for several input messages with a single model forward pass
+
+    Args:
+        messages (List[str]): input messages
+
+    Returns:
+        List[Tuple(str, float, Dict[str, float])]: (predicted response, confidence, entire result as a dict) for each message
+    """
+    # Read the served snapshot once, a reload publishing a new one meanwhile doesn't affect this call
+    current = snapshot
+    assert current.engine is not None, "Model must be initialized before predicting!"
 
     # Since model uses softmax, results should look something like this:
     # > [0.003, 0.0001, 0.02, 0.34, 0.09, 0.80, 0.17, ...]
     # - float in each position representing confidence
-    # - index represent index in the "intents" list (global)
-    results = model.predict([bag_of_words(preprocess(message))])[0]
-
-    # We save the index of the maximum confidence
-    index = np.argmax(results)
-    # Convert index into intent
-    intent = intents[index]
-    # Return a random response of that intent
-    return random.choice(responses[intent]), results[index], {intents[a]: results[a] for a in range(len(results))}
+    # - index represent index in the snapshot's intents
+    token_lists = [preprocess(message) for message in messages]
+    keys = [PredictionCache.get_key(current.version, tokens) for tokens in token_lists]
+    batch_results = [prediction_cache.get(key) for key in keys]
+
+    # Run the model only on the messages we haven't seen yet
+    missed = [i for i, results in enumerate(batch_results) if results is None]
+    if missed:
+        indptr, indices = vectorize_batch([token_lists[i] for i in missed], current.dictionary_index)
+        if hasattr(current.engine, "predict_sparse"):
+            missed_results = current.engine.predict_sparse(indptr, indices)
+        else:
+            missed_results = current.engine.predict(densify(indptr, indices, current.input_width))
+        for i, results in zip(missed, missed_results):
+            batch_results[i] = np.array(results)
+            prediction_cache.put(keys[i], batch_results[i])
+
+    intents = current.intents
+    output = []
+    for results in batch_results:
+        # We save the index of the maximum confidence
+        index = np.argmax(results)
+        # Convert index into intent
+        intent = intents[index]
+        # Pick a random response of that intent, on cache hits too so answers keep varying
+        output.append((random.choice(current.responses[intent]), results[index], {intents[a]: results[a] for a in range(len(results))}))
+    return output
 
 
 ###################
 # UTILITY METHODS #
 ###################
 
-def preprocess(message):
+def preprocess(message, tokenizer=None):
     """
     Preprocesses the message into a list of tokens by tokenizing and stemming
     e.g.
@@ -260,6 +1045,7 @@ def preprocess(message):
 
     Args:
         message (str): message to preprocess
+        tokenizer (str): any of {"regex", "nltk"}, defaults to TOKENIZER
 
     Returns:
         List[str]: list of preprocessed tokens (tokenized and stemmed)
@@ -270,10 +1056,9 @@ def preprocess(message):
 
     output = []
     # Tokenize message (split string into small tokens)
-    words = nltk.word_tokenize(message)
-    for word in words:
+    for word in tokenize(message, tokenizer):
         # Stem each word (eg. flying becomes fly after stemming)
-        word = stemmer.stem(word)
+        word = stem(word)
         # TODO: apply rules to filter tokens in the future, simple rules for now
         if word in ",.?!~" or len(word) <= 1:
             continue
@@ -281,44 +1066,223 @@ def preprocess(message):
     return output
 
 
-def bag_of_words(tokens):
+def tokenize(message, tokenizer=None):
+    """
+    Splits the message into tokens
+
+    Args:
+        message (str): message to tokenize
+        tokenizer (str): any of {"regex", "nltk"}, defaults to TOKENIZER
+
+    Returns:
+        List[str]: list of tokens
+    """
+    if (tokenizer or TOKENIZER) == "nltk":
+        return nltk_tokenize(message)
+
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(message):
+        token = match.group()
+        # Like Treebank, opening double quotes become `` and closing ones become ''
+        if token == "\"" or token == "''":
+            start = match.start()
+            token = "``" if start == 0 or message[start - 1].isspace() or message[start - 1] in "([{<" else "''"
+        tokens.append(token)
+    return tokens
+
+
+def nltk_tokenize(message):
     """
-    Generates a bag-of-words representation of the token list, uses the global dictionary
+    Splits the message into tokens with nltk's word_tokenize. Without the Punkt data, sentences are split at
+    sentence-ending punctuation instead, which only differs from Punkt on abbreviations (e.g. "Mr. Smith")
+
+    Args:
+        message (str): message to tokenize
+
+    Returns:
+        List[str]: list of tokens
+    """
+    import nltk
+    try:
+        return nltk.word_tokenize(message)
+    except LookupError:
+        from nltk.tokenize import NLTKWordTokenizer
+        tokenizer = NLTKWordTokenizer()
+        return [token for sentence in SENTENCE_PATTERN.split(message) for token in tokenizer.tokenize(sentence)]
+
+
+@functools.lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(word):
+    """
+    Stems a token, memoized since the same words come up over and over
+
+    Args:
+        word (str): token
+
+    Returns:
+        str: stemmed token
+    """
+    global stemmer
+    if stemmer is None:
+        from nltk.stem.lancaster import LancasterStemmer
+        stemmer = LancasterStemmer()
+    return stemmer.stem(word)
+
+
+def check_tokenizer_parity(messages=None):
+    """
+    Compare the regex tokenizer against nltk on the intent utterances and PARITY_MESSAGES (or the given messages)
+
+    Args:
+        messages (List[str]): messages to compare, defaults to every utterance in the intents file plus PARITY_MESSAGES
+
+    Returns:
+        List[Tuple(str, List[str], List[str])]: (message, nltk tokens, regex tokens) of every message where they differ
+    """
+    if messages is None:
+        messages = get_parity_messages()
+
+    mismatches = []
+    for message in messages:
+        expected, actual = preprocess(message, "nltk"), preprocess(message, "regex")
+        if expected != actual:
+            mismatches.append((message, expected, actual))
+    return mismatches
+
+
+def vectorize(tokens, dictionary_index=None):
+    """
+    Generates a sparse bag-of-words representation of the token list: the sorted dictionary indices of the known tokens
     e.g.
         Dict:   ["apple", "hello", "orange", "pineapple", "world", "again"]
         Before: [         "hello",                        "world", "again"]
-        After:  [      0,       1,        0,           0,       1,       1]
+        After:  [1, 4, 5]
 
     Args:
         tokens (List[str]): list of preprocessed tokens (tokenized and stemmed)
+        dictionary_index (Mapping[str, int]): {token => index}, defaults to the served snapshot's
 
     Returns:
-        np.array: numpy array of the bag-of-words representation of the token list
+        np.array: int32 numpy array of dictionary indices, O(len(tokens)) to build
     """
-    global dictionary
-    tokens = set(tokens)
-    # TODO: again, this could be faster with an improved dictionary data structure
-    #       Currently O(len(dictionary)), can be improved to O(len(tokens))
-    bag = [1 if word in tokens else 0 for word in dictionary]
-    assert len(bag) == len(dictionary), "INVALID BAG-OF-WORDS MODEL! THIS SHOULDN'T HAPPEN! OH NO!"
-    return np.array(bag)
+    if dictionary_index is None:
+        dictionary_index = snapshot.dictionary_index
+    return np.array(sorted({dictionary_index[word] for word in tokens if word in dictionary_index}), dtype=np.int32)
 
 
-if __name__ == "__main__":
-    # Change path
-    PATH_INTENT = "intents.json"
-    PATH_WORDS_DATA = "data/bag_of_words.pickle"
-    PATH_MODEL = "models/primitive.tflearn"
+def vectorize_batch(token_lists, dictionary_index=None):
+    """
+    Generates a sparse bag-of-words matrix of several token lists in CSR form (row i owns indices[indptr[i]:indptr[i + 1]])
+
+    Args:
+        token_lists (List[List[str]]): list of preprocessed token lists
+        dictionary_index (Mapping[str, int]): {token => index}, defaults to the served snapshot's
+
+    Returns:
+        Tuple(np.array, np.array): (indptr, indices) of the CSR matrix
+    """
+    if dictionary_index is None:
+        dictionary_index = snapshot.dictionary_index
+    rows = [vectorize(tokens, dictionary_index) for tokens in token_lists]
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(row) for row in rows])
+    indices = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32)
+    return indptr, indices
+
+
+def densify(indptr, indices, width):
+    """
+    Expands a CSR bag-of-words matrix into a dense 0/1 matrix, only done at the model boundary
+
+    Args:
+        indptr (np.array): CSR row pointers
+        indices (np.array): CSR column indices
+        width (int): number of columns (model input width)
+
+    Returns:
+        np.array: float32 matrix of shape (rows, width)
+    """
+    dense = np.zeros((len(indptr) - 1, width), dtype=np.float32)
+    dense[np.repeat(np.arange(len(indptr) - 1), np.diff(indptr)), indices] = 1
+    return dense
+
+
+def one_hot(labels, classes):
+    """
+    Expands intent indices into one-hot rows, only done at the model boundary
+
+    Args:
+        labels (np.array): intent index of each row
+        classes (int): number of intents
+
+    Returns:
+        np.array: float32 matrix of shape (rows, classes)
+    """
+    return np.eye(classes, dtype=np.float32)[np.asarray(labels)]
 
-    # Generate data
-    print(f"Generating training data... ", end="")
-    generate_data()
-    print(f"OK!")
 
-    # Train new model
-    print(f"Creating and training the model... ", end="")
-    create_and_train_model()
-    print(f"OK!")
+def bag_of_words(tokens):
+    """
+    Generates a dense bag-of-words representation of the token list, uses the served snapshot's dictionary
+    e.g.
+        Dict:   ["apple", "hello", "orange", "pineapple", "world", "again"]
+        Before: [         "hello",                        "world", "again"]
+        After:  [      0,       1,        0,           0,       1,       1]
+
+    Args:
+        tokens (List[str]): list of preprocessed tokens (tokenized and stemmed)
+
+    Returns:
+        np.array: numpy array of the bag-of-words representation of the token list
+    """
+    current = snapshot
+    bag = np.zeros(current.input_width, dtype=np.int64)
+    bag[vectorize(tokens, current.dictionary_index)] = 1
+    return bag
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train, export and check the intent model, e.g. python -m src.nlp.PrimitiveModel export")
+    parser.add_argument("command", nargs="?", default="train", choices=["train", "export", "check", "chat"],
+                        help="train: train a new model, export: export the saved tflearn model for the NumPy engine, "
+                             "check: compare the tokenizers and engines, chat: talk to the saved model")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        # Generate data
+        print(f"Generating training data... ", end="")
+        generate_data()
+        print(f"OK!")
+
+        # Train new model
+        print(f"Creating and training the model... ", end="")
+        create_and_train_model()
+        print(f"OK!")
+    elif args.command == "export":
+        print(f"Exporting the saved model... ", end="")
+        export_checkpoint()
+        print(f"OK! ({snapshot.engine})")
+    else:
+        print(f"Loading the saved model... ", end="")
+        with artifacts_lock():
+            loaded = load_cached()
+        print(f"OK!" if loaded else f"the saved model doesn't match the intents, train or export it first")
+        if not loaded:
+            return
+
+    if args.command != "chat":
+        # Make sure the fast tokenizer agrees with nltk on the corpus
+        print(f"Checking tokenizer parity... ", end="")
+        tokenizer_mismatches = check_tokenizer_parity()
+        for mismatch in tokenizer_mismatches:
+            print(f"\n  \"{mismatch[0]}\": nltk {mismatch[1]} != regex {mismatch[2]}", end="")
+        print(f"OK!" if not tokenizer_mismatches else "")
+
+        # Make sure the exported NumPy engine serves the same results as tflearn
+        print(f"Checking NumPy engine parity... ", end="")
+        print(f"OK! (max difference {check_engine_parity():.2e})")
+    if args.command not in ("chat", "train"):
+        return
 
     # Test the model
     while True:
@@ -328,3 +1292,7 @@ if __name__ == "__main__":
 
         response, confidence, results = predict(message)
         print(response)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# Built-in imports
+import asyncio
+import multiprocessing
+import queue
+import time
+
+# Project imports
+from src.nlp import PrimitiveModel
+from src.nlp.ModelSnapshot import ModelSnapshot
+
+# TensorFlow isn't fork-safe and the bot process may not even have it, always start a fresh interpreter
+CONTEXT = multiprocessing.get_context("spawn")
+
+# Module settings copied into the training process, so it writes to the same artifacts the bot serves from
+SETTINGS = ["PATH_INTENT", "PATH_JOURNAL", "PATH_DATASET", "PATH_MODEL", "PATH_WEIGHTS", "PATH_MANIFEST", "ENGINE"]
+
+
+class TrainingWorker:
+    """ Regenerates data and trains the model in a separate process, streaming progress back to the bot """
+
+    def __init__(self, incremental=True):
+        """
+        Prepare a training run, call start to launch the process
+
+        Args:
+            incremental (bool): keep the dictionary layout and fine-tune the current weights when possible
+        """
+        self.incremental = incremental
+        self.messages = CONTEXT.Queue()
+        self.process = None
+
+        # Latest known state of the run
+        self.stage = 0  # 0 = generating data, 1 = training, 2 = done
+        self.epoch = 0
+        self.epochs = 0
+        self.loss = None
+        self.warm_started = False
+        self.error = None
+
+    def start(self):
+        """ Launch the training process with a copy of the currently served model state """
+        settings = {name: getattr(PrimitiveModel, name) for name in SETTINGS}
+        # Hand over the served weights and their dictionary so the worker can warm-start from them
+        current = PrimitiveModel.snapshot
+        state = (PrimitiveModel.get_served_weights(), current.dictionary, current.intents, current.input_width) if self.incremental else None
+        self.process = CONTEXT.Process(target=run, args=(settings, self.incremental, state, self.messages), daemon=True)
+        self.process.start()
+
+    async def wait(self, on_progress=None, poll_interval=0.5):
+        """
+        Wait for the training process to finish, without blocking the event loop
+
+        Args:
+            on_progress (function): coroutine function called as on_progress(worker) whenever the state changes
+            poll_interval (float): how often (seconds) to check for new messages
+
+        Returns:
+            bool: whether training succeeded and new artifacts are on disk
+        """
+        while True:
+            changed = False
+            finished = False
+            while True:
+                try:
+                    kind, payload = self.messages.get_nowait()
+                except queue.Empty:
+                    break
+                changed = True
+                if kind == "stage":
+                    self.stage = payload
+                elif kind == "progress":
+                    self.epoch, self.epochs, self.loss = payload
+                elif kind == "done":
+                    self.stage, self.warm_started = 2, payload
+                    finished = True
+                elif kind == "error":
+                    self.error = payload
+                    finished = True
+
+            if changed and on_progress is not None:
+                await on_progress(self)
+            if finished:
+                break
+            # The process died without reporting (killed, segfault in TensorFlow, ...)
+            if not self.process.is_alive() and self.messages.empty():
+                self.error = f"training process exited with code {self.process.exitcode}"
+                break
+            await asyncio.sleep(poll_interval)
+
+        self.process.join()
+        return self.error is None
+
+
+def run(settings, incremental, state, messages):
+    """
+    Entry point of the training process
+
+    Args:
+        settings (Dict[str, Any]): PrimitiveModel module settings of the bot process
+        incremental (bool): keep the dictionary layout and fine-tune the current weights when possible
+        state (Tuple): (weights, dictionary, intents, input width) of the served model, None to train from scratch
+        messages (multiprocessing.Queue): queue of (kind, payload) messages back to the bot
+    """
+    try:
+        for name, value in settings.items():
+            setattr(PrimitiveModel, name, value)
+        if state is not None:
+            engine, dictionary, intents, input_width = state
+            PrimitiveModel.snapshot = ModelSnapshot.create(dictionary, input_width, intents, engine=engine)
+
+        # Other bot processes may be rewriting the same artifacts, wait for them rather than mixing two runs
+        with PrimitiveModel.artifacts_lock():
+            train(incremental, messages)
+    except Exception as e:
+        messages.put(("error", repr(e)))
+
+
+def train(incremental, messages):
+    """ Regenerate data and train, reporting progress, see run """
+    PrimitiveModel.generate_data(incremental=incremental)
+    messages.put(("stage", 1))
+
+    # Don't flood the queue, a few updates per second is plenty for a status embed
+    last_report = [0.0]
+
+    def on_epoch(epoch, epochs, loss):
+        if time.time() - last_report[0] >= 0.5 or epoch == epochs:
+            last_report[0] = time.time()
+            messages.put(("progress", (epoch, epochs, float(loss) if loss is not None else None)))
+
+    warm_started = PrimitiveModel.create_and_train_model(warm_start=incremental, progress_callback=on_epoch)
+    messages.put(("done", warm_started))
@@ -1,17 +1,11 @@
-# Built-in imports
-import asyncio
-
 # Project imports
 from src.data import Color, Config, Emoji
 from src.utils.CommandHandler import CommandHandler
+from src.utils.TaskScheduler import Cron
 from src.utils import TimeUtil
 
 # External imports
 import discord
-import schedule
-
-# Async IO
-LOOP = asyncio.get_event_loop()
 
 # Genshin Channel ID
 GENSHIN_CHANNEL_ID = 754050070349086720
@@ -28,18 +22,19 @@ DAYS_DOMAIN = {
 }
 
 
-def change_description(bot):
-    channel = bot.get_channel(GENSHIN_CHANNEL_ID)
+async def change_description(bot, trigger):
+    await bot.wait_until_ready()
+    channel = await bot.channel_cache.get(GENSHIN_CHANNEL_ID)
     assert type(channel) is discord.TextChannel, "Invalid channel found!"
 
-    async def edit():
-        await channel.edit(topic=DAYS_DOMAIN[TimeUtil.get_now_weekday()])
-
-    LOOP.create_task(edit())
+    # Weekday in the same time zone as the trigger
+    topic = DAYS_DOMAIN[TimeUtil.get_now_weekday(trigger.timezone)]
+    await bot.send_scheduler.submit(channel, lambda: channel.edit(topic=topic), route="channel_edit")
 
 
 ###############################################################
 
 def register_all(bot):
-    """ Register all commands in this module """
-    schedule.every().day.at("00:00").do(change_description, bot)
+    """ Register all tasks in this module """
+    daily = Cron("0 0 * * *")
+    bot.task_scheduler.add("genshin_description", lambda: change_description(bot, daily), daily)
@@ -0,0 +1,212 @@
+# Built-in imports
+import asyncio
+import io
+import tempfile
+
+# Project imports
+from src.data import Config
+
+# External imports
+import aiohttp
+import discord
+
+# Download chunk size, also the most a spooled download holds in memory at once
+CHUNK_SIZE = 64 * 1024
+
+
+class ByteBudget:
+    """ Async semaphore counted in bytes, bounds how much attachment data is held in memory at once """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.available = capacity
+        self.condition = asyncio.Condition()
+
+    async def acquire(self, size):
+        size = min(size, self.capacity)
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.available >= size)
+            self.available -= size
+        return size
+
+    async def release(self, size):
+        async with self.condition:
+            self.available += size
+            self.condition.notify_all()
+
+
+class AttachmentRelay:
+    """ Re-uploads message attachments: downloads them concurrently, then packs them into as few messages as possible """
+
+    def __init__(self, bot, memory_budget=Config.RELAY_MEMORY_BUDGET, spool_threshold=Config.RELAY_SPOOL_THRESHOLD,
+                 files_per_message=Config.RELAY_FILES_PER_MESSAGE):
+        """
+        Initialize an attachment relay, owned by the bot
+
+        Args:
+            bot (BotClient): bot instance
+            memory_budget (int): bytes of attachments held in memory at once, shared by all relays in progress
+            spool_threshold (int): attachments larger than this many bytes are downloaded to temp files instead of memory
+            files_per_message (int): maximum number of files per uploaded message (Discord allows 10)
+        """
+        assert spool_threshold <= memory_budget, "Attachments kept in memory must fit in the memory budget!"
+        self.bot = bot
+        self.memory_budget = memory_budget
+        self.spool_threshold = spool_threshold
+        self.files_per_message = files_per_message
+
+        # Created on the bot's loop by the first relay
+        self.budget = None
+        self.session = None
+
+    async def relay(self, sent_message, attachments):
+        """
+        Reply to a message with copies of attachments, each file keeps its "Attached file" caption
+
+        Args:
+            sent_message (discord.Message): message to reply to
+            attachments (List[discord.Attachment]): attachments to copy
+        """
+        if not attachments:
+            return
+        if self.budget is None:
+            self.budget = ByteBudget(self.memory_budget)
+        guild = sent_message.guild
+        upload_limit = guild.filesize_limit if guild is not None else Config.RELAY_DEFAULT_UPLOAD_LIMIT
+
+        # Files the upload limit rejects anyway are linked instead of downloaded, so are failed downloads
+        unavailable = [attachment for attachment in attachments if attachment.size > upload_limit]
+        groups = self.pack([attachment for attachment in attachments if attachment.size <= upload_limit], upload_limit)
+
+        # Start downloading every group right away (memory permitting), upload them in order as they complete.
+        # Groups reserve memory in upload order: a relay only ever holds memory for the groups it will upload next
+        reservations = [asyncio.Event() for _ in groups]
+        downloads = [asyncio.ensure_future(self.download_group(group, reservations[i - 1] if i else None, reservations[i]))
+                     for i, group in enumerate(groups)]
+        uploaded = 0
+        try:
+            for download in downloads:
+                files, reserved, failed = await download
+                uploaded += 1
+                try:
+                    if files:
+                        captions = "\n".join(f"Attached file `{file.filename}`:" for file in files)
+                        await self.bot.send_scheduler.submit(sent_message.channel, lambda: sent_message.reply(content=captions, files=files))
+                finally:
+                    await self.discard(files, reserved)
+                unavailable.extend(failed)
+        finally:
+            # Relay failed or was cancelled halfway, free whatever the remaining groups already hold
+            for download in downloads[uploaded:]:
+                if not download.done():
+                    download.cancel()
+                elif not download.cancelled() and download.exception() is None:
+                    await self.discard(*download.result()[:2])
+
+        for attachment in unavailable:
+            content = f"Attached file `{attachment.filename}` (could not be re-uploaded): {attachment.url}"
+            await self.bot.send_scheduler.submit(sent_message.channel, lambda: sent_message.reply(content=content))
+
+    def pack(self, attachments, upload_limit):
+        """
+        Split attachments into upload groups, in order, that respect the file count, upload size and memory limits
+
+        Args:
+            attachments (List[discord.Attachment]): attachments that fit the upload limit on their own
+            upload_limit (int): maximum bytes per uploaded message
+
+        Returns:
+            List[List[discord.Attachment]]: upload groups
+        """
+        groups = []
+        group, group_size, group_memory = [], 0, 0
+        for attachment in attachments:
+            memory = attachment.size if attachment.size <= self.spool_threshold else 0
+            if group and (len(group) >= self.files_per_message or group_size + attachment.size > upload_limit
+                          or group_memory + memory > self.memory_budget):
+                groups.append(group)
+                group, group_size, group_memory = [], 0, 0
+            group.append(attachment)
+            group_size += attachment.size
+            group_memory += memory
+        if group:
+            groups.append(group)
+        return groups
+
+    async def download_group(self, group, previous_reservation, reservation):
+        """
+        Download a group of attachments concurrently. The group's memory is reserved all at once and after the
+        previous group's, so concurrent relays can never each hold part of what they need and wait on each other
+
+        Args:
+            group (List[discord.Attachment]): upload group
+            previous_reservation (asyncio.Event): set once the previous group reserved its memory, None for the first group
+            reservation (asyncio.Event): set once this group reserved its memory
+
+        Returns:
+            Tuple(List[discord.File], int, List[discord.Attachment]): (files, reserved bytes to release, failed attachments)
+        """
+        memory = sum(attachment.size for attachment in group if attachment.size <= self.spool_threshold)
+        if previous_reservation is not None:
+            await previous_reservation.wait()
+        reserved = await self.budget.acquire(memory)
+        reservation.set()
+        try:
+            results = await asyncio.gather(*[self.download_file(attachment) for attachment in group], return_exceptions=True)
+        except asyncio.CancelledError:
+            await self.budget.release(reserved)
+            raise
+        files, failed = [], []
+        for attachment, result in zip(group, results):
+            if isinstance(result, Exception):
+                self.bot.log(2, "Could not download attachment {}: {!r}", attachment.filename, result)
+                failed.append(attachment)
+            else:
+                files.append(result)
+        return files, reserved, failed
+
+    async def download_file(self, attachment):
+        """
+        Download an attachment into memory, or into a temp file if it's large
+
+        Args:
+            attachment (discord.Attachment): attachment
+
+        Returns:
+            discord.File: file ready to upload, its buffer must be closed after uploading
+        """
+        fp = io.BytesIO() if attachment.size <= self.spool_threshold else tempfile.TemporaryFile()
+        try:
+            await self.download(attachment, fp)
+        except BaseException:
+            fp.close()
+            raise
+        fp.seek(0)
+        return discord.File(fp, filename=attachment.filename)
+
+    async def download(self, attachment, fp):
+        """
+        Stream an attachment from the CDN into a file object, chunk by chunk
+
+        Args:
+            attachment (discord.Attachment): attachment
+            fp (io.IOBase): writable file object
+        """
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        async with self.session.get(attachment.url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                fp.write(chunk)
+
+    async def discard(self, files, reserved):
+        """ Close downloaded files and give their memory back to the budget """
+        for file in files:
+            file.close()
+            file.fp.close()
+        await self.budget.release(reserved)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
@@ -0,0 +1,66 @@
+# Built-in imports
+import asyncio
+
+
+class ChannelCache:
+    """ Resolves channels by id, from the gateway cache first, then from a single REST fetch shared by concurrent callers """
+
+    def __init__(self, bot):
+        """
+        Initialize an empty channel cache, owned by the bot
+
+        Args:
+            bot (BotClient): bot instance
+        """
+        self.bot = bot
+        # Channels we had to fetch over REST, {channel id => channel}
+        self.fetched = {}
+        # Fetches in flight, {channel id => task}, concurrent callers await the same one
+        self.fetches = {}
+
+    async def get(self, channel_id):
+        """
+        Resolve a channel, only hits the REST API when the channel isn't cached anywhere
+
+        Args:
+            channel_id (int): channel id
+
+        Returns:
+            discord.abc.GuildChannel or discord.abc.PrivateChannel: channel
+
+        Raises:
+            discord.HTTPException: fetching the channel failed, the failure is not cached
+        """
+        # Gateway cache, kept up to date by Discord events
+        channel = self.bot.get_channel(channel_id)
+        if channel is not None:
+            return channel
+        channel = self.fetched.get(channel_id)
+        if channel is not None:
+            return channel
+
+        fetch = self.fetches.get(channel_id)
+        if fetch is None:
+            fetch = self.fetches[channel_id] = asyncio.ensure_future(self.fetch(channel_id))
+        # Shielded so a cancelled caller doesn't cancel the fetch for everyone else
+        return await asyncio.shield(fetch)
+
+    async def fetch(self, channel_id):
+        try:
+            channel = await self.bot.fetch_channel(channel_id)
+        finally:
+            del self.fetches[channel_id]
+        self.fetched[channel_id] = channel
+        return channel
+
+    def invalidate(self, channel_id):
+        """
+        Forget a fetched channel, called when it's updated or deleted
+
+        Args:
+            channel_id (int): channel id
+        """
+        self.fetched.pop(channel_id, None)
+
+    def __len__(self):
+        return len(self.fetched)
@@ -1,9 +1,15 @@
 # Built-in imports
+import asyncio
+import datetime
 
 # Project imports
 from src.data import Color, Config, Emoji
 from src.nlp import PrimitiveModel
+from src.nlp.InferenceBatcher import InferenceBatcher
+from src.utils.RateLimiter import RateLimiter
 from src.utils.ReactionHandler import ReactionHandler
+from src.utils.SendScheduler import PRIORITY_CHAT
+from src.utils.TaskScheduler import Interval
 
 # External imports
 import discord
@@ -20,8 +26,23 @@ class ChatHandler:
             bot (BotClient): bot instance
         """
         self.bot = bot
-
-        self.initialize_nlp()
+        # Runs predictions off the event loop, in micro-batches
+        self.batcher = InferenceBatcher(bot)
+        # Flood protection, spam bursts are dropped before they reach the model
+        self.rate_limiters = []
+        if Config.NLP_USER_RATE_LIMIT is not None:
+            self.rate_limiters.append(RateLimiter(*Config.NLP_USER_RATE_LIMIT, scope="user"))
+        if Config.NLP_CHANNEL_RATE_LIMIT is not None:
+            self.rate_limiters.append(RateLimiter(*Config.NLP_CHANNEL_RATE_LIMIT, scope="channel"))
+
+        # NLP is initialized in the background by warm_up, the bot starts it when connecting
+        # Other bot processes of a sharded bot may retrain the model, pick up what they save
+        if Config.NLP_MODEL_WATCH_INTERVAL is not None:
+            bot.task_scheduler.add("nlp_model_watch", self.check_saved_model, Interval(Config.NLP_MODEL_WATCH_INTERVAL))
+
+    async def close(self):
+        """ Stop answering, called when the bot closes """
+        await self.batcher.close()
 
     async def on_message(self, author, message, channel, guild):
         """
@@ -33,35 +54,73 @@ class ChatHandler:
             channel (discord.TextChannel): text channel that the message is sent in
             guild (discord.Guild): guild that the message is sent in
         """
+        # Stay silent when flooded, answering would only feed the spam.
+        # Peek at every limiter first, a message one of them drops doesn't use up the others' allowance
+        if any(rate_limiter.check(author, channel, guild, count=False) for rate_limiter in self.rate_limiters):
+            self.bot.metrics.increment("rate_limited_total", handler="chat")
+            return
+        for rate_limiter in self.rate_limiters:
+            rate_limiter.check(author, channel, guild)
 
         raw_message = message.content
-        response, confidence, results = PrimitiveModel.predict(raw_message)
+        with self.bot.metrics.timer("stage_duration_seconds", stage="nlp_predict"):
+            response, confidence, results = await self.batcher.predict(raw_message)
 
         # If bot is not confident on the response, don't respond
         if confidence < Config.NLP_CONFIDENCE_THRESHOLD:
+            self.bot.metrics.increment("nlp_low_confidence_total")
             return
 
-        # Send response message
-        result_message = await channel.send(response, reference=message, mention_author=False)
-        await result_message.add_reaction(Emoji.MAGNIFYING_GLASS)
+        # Send response message, it is dropped if the question is too old by the time it would be sent
+        created_at = message.created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+        result_message = await self.bot.reply(message, content=response, priority=PRIORITY_CHAT, created_at=created_at)
+        if result_message is None:
+            return
+        await self.bot.react(result_message, Emoji.MAGNIFYING_GLASS)
 
         async def on_react(target_user, user, emote, message, channel, guild):
             # Confirm emote
             if emote != Emoji.MAGNIFYING_GLASS:
                 return
-            await result_message.edit(embed=self.get_nlp_results_embedded(results), mention_author=False)
+            await self.bot.edit(result_message, priority=PRIORITY_CHAT, embed=self.get_nlp_results_embedded(results), mention_author=False)
 
         reaction_handler = ReactionHandler(author, result_message, [Emoji.MAGNIFYING_GLASS], on_react)
         self.bot.register_reaction_handler(reaction_handler)
 
+    async def warm_up(self):
+        """ Initialize NLP on the inference worker thread, updates the bot's NLP readiness state """
+        self.bot.nlp_state = "warming"
+        try:
+            await asyncio.get_event_loop().run_in_executor(self.batcher.executor, self.initialize_nlp)
+        except Exception as e:
+            self.bot.nlp_state = "failed"
+            self.bot.nlp_error = repr(e)
+            self.bot.log(3, "NLP warm-up failed: {!r}", e)
+            return
+        self.bot.nlp_state = "ready"
+
     def initialize_nlp(self):
-        self.bot.log(1, "Loading NLP data... ", print_footer=False)
-        PrimitiveModel.load_or_generate_data(force_generate=True)
-        self.bot.log(1, "OK!", print_header=False)
+        # Bot processes starting together train once, the others then load what the first one saved
+        with PrimitiveModel.artifacts_lock():
+            # Skip retraining when the saved model was built from the current intents and hyperparameters
+            if PrimitiveModel.load_cached():
+                self.bot.log(1, "Loaded cached NLP data and model! Model is now ready to be used!")
+                return
+
+            self.bot.log(1, "Loading NLP data...")
+            PrimitiveModel.load_or_generate_data(force_generate=True)
+            self.bot.log(1, "NLP data loaded!")
 
-        self.bot.log(1, "Training model...")
-        PrimitiveModel.create_and_train_model()
-        self.bot.log(1, "Training complete! Model is now ready to be used!")
+            self.bot.log(1, "Training model...")
+            PrimitiveModel.create_and_train_model()
+            self.bot.log(1, "Training complete! Model is now ready to be used!")
+
+    async def check_saved_model(self):
+        """ Load the saved model if another bot process saved a newer one, repeating task """
+        if not self.bot.nlp_ready:
+            return
+        if await asyncio.get_event_loop().run_in_executor(None, PrimitiveModel.reload_if_changed):
+            self.bot.log(1, "Loaded the NLP model saved by another process!")
 
     @staticmethod
     def get_nlp_results_embedded(results):
@@ -1,5 +1,6 @@
 # Project imports
-from src.data import Color, Config
+from src.data import Color, Config, Emoji
+from src.utils.RateLimiter import RateLimiter
 
 # External imports
 import discord
@@ -8,7 +9,7 @@ import discord
 class CommandHandler:
     """ Command handler superclass, each specific command handler should extend this class """
 
-    def __init__(self, bot, command, aliases, description, usage, example):
+    def __init__(self, bot, command, aliases, description, usage, example, rate_limiter=None):
         """
         Initialize a command handler (should be overridden by each command)
 
@@ -19,6 +20,7 @@ class CommandHandler:
             description (str): short command description
             usage (str): command usage template
             example (str): command usage demonstration
+            rate_limiter (RateLimiter): flood protection checked by the bot before dispatching, defaults to COMMAND_RATE_LIMIT per user
         """
         self.bot = bot
         self.command = command
@@ -28,6 +30,10 @@ class CommandHandler:
         self.usage = usage
         self.example = example
 
+        if rate_limiter is None and Config.COMMAND_RATE_LIMIT is not None:
+            rate_limiter = RateLimiter(*Config.COMMAND_RATE_LIMIT)
+        self.rate_limiter = rate_limiter
+
     async def on_command(self, author, command, args, message, channel, guild):
         """
         Executes the command, should be overridden in the subclass
@@ -45,6 +51,19 @@ class CommandHandler:
         """
         return False
 
+    async def on_rate_limited(self, author, retry_after, message, channel, guild):
+        """
+        Called instead of on_command when the author is sending this command too fast, can be overridden in the subclass
+
+        Args:
+            author (discord.Member): command sender
+            retry_after (float): seconds until the command would be accepted again
+            message (discord.Message): Discord message object
+            channel (discord.TextChannel): text channel that the message is sent in
+            guild (discord.Guild): guild that the message is sent in
+        """
+        await self.bot.react(message, Emoji.HOUR_GLASS)
+
     def get_help_embedded(self):
         """
         Generates an embedded help message for this command
@@ -0,0 +1,100 @@
+# Built-in imports
+import heapq
+import itertools
+import time
+
+
+class ExpiryScheduler:
+    """ Min-heap of reaction handler deadlines, fires on_timeout on the bot's event loop as soon as a handler expires """
+
+    def __init__(self, bot):
+        """
+        Initialize an expiry scheduler, owned by the bot
+
+        Args:
+            bot (BotClient): bot instance, its event loop runs the timer
+        """
+        self.bot = bot
+
+        # Heap of (expire time, sequence, reaction handler), sequence breaks ties between equal deadlines
+        self.heap = []
+        self.sequence = itertools.count()
+        # Handlers that are still waiting for their deadline, anything else in the heap is stale
+        self.pending = set()
+
+        # The single armed timer, always set to the earliest pending deadline
+        self.timer = None
+        self.timer_deadline = None
+
+    def schedule(self, handler):
+        """
+        Start tracking the deadline of a reaction handler
+
+        Args:
+            handler (ReactionHandler): reaction handler to expire
+        """
+        self.pending.add(handler)
+        heapq.heappush(self.heap, (handler.expire_time, next(self.sequence), handler))
+        # Only re-arm if this deadline is earlier than the one we are already waiting for
+        if self.timer_deadline is None or handler.expire_time < self.timer_deadline:
+            self.arm()
+
+    def discard(self, handler):
+        """
+        Stop tracking a reaction handler (reacted to or unregistered), does nothing if it is not tracked
+
+        Args:
+            handler (ReactionHandler): reaction handler
+        """
+        self.pending.discard(handler)
+        # Rebuild the heap once stale entries outnumber live ones, keeps memory bounded by the live handlers
+        if len(self.heap) > 2 * len(self.pending) + 16:
+            self.heap = [entry for entry in self.heap if entry[2] in self.pending]
+            heapq.heapify(self.heap)
+
+    def arm(self):
+        """ (Re-)arm the timer for the earliest pending deadline """
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = None
+        self.timer_deadline = None
+
+        # Drop stale entries sitting at the top of the heap
+        while self.heap and self.heap[0][2] not in self.pending:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return
+
+        self.timer_deadline = self.heap[0][0]
+        self.timer = self.bot.loop.call_later(max(0.0, self.timer_deadline - time.time()), self.on_timer)
+
+    def on_timer(self):
+        """ Called by the event loop when the earliest deadline is reached """
+        self.timer = None
+        self.timer_deadline = None
+
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            _, _, handler = heapq.heappop(self.heap)
+            if handler not in self.pending:
+                continue
+            # Free the handler right away, then fire its callback
+            self.bot.unregister_reaction_handler(handler)
+            self.bot.loop.create_task(self.fire_timeout(handler))
+
+        self.arm()
+
+    async def fire_timeout(self, handler):
+        """
+        Fire on_timeout of an expired reaction handler, errors are logged instead of killing the timer
+
+        Args:
+            handler (ReactionHandler): expired reaction handler
+        """
+        try:
+            await handler.on_timeout()
+        except Exception as e:
+            self.bot.log(3, "Timeout callback of {} failed: {!r}", handler, e)
+
+    def __len__(self):
+        return len(self.pending)
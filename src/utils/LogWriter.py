@@ -0,0 +1,142 @@
+# Built-in imports
+import atexit
+import json
+import queue
+import sys
+import threading
+import time
+
+# Project imports
+from src.data import Config
+from src.utils import TimeUtil
+
+
+class LogWriter:
+    """ Bounded log queue drained by a background thread, so a slow stdout never stalls the event loop """
+
+    def __init__(self, max_size=Config.LOG_QUEUE_SIZE, output_format=Config.LOG_FORMAT):
+        """
+        Initialize a log writer, its thread starts with the first record
+
+        Args:
+            max_size (int): maximum number of queued records, new records are dropped when it's full
+            output_format (str): any of {"json", "text"}, "json" writes one JSON object per line
+        """
+        self.queue = queue.Queue(max_size)
+        self.output_format = output_format
+        self.thread = None
+        self.start_lock = threading.Lock()
+
+        # Records lost to a full queue, and how many of them were already reported in the log
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.dropped_lock = threading.Lock()
+
+    def submit(self, level, message, args, fields):
+        """
+        Queue a record without blocking, formatting is left to the writer thread
+
+        Args:
+            level (int): log severity (see LOG_LEVELS in Config.py)
+            message (str): message, or str.format template when there are args
+            args (Tuple[Any, ...]): template arguments
+            fields (Dict[str, Any]): extra structured fields
+        """
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait((time.time(), level, message, args, fields))
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+    def start(self):
+        with self.start_lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+
+    def run(self):
+        """ Writer thread, writes whatever is queued in one go and flushes once per batch """
+        while True:
+            records = [self.queue.get()]
+            while len(records) < 256:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            closing = None in records
+            # Nothing may escape: a dead writer thread would silently swallow every record after it
+            try:
+                self.write(records)
+            except Exception as e:
+                self.write_lines([f"[ERROR] {TimeUtil.format_timestamp(time.time())} >> Log writer failed on a batch: {e!r}\n"])
+            if closing:
+                return
+
+    def write(self, records):
+        """
+        Format and write a batch of records, a record that can't be formatted is written as-is instead
+
+        Args:
+            records (List[Tuple]): queued records, None entries are skipped
+        """
+        lines = []
+        for record in records:
+            if record is None:
+                continue
+            try:
+                lines.append(self.format(*record))
+            except Exception as e:
+                lines.append(f"[ERROR] {TimeUtil.format_timestamp(record[0])} >> Unformattable log record {record[1:]!r}: {e!r}\n")
+        if self.dropped != self.reported_dropped:
+            dropped, self.reported_dropped = self.dropped - self.reported_dropped, self.dropped
+            lines.append(self.format(time.time(), 2, "{} log record(s) dropped, the log queue was full", (dropped,), {}))
+        self.write_lines(lines)
+
+    @staticmethod
+    def write_lines(lines):
+        try:
+            stream = sys.stdout
+            stream.write("".join(lines))
+            stream.flush()
+        except (OSError, ValueError):
+            # Nowhere to log that logging failed
+            pass
+
+    def format(self, timestamp, level, message, args, fields):
+        """
+        Format a record as a line
+
+        Returns:
+            str: formatted line, newline included
+        """
+        if args:
+            try:
+                message = message.format(*args)
+            except (IndexError, KeyError, ValueError):
+                message = f"{message} {args!r}"
+        if self.output_format == "json":
+            record = {"time": timestamp, "level": Config.LOG_LEVELS[level], "message": message}
+            # Fields don't overwrite the record's own keys, e.g. a "message" field is written as "field_message"
+            record.update((f"field_{name}" if name in record else name, value) for name, value in fields.items())
+            return json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        extra = "".join(f" {name}={value}" for name, value in fields.items())
+        return f"[{Config.LOG_LEVELS[level]}] {TimeUtil.format_timestamp(timestamp)} >> {message}{extra}\n"
+
+    def close(self, timeout=2):
+        """ Write out whatever is still queued, called at exit """
+        if self.thread is None or not self.thread.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
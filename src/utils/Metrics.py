@@ -0,0 +1,280 @@
+# Built-in imports
+import asyncio
+import bisect
+import contextlib
+import os
+import time
+
+# Project imports
+from src.data import Config
+
+# Histogram bucket upper bounds (seconds), from sub-millisecond dispatch to slow uploads and training
+BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# Metric name prefix in the Prometheus output
+PREFIX = "discord_bot_"
+
+# Help text of each metric in the Prometheus output
+DESCRIPTIONS = {
+    "command_duration_seconds": "Time spent in command handlers",
+    "stage_duration_seconds": "Time spent in each processing stage (chat, nlp_predict, nlp_batch, move_message, reaction)",
+    "event_loop_lag_seconds": "How late the event loop woke up a sleeping task",
+    "unknown_commands_total": "Messages with the command prefix but no matching command",
+    "rate_limited_total": "Commands and chat messages ignored by flood protection",
+    "send_wait_seconds": "Time outbound requests spent queued, by priority",
+    "sends_dropped_total": "Outbound requests dropped because they were too late, by priority",
+    "sends_coalesced_total": "Outbound requests replaced by a newer one while still queued",
+    "send_queue_depth": "Outbound requests queued, all channels together",
+    "task_lateness_seconds": "How late repeating task runs were due, by task",
+    "task_duration_seconds": "Time spent in repeating task runs, by task",
+    "tasks_skipped_total": "Repeating task runs skipped, by task and reason (late, overlap, missed)",
+    "tasks_failed_total": "Repeating task runs that raised, by task",
+    "scheduled_tasks": "Registered repeating tasks",
+    "nlp_low_confidence_total": "Chat messages left unanswered because the model wasn't confident enough",
+    "reaction_handlers": "Messages with registered reaction handlers",
+    "reaction_expiry_pending": "Reaction handlers waiting for their expiry",
+    "event_loop_last_lag_seconds": "Event loop lag measured by the latest probe",
+    "nlp_queue_depth": "Chat messages waiting for an inference batch",
+    "uptime_seconds": "Seconds since the bot started",
+    "log_queue_depth": "Log records waiting for the writer thread",
+    "log_records_dropped": "Log records dropped because the log queue was full",
+}
+
+
+class Histogram:
+    """ Fixed-bucket latency histogram, cheap enough to observe on every event """
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        Initialize an empty histogram
+
+        Args:
+            buckets (List[float]): sorted bucket upper bounds, an implicit +Inf bucket is added
+        """
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimate a quantile by interpolating inside its bucket, like Prometheus' histogram_quantile
+
+        Args:
+            q (float): quantile, range=[0, 1]
+
+        Returns:
+            float: estimated value, 0 if nothing was observed
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+
+class Metrics:
+    """ In-process metrics of the bot: latency histograms, counters and gauges, exported in the Prometheus text format """
+
+    def __init__(self, bot):
+        """
+        Initialize the metrics registry, owned by the bot
+
+        Args:
+            bot (BotClient): bot instance
+        """
+        self.bot = bot
+        self.started_at = time.time()
+
+        # {metric name => {labels (tuple of (name, value) pairs) => Histogram or counter value}}
+        self.histograms = {}
+        self.counters = {}
+
+        # Gauges are read when exporting, {metric name => function returning the current value}
+        self.gauges = {
+            "reaction_handlers": lambda: len(self.bot.reaction_handlers),
+            "reaction_expiry_pending": lambda: len(self.bot.expiry_scheduler),
+            "event_loop_last_lag_seconds": lambda: self.last_loop_lag,
+            "send_queue_depth": lambda: len(self.bot.send_scheduler),
+            "scheduled_tasks": lambda: len(self.bot.task_scheduler),
+            "nlp_queue_depth": lambda: self.bot.chat_handler.batcher.queue_depth if self.bot.chat_handler is not None else 0,
+            "uptime_seconds": lambda: time.time() - self.started_at,
+            "log_queue_depth": lambda: self.bot.log_writer.queue_depth,
+            "log_records_dropped": lambda: self.bot.log_writer.dropped,
+        }
+        self.last_loop_lag = 0.0
+
+        # Background tasks, started with the bot
+        self.tasks = []
+
+    def observe(self, name, seconds, **labels):
+        """
+        Record a duration in a histogram
+
+        Args:
+            name (str): metric name, e.g. "command_duration_seconds"
+            seconds (float): observed duration
+            **labels (str): metric labels, e.g. command="help"
+        """
+        key = tuple(sorted(labels.items()))
+        family = self.histograms.setdefault(name, {})
+        histogram = family.get(key)
+        if histogram is None:
+            histogram = family[key] = Histogram()
+        histogram.observe(seconds)
+
+    def increment(self, name, amount=1, **labels):
+        """
+        Increase a counter
+
+        Args:
+            name (str): metric name, e.g. "unknown_commands_total"
+            amount (int): how much to add
+            **labels (str): metric labels
+        """
+        key = tuple(sorted(labels.items()))
+        family = self.counters.setdefault(name, {})
+        family[key] = family.get(key, 0) + amount
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """
+        Time the body of a with statement (awaits included) into a histogram, e.g.
+            with bot.metrics.timer("stage_duration_seconds", stage="move_message"):
+                await MoveMessageUtil.move_message(bot, message)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get_counter(self, name, **labels):
+        return self.counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def get_gauge(self, name):
+        return self.gauges[name]()
+
+    ######################
+    # BACKGROUND METHODS #
+    ######################
+
+    def start(self):
+        """ Start the loop lag probe and, if configured, the periodic textfile export on the bot's loop """
+        if self.tasks:
+            return
+        self.tasks.append(self.bot.loop.create_task(self.probe_loop_lag(Config.METRICS_LOOP_LAG_INTERVAL)))
+        if Config.METRICS_TEXTFILE:
+            self.tasks.append(self.bot.loop.create_task(self.export_periodically(Config.METRICS_TEXTFILE, Config.METRICS_EXPORT_INTERVAL)))
+
+    async def probe_loop_lag(self, interval):
+        """
+        Measure how late the event loop wakes up a sleeping task, a busy or blocked loop wakes it up late
+
+        Args:
+            interval (float): seconds between probes
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.last_loop_lag = max(0.0, loop.time() - start - interval)
+            self.observe("event_loop_lag_seconds", self.last_loop_lag)
+
+    async def export_periodically(self, path, interval):
+        """
+        Write the metrics to a Prometheus textfile every interval seconds
+
+        Args:
+            path (str): .prom file watched by node_exporter's textfile collector
+            interval (float): seconds between exports
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(interval)
+            # Render on the loop (metrics are only touched from here), write on a thread
+            text = self.render()
+            try:
+                await loop.run_in_executor(None, self.write_textfile, path, text)
+            except OSError as e:
+                self.bot.log(2, "Could not write metrics to {}: {!r}", path, e)
+
+    ##################
+    # EXPORT METHODS #
+    ##################
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format
+
+        Returns:
+            str: exposition text
+        """
+        lines = []
+        for name, getter in self.gauges.items():
+            self.render_header(lines, name, "gauge")
+            lines.append(f"{PREFIX}{name} {float(getter())}")
+        for name, family in self.counters.items():
+            self.render_header(lines, name, "counter")
+            for key, value in family.items():
+                lines.append(f"{PREFIX}{name}{format_labels(key)} {value}")
+        for name, family in self.histograms.items():
+            self.render_header(lines, name, "histogram")
+            for key, histogram in family.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{format_labels(key + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{format_labels(key)} {histogram.sum}")
+                lines.append(f"{PREFIX}{name}_count{format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def render_header(lines, name, kind):
+        if name in DESCRIPTIONS:
+            lines.append(f"# HELP {PREFIX}{name} {DESCRIPTIONS[name]}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    @staticmethod
+    def write_textfile(path, text):
+        """ Replace the textfile atomically, node_exporter must never read a half-written file """
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+
+def format_labels(key):
+    """
+    Format metric labels, e.g. (("command", "help"),) => {command="help"}
+
+    Args:
+        key (Tuple[Tuple[str, str], ...]): label pairs
+
+    Returns:
+        str: formatted labels, empty if there are none
+    """
+    if not key:
+        return ""
+    pairs = []
+    for name, value in key:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f"{name}=\"{value}\"")
+    return "{" + ",".join(pairs) + "}"
@@ -19,22 +19,17 @@ async def move_message(bot, message):
     # Generate message embedded
     embedded = generate_embedded(message.author, message.content, message.attachments)
     # Delete message
-    await message.delete()
+    await bot.send_scheduler.submit(message.channel, message.delete, route="delete")
     # Send confirm message
-    await message.channel.send(content=f"`{TimeUtil.formatted_now(include_date=True)}` >> Your report has been registered {Emoji.CHECK}")
-    # Fetch MOVE_TO channel
-    channel = await bot.fetch_channel(Config.MOVE_TO_CHANNEL)
+    content = f"`{TimeUtil.formatted_now(include_date=True)}` >> Your report has been registered {Emoji.CHECK}"
+    await bot.send_scheduler.submit(message.channel, lambda: message.channel.send(content=content))
+    # Resolve MOVE_TO channel
+    channel = await bot.channel_cache.get(Config.MOVE_TO_CHANNEL)
     # Send message to MOVE_TO channel
-    sent_message = await channel.send(embed=embedded)
-
-    # Scan for attachments
-    if not message.attachments:
-        return
+    sent_message = await bot.send_scheduler.submit(channel, lambda: channel.send(embed=embedded))
 
     # If there is attachments, send attachment messages
-    for attachment in message.attachments:
-        file = await attachment.to_file()
-        await sent_message.reply(content=f"Attached file `{attachment.filename}`:", file=file)
+    await bot.attachment_relay.relay(sent_message, message.attachments)
 
 
 def generate_embedded(author, raw_message, attachments, is_dm=False):
@@ -0,0 +1,106 @@
+# Built-in imports
+from collections import OrderedDict
+import itertools
+import time
+
+# Project imports
+from src.data import Config
+
+
+class RateLimiter:
+    """
+    GCRA rate limiter (a token bucket that stores a single timestamp per key): allows `events` events per `period`
+    seconds per key, all of them at once at best. Idle keys are evicted as we go, and the number of keys is capped
+    """
+
+    def __init__(self, events, period, scope="user", max_keys=Config.RATE_LIMITER_MAX_KEYS):
+        """
+        Initialize a rate limiter
+
+        Args:
+            events (int): events allowed per period, also the largest burst
+            period (float): period in seconds
+            scope (str): what is limited, any of {"user", "channel", "guild"}, DMs count as their own guild
+            max_keys (int): maximum number of tracked keys, the least recently seen ones are dropped beyond that
+        """
+        assert scope in ("user", "channel", "guild"), f"Unknown rate limit scope \"{scope}\""
+        self.events = events
+        self.period = period
+        self.scope = scope
+        self.max_keys = max_keys
+
+        # Time between two events at the sustained rate, and how far ahead of it a burst may go
+        self.interval = period / events
+        self.tolerance = self.interval * (events - 1)
+
+        # {key => theoretical arrival time of the next event}, least recently seen first
+        self.arrivals = OrderedDict()
+
+    def get_key(self, author, channel, guild):
+        """
+        Key of an event in this limiter's scope
+
+        Args:
+            author (discord.Member): event author
+            channel (discord.TextChannel): channel of the event
+            guild (discord.Guild): guild of the event, None in DMs
+
+        Returns:
+            int: key
+        """
+        if self.scope == "user":
+            return author.id
+        if self.scope == "channel" or guild is None:
+            return channel.id
+        return guild.id
+
+    def check(self, author, channel, guild, count=True):
+        """
+        Count an event in this limiter's scope
+
+        Args:
+            count (bool): whether an allowed event counts, False to only peek (e.g. before checking other limiters)
+
+        Returns:
+            float: 0 if the event is allowed, otherwise how many seconds until it would be
+        """
+        return self.hit(self.get_key(author, channel, guild), count=count)
+
+    def hit(self, key, now=None, count=True):
+        """
+        Count an event for a key, rejected events don't count
+
+        Args:
+            key (Hashable): rate-limited key, e.g. a user id
+            now (float): current time, defaults to time.monotonic()
+            count (bool): whether an allowed event counts, False to only peek
+
+        Returns:
+            float: 0 if the event is allowed, otherwise how many seconds until it would be
+        """
+        if now is None:
+            now = time.monotonic()
+        arrival = self.arrivals.get(key, now)
+        retry_after = arrival - self.tolerance - now
+        if retry_after > 0 or not count:
+            return max(retry_after, 0.0)
+
+        self.arrivals[key] = max(arrival, now) + self.interval
+        self.arrivals.move_to_end(key)
+        self.evict(now)
+        return 0.0
+
+    def evict(self, now):
+        """ Drop a couple of idle keys (a full bucket is the same as no entry), and enforce the key cap """
+        for key, arrival in list(itertools.islice(self.arrivals.items(), 2)):
+            if arrival > now:
+                break
+            del self.arrivals[key]
+        while len(self.arrivals) > self.max_keys:
+            self.arrivals.popitem(last=False)
+
+    def __len__(self):
+        return len(self.arrivals)
+
+    def __str__(self):
+        return f"Rate limiter ({self.events} per {self.period}s per {self.scope}, {len(self)} keys)"
@@ -0,0 +1,222 @@
+# Built-in imports
+import asyncio
+import heapq
+import itertools
+import time
+
+# Project imports
+from src.data import Config
+from src.utils.RateLimiter import RateLimiter
+
+# Send priorities, lower goes first
+PRIORITY_REPLY = 0  # command replies, moderation (report relays, deletes), never dropped
+PRIORITY_CHAT = 1  # NLP chat responses
+PRIORITY_REACTION = 2  # reactions
+PRIORITY_NAMES = ["reply", "chat", "reaction"]
+
+
+class SendJob:
+    """ One queued outbound request """
+
+    def __init__(self, action, priority, route, created_at, coalesce_key, future):
+        self.action = action
+        self.priority = priority
+        self.route = route
+        self.created_at = created_at
+        self.queued_at = time.time()
+        self.coalesce_key = coalesce_key
+        self.future = future
+
+
+class SendBucket:
+    """ Queue of one route bucket (channel and kind of request), lives while it has queued or in-flight requests """
+
+    def __init__(self, concurrency):
+        # Heap of (priority, sequence, job)
+        self.queue = []
+        # Worker task draining the queue, None while it's empty
+        self.worker = None
+        # In-flight requests, shared by every worker the bucket ever has so the limit holds across them
+        self.slots = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+
+    @property
+    def idle(self):
+        return not self.queue and self.worker is None and not self.in_flight
+
+
+class SendScheduler:
+    """
+    Outbound Discord requests go through one queue per route bucket (channel and kind of request), served by priority
+    and paced to Discord's limits, so a rate-limited bucket only holds up its own queue, and chat responses or
+    reactions that waited too long are dropped. When the bot-wide limit is reached, buckets get its next free slots
+    by priority
+    """
+
+    def __init__(self, bot, concurrency=Config.SEND_CONCURRENCY):
+        """
+        Initialize the send scheduler, owned by the bot
+
+        Args:
+            bot (BotClient): bot instance
+            concurrency (int): requests in flight per bucket at most, routes in SEND_ORDERED_ROUTES have one at a time
+        """
+        self.bot = bot
+        self.concurrency = concurrency
+        self.ordered_routes = set(Config.SEND_ORDERED_ROUTES)
+        # {(channel id, route) => send bucket}
+        self.buckets = {}
+        self.sequence = itertools.count()
+        # Queued jobs that later requests may replace, {(channel id, coalesce key) => job}
+        self.coalescable = {}
+
+        # Pacing: {route => per-channel limiter} and the bot-wide limiter
+        self.route_limiters = {route: RateLimiter(*limit, scope="channel") for route, limit in Config.SEND_ROUTE_LIMITS.items()}
+        self.global_limiter = RateLimiter(*Config.SEND_GLOBAL_LIMIT) if Config.SEND_GLOBAL_LIMIT is not None else None
+        # Buckets waiting for the bot-wide limit, heap of (priority, sequence, future), and the task granting them slots
+        self.global_waiters = []
+        self.global_pump = None
+
+    async def submit(self, channel, action, priority=PRIORITY_REPLY, route="send", created_at=None, coalesce_key=None):
+        """
+        Queue an outbound request and wait for it to be sent
+
+        Args:
+            channel (discord.abc.Messageable): channel the request is about
+            action (function): coroutine function making the request, e.g. lambda: channel.send(...)
+            priority (int): any of the PRIORITY_* constants
+            route (str): kind of request, any of SEND_ROUTE_LIMITS' keys
+            created_at (float): time.time() the request became relevant (e.g. when the message being answered was sent),
+                                requests below PRIORITY_REPLY older than SEND_STALE_AFTER are dropped, defaults to now
+            coalesce_key (Hashable): a newer request with the same key replaces this one while it's still queued
+
+        Returns:
+            Any: result of the action, None if the request was dropped
+        """
+        created_at = created_at if created_at is not None else time.time()
+        if coalesce_key is not None:
+            job = self.coalescable.get((channel.id, coalesce_key))
+            if job is not None:
+                # Still queued, the newest state is all that matters, sent as urgently and as fresh as the newest request
+                job.action = action
+                job.created_at = max(job.created_at, created_at)
+                if priority < job.priority:
+                    self.reprioritize(self.buckets[(channel.id, job.route)], job, priority)
+                self.bot.metrics.increment("sends_coalesced_total", route=route)
+                return await asyncio.shield(job.future)
+
+        bucket_key = (channel.id, route)
+        bucket = self.buckets.get(bucket_key)
+        if bucket is None:
+            bucket = self.buckets[bucket_key] = SendBucket(1 if route in self.ordered_routes else self.concurrency)
+        job = SendJob(action, priority, route, created_at, coalesce_key, asyncio.get_event_loop().create_future())
+        heapq.heappush(bucket.queue, (priority, next(self.sequence), job))
+        if coalesce_key is not None:
+            self.coalescable[(channel.id, coalesce_key)] = job
+        if bucket.worker is None:
+            bucket.worker = asyncio.ensure_future(self.run(bucket_key, bucket))
+        # Shielded so a cancelled caller doesn't cancel a request other callers may share
+        return await asyncio.shield(job.future)
+
+    @staticmethod
+    def reprioritize(bucket, job, priority):
+        """ Move a queued job up to a higher priority """
+        job.priority = priority
+        for i, (_, sequence, queued_job) in enumerate(bucket.queue):
+            if queued_job is job:
+                bucket.queue[i] = (priority, sequence, job)
+                heapq.heapify(bucket.queue)
+                return
+
+    async def run(self, bucket_key, bucket):
+        """ Worker of one bucket, starts requests in priority order and exits as soon as the queue is empty """
+        channel_id, route = bucket_key
+        queue = bucket.queue
+        try:
+            while queue:
+                await bucket.slots.acquire()
+                await self.pace(channel_id, route, queue)
+                # Pick the job only now, higher priority ones may have come in while waiting
+                _, _, job = heapq.heappop(queue)
+                if job.coalesce_key is not None:
+                    del self.coalescable[(channel_id, job.coalesce_key)]
+
+                now = time.time()
+                self.bot.metrics.observe("send_wait_seconds", now - job.queued_at, priority=PRIORITY_NAMES[job.priority])
+                if job.priority > PRIORITY_REPLY and now - job.created_at > Config.SEND_STALE_AFTER:
+                    self.bot.metrics.increment("sends_dropped_total", priority=PRIORITY_NAMES[job.priority])
+                    job.future.set_result(None)
+                    bucket.slots.release()
+                    continue
+                bucket.in_flight += 1
+                asyncio.ensure_future(self.execute(bucket_key, bucket, job))
+        finally:
+            bucket.worker = None
+            self.release_bucket(bucket_key, bucket)
+
+    async def execute(self, bucket_key, bucket, job):
+        try:
+            result = await job.action()
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            bucket.in_flight -= 1
+            bucket.slots.release()
+            self.release_bucket(bucket_key, bucket)
+
+    def release_bucket(self, bucket_key, bucket):
+        """ Forget a bucket once nothing is queued or in flight, a later request starts a new one """
+        if bucket.idle and self.buckets.get(bucket_key) is bucket:
+            del self.buckets[bucket_key]
+
+    async def pace(self, channel_id, route, queue):
+        """ Wait until the route bucket of the channel and the global bucket have room for the next request of a queue """
+        limiter = self.route_limiters.get(route)
+        while limiter is not None:
+            retry_after = limiter.hit(channel_id)
+            if not retry_after:
+                break
+            await asyncio.sleep(retry_after)
+        if self.global_limiter is not None:
+            await self.pace_global(queue)
+
+    async def pace_global(self, queue):
+        """ Wait for a slot of the bot-wide limit, buckets waiting for one are served by the priority of their next request """
+        if not self.global_waiters and not self.global_limiter.hit(None):
+            return
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.global_waiters, (queue[0][0], next(self.sequence), future))
+        if self.global_pump is None or self.global_pump.done():
+            self.global_pump = asyncio.ensure_future(self.pump_global())
+        await future
+
+    async def pump_global(self):
+        """ Grants slots of the bot-wide limit to waiting buckets as they free up, most urgent first """
+        while self.global_waiters:
+            retry_after = self.global_limiter.hit(None)
+            if retry_after:
+                await asyncio.sleep(retry_after)
+                continue
+            _, _, future = heapq.heappop(self.global_waiters)
+            # A waiter whose worker was cancelled doesn't need its slot anymore
+            if not future.done():
+                future.set_result(None)
+
+    def get_depth(self, channel_id):
+        """ Number of requests queued for a channel, all routes together """
+        return sum(len(bucket.queue) for (bucket_channel_id, _), bucket in self.buckets.items() if bucket_channel_id == channel_id)
+
+    def get_depths(self):
+        """ Queue depth of every channel with queued requests, {channel id => depth} """
+        depths = {}
+        for (channel_id, _), bucket in self.buckets.items():
+            if bucket.queue:
+                depths[channel_id] = depths.get(channel_id, 0) + len(bucket.queue)
+        return depths
+
+    def __len__(self):
+        return sum(len(bucket.queue) for bucket in self.buckets.values())
@@ -0,0 +1,81 @@
+# Built-in imports
+import asyncio
+import time
+
+# External imports
+import discord
+
+# Seconds between two gateway identifies of a bot token, Discord's limit for bots without larger identify concurrency
+IDENTIFY_INTERVAL = 5.0
+
+
+def split_shards(shard_count, processes):
+    """
+    Split shard ids into contiguous ranges, one per process, range sizes differ by one at most
+
+    Args:
+        shard_count (int): total number of shards
+        processes (int): number of bot processes, no more than shard_count are used
+
+    Returns:
+        List[List[int]]: shard ids of each process
+    """
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def fetch_recommended_shard_count(token):
+    """
+    Ask Discord how many shards the bot should run, blocks until it answers
+
+    Args:
+        token (str): bot token
+
+    Returns:
+        int: recommended shard count
+    """
+    async def fetch():
+        http = discord.http.HTTPClient()
+        try:
+            await http.static_login(token, bot=True)
+            shard_count, _ = await http.get_bot_gateway()
+        finally:
+            await http.close()
+        return shard_count
+
+    return asyncio.run(fetch())
+
+
+class IdentifyCoordinator:
+    """
+    Spaces out gateway identifies of every bot process sharing a token: each process paces its own shards,
+    but processes launching at the same time would identify together and get rejected by Discord
+    """
+
+    def __init__(self, context, interval=IDENTIFY_INTERVAL):
+        """
+        Initialize a coordinator in the launching process, then pass it to each bot process
+
+        Args:
+            context (multiprocessing.context.BaseContext): multiprocessing context the bot processes are started with
+            interval (float): seconds between two identifies
+        """
+        self.interval = interval
+        # Earliest time.time() the next identify may happen, reserved under the value's lock
+        self.next_identify = context.Value("d", 0.0)
+
+    async def wait(self):
+        """ Wait for this process' turn to identify a shard """
+        # The lock is only held to reserve a turn, never while sleeping
+        with self.next_identify.get_lock():
+            now = time.time()
+            turn = max(now, self.next_identify.value)
+            self.next_identify.value = turn + self.interval
+        await asyncio.sleep(turn - now)
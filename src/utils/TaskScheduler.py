@@ -0,0 +1,377 @@
+# Built-in imports
+import datetime
+import heapq
+import itertools
+import math
+import random
+import time
+
+# Project imports
+from src.data import Config
+from src.utils import TimeUtil
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    # Python < 3.9, only UTC and the host's local time are available
+    ZoneInfo = None
+
+# Longest single timer sleep (seconds), the timer runs on the monotonic clock so it re-checks the wall clock this often
+MAX_TIMER_DELAY = 300
+# Most missed runs counted after a long stall (e.g. a suspended host), beyond that the schedule just restarts from now
+MAX_MISSED_RUNS = 10000
+
+# Cron fields: (name, lowest value, highest value), weekday 0 and 7 are both Sunday
+CRON_FIELDS = [("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 7)]
+# Days searched for the next run of a cron trigger, enough for February 29th
+CRON_MAX_DAYS = 366 * 8
+
+
+def get_timezone(name):
+    """
+    Resolve a time zone name
+
+    Args:
+        name (str): IANA time zone name (e.g. "America/New_York"), "UTC", or None for the host's local time
+
+    Returns:
+        Optional[datetime.tzinfo]: time zone, None for the host's local time
+    """
+    if name is None:
+        return None
+    if name.upper() == "UTC":
+        return datetime.timezone.utc
+    if ZoneInfo is None:
+        raise ValueError(f"Time zone \"{name}\" needs the zoneinfo module (Python 3.9+), use \"UTC\" or None instead")
+    return ZoneInfo(name)
+
+
+class Interval:
+    """ Runs every `seconds` seconds, on a fixed grid so run times never drift with how long runs take """
+
+    def __init__(self, seconds, start=None):
+        """
+        Initialize an interval trigger
+
+        Args:
+            seconds (float): seconds between runs
+            start (float): time.time() the grid is aligned to (e.g. 0 to run on multiples of the interval),
+                           defaults to when the task is added, first run one interval later
+        """
+        assert seconds > 0, "Interval must be positive!"
+        self.seconds = seconds
+        self.start = start
+
+    def next_after(self, timestamp):
+        """
+        Next run time strictly after a time
+
+        Args:
+            timestamp (float): time.time() to start from
+
+        Returns:
+            float: next run time
+        """
+        if self.start is None:
+            self.start = timestamp
+        if timestamp < self.start:
+            return self.start
+        runs = math.floor((timestamp - self.start) / self.seconds) + 1
+        run = self.start + runs * self.seconds
+        # Float rounding can land back on the timestamp when it's a run time itself
+        if run <= timestamp:
+            run = self.start + (runs + 1) * self.seconds
+        return run
+
+    def __str__(self):
+        return f"every {self.seconds}s"
+
+
+class Cron:
+    """
+    Runs at wall-clock times matching a cron expression, in a given time zone. Like cron, when both day and weekday
+    are restricted a day matching either one runs. Times skipped by a DST change run at the shifted time, times
+    repeated by one only run once
+    """
+
+    def __init__(self, expression, timezone=Config.TASK_TIMEZONE):
+        """
+        Initialize a cron trigger
+
+        Args:
+            expression (str): "minute hour day month weekday", e.g. "0 0 * * *" for every midnight, fields take
+                              *, values, ranges (1-5), steps (*/15) and lists (1,15), weekday 0 is Sunday
+            timezone (str): IANA time zone name, "UTC", or None for the host's local time
+        """
+        self.expression = expression
+        self.timezone = get_timezone(timezone)
+
+        specs = expression.split()
+        if len(specs) != len(CRON_FIELDS):
+            raise ValueError(f"Cron expression \"{expression}\" must have {len(CRON_FIELDS)} fields")
+        fields = [parse_cron_field(spec, low, high) for spec, (_, low, high) in zip(specs, CRON_FIELDS)]
+        self.minutes, self.hours = sorted(fields[0]), sorted(fields[1])
+        self.days, self.months = fields[2], fields[3]
+        # Cron counts weekdays from Sunday, datetime from Monday
+        self.weekdays = {(weekday - 1) % 7 for weekday in fields[4]}
+        self.days_restricted = not specs[2].startswith("*")
+        self.weekdays_restricted = not specs[4].startswith("*")
+
+    def matches(self, date):
+        """ Whether a date has runs """
+        if date.month not in self.months:
+            return False
+        day_matches = date.day in self.days
+        weekday_matches = date.weekday() in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_matches or weekday_matches
+        return day_matches and weekday_matches
+
+    def next_after(self, timestamp):
+        """
+        Next run time strictly after a time
+
+        Args:
+            timestamp (float): time.time() to start from
+
+        Returns:
+            float: next run time
+        """
+        date = datetime.datetime.fromtimestamp(timestamp, self.timezone).date()
+        for _ in range(CRON_MAX_DAYS):
+            if self.matches(date):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        run = datetime.datetime.combine(date, datetime.time(hour, minute), tzinfo=self.timezone).timestamp()
+                        if run > timestamp:
+                            return run
+            date += datetime.timedelta(days=1)
+        raise ValueError(f"Cron expression \"{self.expression}\" never matches")
+
+    def __str__(self):
+        return f"cron \"{self.expression}\""
+
+
+def parse_cron_field(spec, low, high):
+    """
+    Parse one field of a cron expression
+
+    Args:
+        spec (str): field, e.g. "*/15" or "1-5,7"
+        low (int): lowest allowed value
+        high (int): highest allowed value
+
+    Returns:
+        Set[int]: matching values
+    """
+    values = set()
+    for part in spec.split(","):
+        part, _, step = part.partition("/")
+        try:
+            step = int(step) if step else 1
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = map(int, part.split("-"))
+            else:
+                start = int(part)
+                end = high if step != 1 else start
+        except ValueError:
+            raise ValueError(f"Invalid cron field \"{spec}\"") from None
+        if step < 1 or not low <= start <= end <= high:
+            raise ValueError(f"Invalid cron field \"{spec}\", values must be in [{low}, {high}]")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class ScheduledTask:
+    """ A coroutine function run on a trigger's schedule """
+
+    def __init__(self, name, function, trigger, jitter, misfire_grace):
+        self.name = name
+        self.function = function
+        self.trigger = trigger
+        self.jitter = jitter
+        self.misfire_grace = misfire_grace
+
+        # Next run time given by the trigger, and when it actually fires (jitter added)
+        self.scheduled_at = None
+        self.fire_at = None
+        # Run in progress, if any
+        self.running = None
+        self.cancelled = False
+
+    def __str__(self):
+        return f"Task \"{self.name}\" ({self.trigger})"
+
+
+class TaskScheduler:
+    """
+    Runs repeating tasks on the bot's event loop. Like the expiry scheduler, a single timer is armed for the earliest
+    run, so idle tasks cost nothing. Runs that start too late or would overlap the previous run are skipped and counted
+    """
+
+    def __init__(self, bot):
+        """
+        Initialize a task scheduler, owned by the bot, runs start once the bot starts
+
+        Args:
+            bot (BotClient): bot instance, its event loop runs the tasks
+        """
+        self.bot = bot
+        # Registered tasks, {name => scheduled task}
+        self.tasks = {}
+
+        # Heap of (fire time, sequence, scheduled task), entries whose fire time is no longer the task's are stale
+        self.heap = []
+        self.sequence = itertools.count()
+
+        self.started = False
+        self.timer = None
+        self.timer_deadline = None
+
+    def add(self, name, function, trigger, jitter=0, misfire_grace=Config.TASK_MISFIRE_GRACE):
+        """
+        Register a repeating task, e.g. add("reset", lambda: reset(bot), Cron("0 4 * * *"))
+
+        Args:
+            name (str): unique task name, also its metrics label
+            function (function): coroutine function to run, without arguments
+            trigger (Interval or Cron): when to run
+            jitter (float): up to this many random seconds are added to each run time, keep it well below the period
+            misfire_grace (float): runs starting more than this many seconds late are skipped
+
+        Returns:
+            ScheduledTask: the registered task
+        """
+        assert name not in self.tasks, f"Task \"{name}\" is already registered"
+        task = self.tasks[name] = ScheduledTask(name, function, trigger, jitter, misfire_grace)
+        self.schedule(task, trigger.next_after(time.time()))
+        self.bot.log(0, "{} registered, next run at {}", task, TimeUtil.format_timestamp(task.scheduled_at))
+        return task
+
+    def remove(self, name):
+        """
+        Unregister a task, a run in progress is left to finish
+
+        Args:
+            name (str): task name
+        """
+        task = self.tasks.pop(name)
+        task.cancelled = True
+
+    def start(self):
+        """ Arm the timer on the bot's loop, called when the bot starts """
+        if self.started:
+            return
+        self.started = True
+        self.arm()
+
+    def stop(self):
+        """ Disarm the timer, called when the bot closes """
+        self.started = False
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = None
+        self.timer_deadline = None
+
+    def schedule(self, task, scheduled_at):
+        """
+        Set the next run of a task
+
+        Args:
+            task (ScheduledTask): scheduled task
+            scheduled_at (float): run time given by its trigger
+        """
+        task.scheduled_at = scheduled_at
+        task.fire_at = scheduled_at + (random.uniform(0, task.jitter) if task.jitter else 0)
+        heapq.heappush(self.heap, (task.fire_at, next(self.sequence), task))
+        if self.started and (self.timer_deadline is None or task.fire_at < self.timer_deadline):
+            self.arm()
+
+    def arm(self):
+        """ (Re-)arm the timer for the earliest run """
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = None
+        self.timer_deadline = None
+
+        # Drop stale entries sitting at the top of the heap
+        while self.heap and self.is_stale(self.heap[0]):
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return
+
+        self.timer_deadline = self.heap[0][0]
+        self.timer = self.bot.loop.call_later(min(MAX_TIMER_DELAY, max(0.0, self.timer_deadline - time.time())), self.on_timer)
+
+    @staticmethod
+    def is_stale(entry):
+        fire_at, _, task = entry
+        return task.cancelled or task.fire_at != fire_at
+
+    def on_timer(self):
+        """ Called by the event loop when the earliest run is due, or to re-check the wall clock """
+        self.timer = None
+        self.timer_deadline = None
+
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            if not self.is_stale(entry):
+                self.fire(entry[2], now)
+
+        self.arm()
+
+    def fire(self, task, now):
+        """
+        Start a due run, unless it's too late or the previous run is still going, then schedule the next one
+
+        Args:
+            task (ScheduledTask): due task
+            now (float): current time.time()
+        """
+        lateness = now - task.fire_at
+        self.bot.metrics.observe("task_lateness_seconds", lateness, task=task.name)
+
+        # Runs that were due while we weren't looking (blocked loop, suspended host) are skipped, not caught up on
+        missed = 0
+        next_run = task.trigger.next_after(task.scheduled_at)
+        while next_run <= now and missed < MAX_MISSED_RUNS:
+            missed += 1
+            next_run = task.trigger.next_after(next_run)
+        if next_run <= now:
+            next_run = task.trigger.next_after(now)
+        if missed:
+            self.bot.metrics.increment("tasks_skipped_total", missed, task=task.name, reason="missed")
+            self.bot.log(2, "{} missed {} run(s)", task, missed)
+
+        if lateness > task.misfire_grace:
+            self.bot.metrics.increment("tasks_skipped_total", task=task.name, reason="late")
+            self.bot.log(2, "{} skipped a run, {:.1f}s late", task, lateness)
+        elif task.running is not None and not task.running.done():
+            self.bot.metrics.increment("tasks_skipped_total", task=task.name, reason="overlap")
+            self.bot.log(2, "{} skipped a run, the previous one is still going", task)
+        else:
+            task.running = self.bot.loop.create_task(self.run(task))
+
+        self.schedule(task, next_run)
+
+    async def run(self, task):
+        """
+        Run a task once, errors are logged instead of killing the schedule
+
+        Args:
+            task (ScheduledTask): task to run
+        """
+        start = time.perf_counter()
+        try:
+            await task.function()
+        except Exception as e:
+            self.bot.metrics.increment("tasks_failed_total", task=task.name)
+            self.bot.log(3, "{} failed: {!r}", task, e)
+        finally:
+            self.bot.metrics.observe("task_duration_seconds", time.perf_counter() - start, task=task.name)
+
+    def __len__(self):
+        return len(self.tasks)
@@ -13,6 +13,20 @@ def formatted_now(include_date=False):
     return f"{now.month}/{now.day}/{now.year} {now.hour:02d}:{now.minute:02d}:{now.second:02d}:{int(now.microsecond / 1000):03d}"
 
 
+def format_timestamp(timestamp):
+    """
+    Pretty-prints a UNIX timestamp the same way as formatted_now
+
+    Args:
+        timestamp (float): seconds since the epoch, e.g. time.time()
+
+    Returns:
+        str: formatted time string in "MM/DD/YYYY HH:MM:SS:_MS"
+    """
+    then = datetime.datetime.fromtimestamp(timestamp)
+    return f"{then.month}/{then.day}/{then.year} {then.hour:02d}:{then.minute:02d}:{then.second:02d}:{int(then.microsecond / 1000):03d}"
+
+
 def format_time(time_float, english=False):
     """
     Pretty-prints the time float
@@ -42,14 +56,17 @@ def format_time(time_float, english=False):
     return english[:-1]
 
 
-def get_now_weekday():
+def get_now_weekday(timezone=None):
     """
     Get current time's weekday
 
+    Args:
+        timezone (datetime.tzinfo): time zone of the weekday, None for the host's local time
+
     Returns:
         int: integer ranged [0, 6] representing current weekday (Monday=0, Sunday=6)
     """
-    return datetime.datetime.today().weekday()
+    return datetime.datetime.now(timezone).weekday()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+# Built-in imports
+
+# Project imports
+from src.nlp import PrimitiveModel
+from src.nlp.NumpyEngine import NumpyEngine
+
+# External imports
+import numpy as np
+import pytest
+
+# Largest allowed absolute difference between the two engines' confidences
+TOLERANCE = 1e-5
+
+
+@pytest.fixture(scope="module")
+def data():
+    """ Bag-of-words features of the corpus and PARITY_MESSAGES, with the dictionary the shipped model was trained on """
+    PrimitiveModel.generate_data(save_data=False)
+    messages = PrimitiveModel.get_parity_messages()
+    token_lists = [PrimitiveModel.preprocess(message) for message in messages]
+    return PrimitiveModel.vectorize_batch(token_lists, PrimitiveModel.pending.dictionary_index)
+
+
+@pytest.fixture(scope="module")
+def expected(data):
+    """ Confidences of the shipped checkpoint, run by tflearn itself """
+    # tflearn also fails to import (ImportError, not ModuleNotFoundError) on TensorFlow versions it doesn't support
+    pytest.importorskip("tflearn", exc_type=ImportError)
+    import tensorflow as tf
+
+    x = PrimitiveModel.densify(*data, PrimitiveModel.pending.input_width)
+    with tf.Graph().as_default():
+        dnn, width = PrimitiveModel.load_tflearn_model(PrimitiveModel.PATH_MODEL)
+        return np.array(dnn.predict(x[:, :width]))
+
+
+def test_shipped_weights_match_the_corpus(data):
+    engine = NumpyEngine.load(PrimitiveModel.PATH_WEIGHTS)
+    assert engine.input_width == PrimitiveModel.pending.input_width
+    assert engine.weights[-1].shape[1] == len(PrimitiveModel.pending.intents)
+
+
+def test_predict_matches_tflearn(data, expected):
+    engine = NumpyEngine.load(PrimitiveModel.PATH_WEIGHTS)
+    actual = engine.predict(PrimitiveModel.densify(*data, PrimitiveModel.pending.input_width))
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=TOLERANCE)
+
+
+def test_predict_sparse_matches_tflearn(data, expected):
+    engine = NumpyEngine.load(PrimitiveModel.PATH_WEIGHTS)
+    np.testing.assert_allclose(engine.predict_sparse(*data), expected, rtol=0, atol=TOLERANCE)
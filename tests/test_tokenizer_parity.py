@@ -0,0 +1,34 @@
+# Built-in imports
+
+# Project imports
+from src.nlp import PrimitiveModel
+
+# External imports
+import pytest
+
+# Chat input on top of the corpus and PARITY_MESSAGES: links, Discord mentions and emotes, contractions, emoji,
+# punctuation runs and other things chat is full of
+EDGE_CASES = [
+    "check https://example.com/a?b=1&c=2 now", "see www.example.org.", "mail me at a@b.com",
+    "hey <@123456789> and <@!42> in <#987>", "@everyone look", "<:pepe:12345>", "#1 fan", "C++ and C#",
+    "I'm sure you'd've", "they're sure we'll go", "isn't it, ain't it", "y'all", "Don't", "I'LL DO IT", "CAN'T WON'T",
+    "gonna gimme gotta lemme wanna", "i cannot", "rock 'n' roll", "'tis", "dogs' toys", "pizza's'",
+    "love it 😂😂 🍕!", "🍕🍕🍕", "(╯°□°)╯︵ ┻━┻", ":)", ":-D", "<3",
+    "wait... what?!?! ...", "!!!???", "hmm,,, ok;;", "--- stop ---", "x--y", "x...y", "a.b.c.",
+    "'quoted' words", "He said \"hi\"", "he said ''hi'' ok", "3.5% of $10.99", "12:30pm", "1,2,3", "v1.2.3",
+    "hello\nworld", "tab\there", "  spaces  ", ""
+]
+
+
+def get_messages():
+    return PrimitiveModel.get_parity_messages() + EDGE_CASES
+
+
+@pytest.mark.parametrize("message", get_messages())
+def test_regex_tokenizer_matches_nltk(message):
+    # nltk_tokenize is nltk.word_tokenize, sentences are split with a regex instead of Punkt if its data isn't installed
+    assert PrimitiveModel.tokenize(message, "regex") == PrimitiveModel.nltk_tokenize(message)
+
+
+def test_check_tokenizer_parity():
+    assert PrimitiveModel.check_tokenizer_parity(get_messages()) == []